@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+from step5_sync_to_safari import convert_to_html_format, write_html_file
+from generate_synthetic_profile import ProfileGenerator
+
+# 旧版实现（递归拼接字符串），仅用于对比耗时和内存
+def legacy_convert_to_html_format(bookmarks):
+    html = """<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<!-- This is an automatically generated file.
+     It will be read and overwritten.
+     DO NOT EDIT! -->
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<H1>Bookmarks</H1>
+<DL><p>
+"""
+
+    def process_bookmarks(items, indent="    "):
+        result = ""
+        for item in items:
+            if item.get("type") == "folder":
+                folder_name = item.get("name", "")
+                result += f"{indent}<DT><H3>{folder_name}</H3>\n{indent}<DL><p>\n"
+                if "children" in item and isinstance(item["children"], list):
+                    result += process_bookmarks(item["children"], indent + "    ")
+                result += f"{indent}</DL><p>\n"
+            elif item.get("type") == "url":
+                url_name = item.get("name", "")
+                url = item.get("url", "")
+                source = item.get("source", "")
+                add_date = int(datetime.now().timestamp())
+                result += f"{indent}<DT><A HREF=\"{url}\" ADD_DATE=\"{add_date}\" SOURCE=\"{source}\">{url_name}</A>\n"
+        return result
+
+    html += process_bookmarks(bookmarks)
+    html += "</DL><p>"
+    return html
+
+# 生成与convert_to_safari_format输出结构相同的书签列表
+def make_bookmarks(count, depth, fanout, seed=0):
+    generator = ProfileGenerator(seed, dup_rate=0.0, unicode_rate=0.3)
+
+    def convert(items):
+        result = []
+        for name, value in items:
+            if isinstance(value, list):
+                result.append({'type': 'folder', 'name': name, 'children': convert(value)})
+            else:
+                result.append({'type': 'url', 'name': name, 'url': value, 'source': 'Chrome'})
+        return result
+
+    return convert(generator.tree(count, depth, fanout))
+
+# 运行func并返回(耗时秒数, tracemalloc峰值字节数)
+def measure(func, trace_memory):
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak
+
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="对比流式HTML导出与旧版字符串拼接实现的耗时和峰值内存")
+    parser.add_argument('--size', type=int, default=200000, help="书签数量（默认: 200000）")
+    parser.add_argument('--depth', type=int, default=4, help="文件夹最大嵌套深度（默认: 4）")
+    parser.add_argument('--fanout', type=int, default=20, help="每个文件夹的子项数量（默认: 20）")
+    parser.add_argument('--no-memory', action='store_true', help="不测量峰值内存")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+    trace_memory = not args.no_memory
+
+    # 校验：不含需要转义的字符时，新旧实现除ADD_DATE外输出相同
+    sample = make_bookmarks(2000, args.depth, args.fanout, seed=1)
+    normalize = lambda text: re.sub(r'ADD_DATE="\d+"', 'ADD_DATE=""', text)
+    if normalize(convert_to_html_format(sample)) != normalize(legacy_convert_to_html_format(sample)):
+        print("错误: 新旧实现的输出不一致")
+        return 1
+
+    bookmarks = make_bookmarks(args.size, args.depth, args.fanout)
+    print(f"书签数量: {args.size}，嵌套深度: {args.depth}，每个文件夹子项数: {args.fanout}")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        legacy_file = os.path.join(work_dir, 'legacy.html')
+        streaming_file = os.path.join(work_dir, 'streaming.html')
+
+        def run_legacy():
+            content = legacy_convert_to_html_format(bookmarks)
+            with open(legacy_file, 'w', encoding='utf-8') as f:
+                f.write(content)
+
+        legacy_time, legacy_peak = measure(run_legacy, trace_memory)
+        streaming_time, streaming_peak = measure(lambda: write_html_file(bookmarks, streaming_file), trace_memory)
+        size = os.path.getsize(streaming_file)
+
+    print(f"{'实现':<10} {'耗时(秒)':>10} {'峰值内存(MB)':>14}")
+    for name, elapsed, peak in (('旧版', legacy_time, legacy_peak), ('流式', streaming_time, streaming_peak)):
+        peak_text = f"{peak / 1024 / 1024:14.1f}" if peak is not None else f"{'-':>14}"
+        print(f"{name:<10} {elapsed:10.3f} {peak_text}")
+    print(f"输出文件大小: {size / 1024 / 1024:.1f} MB")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import resource
+import tracemalloc
+import contextlib
+
+import step1_chrome_bookmarks_viewer_fixed as step1
+import step2_safari_bookmarks_viewer as step2
+import step3_merge_bookmarks as step3
+import step4_sync_to_chrome as step4
+import step5_sync_to_safari as step5
+import source_cache
+import three_way_merge
+import bookmark_index
+import run_pipeline
+from generate_synthetic_profile import generate_profiles
+
+# 统计书签列表中的节点数量（书签和文件夹）
+def count_nodes(bookmarks):
+    count = 0
+    stack = [bookmarks]
+    while stack:
+        for item in stack.pop():
+            count += 1
+            if item.get('type') == 'folder':
+                stack.append(item.get('children', []))
+    return count
+
+# 运行一次func，屏蔽各步骤的输出，返回(结果, 耗时秒数, 峰值内存字节数或None)
+def run_step(func, trace_memory=False):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            result = func()
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = None
+            if trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+    return result, elapsed, peak
+
+# 依次执行各个步骤，返回[(步骤名称, 处理的节点数, 耗时, 峰值内存)]
+# 每个步骤都使用自己的输入副本，步骤之间互不影响；写文件的步骤只写入work_dir
+def benchmark_steps(chrome_file, safari_file, work_dir, trace_memory=False):
+    results = []
+
+    def record(name, func, nodes=None):
+        result, elapsed, peak = run_step(func, trace_memory)
+        results.append((name, nodes if nodes is not None else count_nodes(result), elapsed, peak))
+        return result
+
+    chrome_bookmarks = record('step1 读取Chrome', lambda: step1.read_chrome_bookmarks(chrome_file))
+    safari_bookmarks = record('step2 读取Safari', lambda: step2.read_safari_bookmarks(safari_file))
+    input_nodes = count_nodes(chrome_bookmarks) + count_nodes(safari_bookmarks)
+
+    merged = record('step3 合并', lambda: step3.merge_bookmarks(chrome_bookmarks, safari_bookmarks), input_nodes)
+    merged_nodes = count_nodes(merged)
+    index_file = os.path.join(work_dir, 'bookmarks_index.sqlite3')
+    if os.path.exists(index_file):
+        os.remove(index_file)
+    record('step3 建立索引', lambda: bookmark_index.update_index(merged, index_file), merged_nodes)
+
+    chrome_format = record('step4 转换', lambda: step4.convert_to_chrome_format(merged), merged_nodes)
+    target_file = os.path.join(work_dir, 'Bookmarks.out')
+    shutil.copyfile(chrome_file, target_file)
+    record('step4 写入Chrome', lambda: step4.save_to_chrome_bookmarks(chrome_format, target_file, save_copy=False),
+           merged_nodes)
+
+    safari_target = os.path.join(work_dir, 'Bookmarks.plist.out')
+    shutil.copyfile(safari_file, safari_target)
+    record('step5 写入Safari', lambda: step5.save_to_safari_bookmarks(merged, safari_target), merged_nodes)
+
+    safari_format = record('step5 转换', lambda: step5.convert_to_safari_format(merged), merged_nodes)
+
+    html_file = os.path.join(work_dir, 'safari_bookmarks.html')
+    record('step5 生成HTML', lambda: step5.write_html_file(safari_format, html_file), merged_nodes)
+
+    # 完整流程：与run_pipeline.py相同的调用，书签文件使用副本，基线保存在work_dir中
+    pipeline_chrome = os.path.join(work_dir, 'Bookmarks.pipeline')
+    pipeline_safari = os.path.join(work_dir, 'Bookmarks.pipeline.plist')
+    shutil.copyfile(chrome_file, pipeline_chrome)
+    shutil.copyfile(safari_file, pipeline_safari)
+    record('完整流程', lambda: run_pipeline.run_pipeline(
+        chrome_path=pipeline_chrome, safari_path=pipeline_safari, close_browsers=False,
+        use_cache=False, full_merge=True), input_nodes)
+    return results
+
+# 打印一个规模的测试结果
+def print_results(label, results):
+    print(f"\n=== {label} ===")
+    print(f"{'步骤':<16} {'节点数':>10} {'耗时(秒)':>10} {'节点/秒':>12} {'峰值内存(MB)':>14}")
+    for name, nodes, elapsed, peak in results:
+        throughput = nodes / elapsed if elapsed > 0 else 0
+        peak_text = f"{peak / 1024 / 1024:14.1f}" if peak is not None else f"{'-':>14}"
+        print(f"{name:<16} {nodes:>10} {elapsed:10.3f} {throughput:12.0f} {peak_text}")
+
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="使用生成的书签文件测试各步骤和完整流程的耗时、吞吐量与峰值内存")
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help="每个浏览器的书签数量，逗号分隔（默认: 1000,10000,100000）")
+    parser.add_argument('--chrome-bookmarks', help="使用已有的Chrome书签文件，不生成测试数据")
+    parser.add_argument('--safari-bookmarks', help="使用已有的Safari书签文件，不生成测试数据")
+    parser.add_argument('--depth', type=int, default=4, help="生成数据的文件夹最大嵌套深度（默认: 4）")
+    parser.add_argument('--fanout', type=int, default=20, help="生成数据的每个文件夹子项数量（默认: 20）")
+    parser.add_argument('--dup-rate', type=float, default=0.05, help="生成数据的重复URL比例（默认: 0.05）")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子（默认: 0）")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="不单独测量峰值内存（tracemalloc会明显拖慢运行）")
+    parser.add_argument('--json', dest='json_file', help="把测试结果另存为JSON文件")
+    parser.add_argument('--keep', action='store_true', help="保留生成的测试数据和输出文件")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+    work_root = tempfile.mkdtemp(prefix='bookmarks_benchmark_')
+
+    # 基线和缓存写入临时目录，避免覆盖真实同步的状态
+    source_cache.CACHE_DIR = os.path.join(work_root, 'cache')
+    source_cache.STATE_FILE = os.path.join(source_cache.CACHE_DIR, 'state.json')
+    three_way_merge.BASE_FILE = os.path.join(source_cache.CACHE_DIR, 'base_snapshot.pickle')
+    bookmark_index.INDEX_FILE = os.path.join(source_cache.CACHE_DIR, 'bookmarks_index.sqlite3')
+
+    if args.chrome_bookmarks or args.safari_bookmarks:
+        if not (args.chrome_bookmarks and args.safari_bookmarks):
+            print("错误: --chrome-bookmarks和--safari-bookmarks需要同时指定")
+            return 1
+        profiles = [('已有书签文件', args.chrome_bookmarks, args.safari_bookmarks)]
+    else:
+        profiles = []
+        for size in (int(size) for size in args.sizes.split(',') if size):
+            profile_dir = os.path.join(work_root, f"profile_{size}")
+            print(f"正在生成 {size} 个书签的测试数据...")
+            chrome_file, safari_file = generate_profiles(
+                profile_dir, size=size, depth=args.depth, fanout=args.fanout,
+                dup_rate=args.dup_rate, seed=args.seed)
+            profiles.append((f"{size} 个书签", chrome_file, safari_file))
+
+    report = []
+    try:
+        for label, chrome_file, safari_file in profiles:
+            work_dir = tempfile.mkdtemp(dir=work_root)
+            results = benchmark_steps(chrome_file, safari_file, work_dir)
+            if not args.no_memory:
+                memory = benchmark_steps(chrome_file, safari_file, work_dir, trace_memory=True)
+                results = [(name, nodes, elapsed, peak)
+                           for (name, nodes, elapsed, _), (_, _, _, peak) in zip(results, memory)]
+            print_results(label, results)
+            report.append({
+                'profile': label,
+                'chrome_file_size': os.path.getsize(chrome_file),
+                'safari_file_size': os.path.getsize(safari_file),
+                'steps': [{'name': name, 'nodes': nodes, 'seconds': elapsed, 'peak_bytes': peak}
+                          for name, nodes, elapsed, peak in results],
+            })
+    finally:
+        if args.keep:
+            print(f"\n测试数据保存在: {work_root}")
+        else:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    # ru_maxrss在macOS上以字节为单位，在Linux上以KB为单位
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        max_rss *= 1024
+    print(f"\n进程最大常驻内存: {max_rss / 1024 / 1024:.1f} MB")
+
+    if args.json_file:
+        with open(args.json_file, 'w', encoding='utf-8') as f:
+            json.dump({'max_rss_bytes': max_rss, 'profiles': report}, f, ensure_ascii=False, indent=2)
+        print(f"测试结果已保存到: {args.json_file}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
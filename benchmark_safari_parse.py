@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import random
+import argparse
+
+from step2_safari_bookmarks_viewer import parse_safari_bookmarks
+
+# 旧版递归实现，仅用于对比耗时和校验结果
+def legacy_parse_safari_bookmarks(node, path=""):
+    results = []
+    skip_folders = ['com.apple.ReadingList', 'BookmarksMenu', 'BookmarksBar', 'Menu']
+
+    if 'Children' in node and isinstance(node['Children'], list):
+        folder_name = node.get('Title', 'Unnamed Folder')
+
+        flatten = folder_name in skip_folders or (node.get('WebBookmarkType') == 'WebBookmarkTypeList'
+                                                  and not node.get('Title'))
+        if flatten:
+            current_path = path
+        else:
+            current_path = f"{path}/{folder_name}" if path else folder_name
+            results.append({
+                'type': 'folder',
+                'name': folder_name,
+                'path': current_path,
+                'children': []
+            })
+
+        for child in node['Children']:
+            child_items = legacy_parse_safari_bookmarks(child, current_path)
+            if not flatten and child_items:
+                for item in results:
+                    if item['type'] == 'folder' and item['name'] == folder_name:
+                        item['children'].extend(child_items)
+                        break
+            else:
+                results.extend(child_items)
+
+    elif node.get('WebBookmarkType') == 'WebBookmarkTypeLeaf' and 'URLString' in node:
+        title = ''
+        if 'URIDictionary' in node and node['URIDictionary'] and 'title' in node['URIDictionary']:
+            title = node['URIDictionary']['title']
+        elif 'Title' in node:
+            title = node['Title']
+        if not title:
+            title = 'Unnamed Bookmark'
+        results.append({
+            'type': 'url',
+            'name': title,
+            'url': node.get('URLString', ''),
+            'path': path if path else "根目录"
+        })
+
+    return results
+
+# 生成一个书签叶子节点
+def make_leaf(i):
+    return {
+        'WebBookmarkType': 'WebBookmarkTypeLeaf',
+        'URLString': f"https://example{i % 997}.com/page/{i}",
+        'URIDictionary': {'title': f"书签 {i}"},
+    }
+
+# 生成Safari书签根结构：一个包含count个书签的平铺文件夹（类似"其他书签"）
+def make_flat_profile(count):
+    return {
+        'WebBookmarkType': 'WebBookmarkTypeList',
+        'Children': [
+            {'WebBookmarkType': 'WebBookmarkTypeList', 'Title': 'BookmarksBar', 'Children': []},
+            {
+                'WebBookmarkType': 'WebBookmarkTypeFolder',
+                'Title': 'Other Bookmarks',
+                'Children': [make_leaf(i) for i in range(count)],
+            },
+        ],
+    }
+
+# 生成随机嵌套的书签结构，包含同名的兄弟文件夹，用于校验新旧实现结果一致
+def make_nested_profile(count, seed=0):
+    rng = random.Random(seed)
+    root = {'WebBookmarkType': 'WebBookmarkTypeList', 'Children': []}
+    folders = [root]
+    for i in range(count):
+        parent = rng.choice(folders)
+        if rng.random() < 0.15:
+            folder_type = rng.choice(['WebBookmarkTypeList', 'WebBookmarkTypeFolder', 'WebBookmarkTypeFolder'])
+            folder = {'WebBookmarkType': folder_type, 'Title': f"文件夹 {i % 5}", 'Children': []}
+            parent['Children'].append(folder)
+            folders.append(folder)
+        else:
+            parent['Children'].append(make_leaf(i))
+    return root
+
+# 多次运行取最短耗时
+def measure(func, data, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="对比parse_safari_bookmarks新旧实现在平铺大文件夹上的耗时")
+    parser.add_argument('--sizes', default='12500,25000,50000,100000',
+                        help="平铺文件夹中的书签数量，逗号分隔（默认: 12500,25000,50000,100000）")
+    parser.add_argument('--repeat', type=int, default=3, help="每个规模重复运行的次数（默认: 3）")
+    parser.add_argument('--skip-legacy', action='store_true', help="不运行旧版实现")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+
+    # 校验新旧实现在嵌套结构上的结果一致
+    nested = make_nested_profile(5000)
+    if parse_safari_bookmarks(nested) != legacy_parse_safari_bookmarks(nested):
+        print("错误: 新旧实现的解析结果不一致")
+        return 1
+
+    print(f"{'书签数量':>10} {'新实现(秒)':>12} {'每条(微秒)':>12} {'旧实现(秒)':>12}")
+    for size in sizes:
+        data = make_flat_profile(size)
+        elapsed = measure(parse_safari_bookmarks, data, args.repeat)
+        legacy = None if args.skip_legacy else measure(legacy_parse_safari_bookmarks, data, args.repeat)
+        legacy_text = f"{legacy:12.4f}" if legacy is not None else f"{'-':>12}"
+        print(f"{size:>10} {elapsed:12.4f} {elapsed / size * 1e6:12.3f} {legacy_text}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import mmap
+import struct
+import operator
+import argparse
+import functools
+
+import instrumentation
+
+# 书签树的二进制快照格式（.bksnap），步骤之间传递书签时代替缩进的JSON文件：
+#   文件头 | 节点表 | 字符串偏移表 | 字符串区
+# 节点表是定长记录，按先序排列：类型、字段掩码、父节点、第一个子节点、下一个兄弟节点、深度，以及各字符串字段在字符串表中的编号；
+# 字符串去重后以UTF-8连续存放在字符串区。文件通过mmap只读打开，不需要解析，按需读取节点（NodeView），
+# 多个进程打开同一个快照时共享同一份页缓存
+MAGIC = b'BKSNAP\x00\x01'
+VERSION = 2
+SUFFIX = '.bksnap'
+
+# 文件头：魔数、版本、节点数、第一个顶层节点、字符串数、节点表/字符串偏移表/字符串区的偏移、字符串区长度
+HEADER = struct.Struct('<8sIIIIQQQQ')
+
+# 表示"没有"的编号（没有父节点、子节点、兄弟节点，或者没有该字段）
+NONE = 0xFFFFFFFF
+
+# 节点记录中按编号保存的字符串字段；sources列表以换行连接后保存
+STRING_FIELDS = ('type', 'name', 'url', 'path', 'id', 'guid', 'date_added', 'date_modified', 'source', 'original_path',
+                 'sources')
+
+# 节点记录：类型、标志、字段掩码（第i位表示有第i个字符串字段）、父节点、第一个子节点、下一个兄弟节点、深度，
+# 各字符串字段的编号，其他字段（JSON）的编号
+NODE = struct.Struct('<BBHIIIi' + 'I' * (len(STRING_FIELDS) + 1))
+FIELDS_START = 7
+EXTRA_FIELD = FIELDS_START + len(STRING_FIELDS)
+
+# 节点类型
+TYPE_FOLDER = 0
+TYPE_URL = 1
+TYPE_OTHER = 2
+TYPE_CODES = {'folder': TYPE_FOLDER, 'url': TYPE_URL}
+TYPE_NAMES = {TYPE_FOLDER: 'folder', TYPE_URL: 'url'}
+
+# 直接保存在节点记录中的字段，其余字段放进JSON编码的其他字段
+KNOWN_KEYS = frozenset(('depth', 'children') + STRING_FIELDS)
+
+# 标志位：有depth字段、有children字段
+FLAG_DEPTH = 1
+FLAG_CHILDREN = 2
+
+SOURCES_BIT = 1 << STRING_FIELDS.index('sources')
+SOURCES_FIELD = FIELDS_START + STRING_FIELDS.index('sources')
+
+# 把一个书签编码为节点记录（列表，子节点和兄弟节点之后再填）；不是字符串的字段放进JSON编码的其他字段
+def _encode_node(item, parent, string_id):
+    record = [TYPE_CODES.get(item.get('type'), TYPE_OTHER), 0, 0, parent, NONE, NONE, 0]
+    extra = {}
+    for bit, field in enumerate(STRING_FIELDS):
+        value = item.get(field)
+        if field == 'sources' and value is not None:
+            # 只有能无歧义还原的列表以换行连接保存（空字符串无法与空列表区分），其余放进JSON编码的其他字段
+            if isinstance(value, list) and all(isinstance(source, str) and source and '\n' not in source
+                                               for source in value):
+                value = '\n'.join(value)
+            else:
+                extra[field] = value
+                value = None
+        elif value is not None and not isinstance(value, str):
+            extra[field] = value
+            value = None
+        elif value is None and field in item:
+            extra[field] = None
+        if value is None:
+            record.append(NONE)
+        else:
+            record[2] |= 1 << bit
+            record.append(string_id(value))
+    depth = item.get('depth')
+    if isinstance(depth, int) and not isinstance(depth, bool) and -2 ** 31 <= depth < 2 ** 31:
+        record[1] |= FLAG_DEPTH
+        record[6] = depth
+    elif 'depth' in item:
+        extra['depth'] = depth
+    children = item.get('children')
+    if isinstance(children, list):
+        record[1] |= FLAG_CHILDREN
+    elif 'children' in item:
+        extra['children'] = children
+    for key, value in item.items():
+        if key not in KNOWN_KEYS:
+            extra[key] = value
+    record.append(string_id(json.dumps(extra, ensure_ascii=False)) if extra else NONE)
+    return record
+
+# 把书签树编码为二进制快照的字节
+@instrumentation.timed('binary_snapshot.encode')
+def encode(bookmarks):
+    strings = {}
+
+    def string_id(value):
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    # 先序遍历：节点紧跟在父节点之后，兄弟节点按原来的顺序；last_child记录每个父节点已写入的最后一个子节点
+    records = []
+    first_root = NONE
+    last_child = {}
+    stack = [(iter(bookmarks), NONE)]
+    while stack:
+        item = next(stack[-1][0], None)
+        if item is None:
+            stack.pop()
+            continue
+        parent = stack[-1][1]
+        index = len(records)
+        records.append(_encode_node(item, parent, string_id))
+        previous = last_child.get(parent)
+        if previous is not None:
+            records[previous][5] = index
+        elif parent == NONE:
+            first_root = index
+        else:
+            records[parent][4] = index
+        last_child[parent] = index
+        if records[index][1] & FLAG_CHILDREN:
+            stack.append((iter(item['children']), index))
+
+    # 字符串之间用\0分隔（不计入长度），读取全部字符串时可以一次解码再切分
+    encoded = [value.encode('utf-8', 'surrogatepass') + b'\0' for value in strings]
+    offsets = [0] * (len(encoded) + 1)
+    position = 0
+    for i, value in enumerate(encoded):
+        position += len(value)
+        offsets[i + 1] = position
+    if position >= 2 ** 32:
+        raise ValueError("字符串区超过4GB，无法写入书签快照")
+
+    node_offset = HEADER.size
+    string_offsets_offset = node_offset + NODE.size * len(records)
+    blob_offset = string_offsets_offset + 4 * len(offsets)
+    data = bytearray(blob_offset)
+    HEADER.pack_into(data, 0, MAGIC, VERSION, len(records), first_root, len(encoded),
+                     node_offset, string_offsets_offset, blob_offset, position)
+    for i, record in enumerate(records):
+        NODE.pack_into(data, node_offset + NODE.size * i, *record)
+    struct.pack_into(f'<{len(offsets)}I', data, string_offsets_offset, *offsets)
+    data += b''.join(encoded)
+    instrumentation.count('binary_snapshot.nodes_written', len(records))
+    return data
+
+# 把书签树写入二进制快照文件（先写临时文件再原子替换）
+def write_snapshot(bookmarks, path):
+    data = encode(bookmarks)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    instrumentation.count('binary_snapshot.bytes_written', len(data))
+    return path
+
+# 只读打开的二进制快照；节点按需读取，to_bookmarks()一次性转换为与JSON文件相同的书签列表
+class BinarySnapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        try:
+            (magic, version, self.node_count, self.first_root, self.string_count, self._node_offset,
+             string_offsets_offset, self._blob_offset, blob_size) = HEADER.unpack_from(self._view, 0)
+        except struct.error:
+            magic = version = None
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"不是书签快照文件或版本不支持: {path}")
+        self._offsets = self._view[string_offsets_offset:self._blob_offset].cast('I')
+        self._blob = self._view[self._blob_offset:self._blob_offset + blob_size]
+        self._strings = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # 关闭快照；还有NodeView引用内存时由垃圾回收关闭
+    def close(self):
+        for name in ('_offsets', '_blob', '_view'):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    # 按编号读取一个字符串
+    def string(self, index):
+        if index == NONE:
+            return None
+        if self._strings is not None:
+            return self._strings[index]
+        return str(self._blob[self._offsets[index]:self._offsets[index + 1] - 1], 'utf-8', 'surrogatepass')
+
+    # 读取一个节点的记录
+    def record(self, index):
+        return NODE.unpack_from(self._view, self._node_offset + NODE.size * index)
+
+    # 返回一个节点的视图
+    def node(self, index):
+        if not 0 <= index < self.node_count:
+            raise IndexError(index)
+        return NodeView(self, index)
+
+    # 按顺序遍历从first开始的兄弟节点
+    def siblings(self, first):
+        index = first
+        while index != NONE:
+            node = NodeView(self, index)
+            yield node
+            index = node.record[5]
+
+    # 顶层节点
+    def roots(self):
+        return self.siblings(self.first_root)
+
+    # 解码全部字符串：整个字符串区一次解码再按\0切分，字符串本身含有\0时退回逐个解码
+    def strings(self):
+        if self._strings is None:
+            strings = str(self._blob, 'utf-8', 'surrogatepass').split('\0')
+            if len(strings) == self.string_count + 1:
+                strings.pop()
+            else:
+                strings = [self.string(i) for i in range(self.string_count)]
+            self._strings = strings
+        return self._strings
+
+    # 转换为书签列表（与写入前的JSON结构相同）
+    # 热点循环：按字段掩码缓存的itemgetter一次取出全部字符串编号，相同的sources只切分一次
+    @instrumentation.timed('binary_snapshot.to_bookmarks')
+    def to_bookmarks(self):
+        strings = self.strings()
+        lookup = strings.__getitem__
+        masks = {}
+        split_sources = {}
+        roots = []
+        children = []
+        nodes = self._view[self._node_offset:self._node_offset + NODE.size * self.node_count]
+        for record in NODE.iter_unpack(nodes):
+            mask = record[2]
+            fields = masks.get(mask)
+            if fields is None:
+                fields = masks[mask] = _mask_fields(mask)
+            item = dict(zip(fields[0], map(lookup, fields[1](record))))
+            if mask & SOURCES_BIT:
+                sources = split_sources.get(record[SOURCES_FIELD])
+                if sources is None:
+                    sources = split_sources[record[SOURCES_FIELD]] = _split_sources(item['sources'])
+                item['sources'] = list(sources)
+            flags = record[1]
+            if flags & FLAG_DEPTH:
+                item['depth'] = record[6]
+            if record[EXTRA_FIELD] != NONE:
+                item.update(json.loads(strings[record[EXTRA_FIELD]]))
+            if flags & FLAG_CHILDREN:
+                item['children'] = item_children = []
+                children.append(item_children)
+            else:
+                children.append(None)
+            # 先序排列中同一父节点的子节点按顺序出现，依次追加即可保持顺序
+            parent = record[3]
+            (roots if parent == NONE else children[parent]).append(item)
+        nodes.release()
+        instrumentation.count('binary_snapshot.nodes_read', len(children))
+        return roots
+
+# 字段掩码对应的(字段名, 取出这些字段编号的函数)；书签通常只有几种字段组合，按掩码缓存
+@functools.lru_cache(maxsize=None)
+def _mask_fields(mask):
+    positions = [bit for bit in range(len(STRING_FIELDS)) if mask & (1 << bit)]
+    fields = tuple(STRING_FIELDS[bit] for bit in positions)
+    indexes = [FIELDS_START + bit for bit in positions]
+    if len(indexes) == 1:
+        # itemgetter只取一项时返回的不是元组
+        return fields, lambda record, index=indexes[0]: (record[index],)
+    return fields, operator.itemgetter(*indexes) if indexes else (lambda record: ())
+
+# sources字段保存为以换行连接的字符串（其中没有空字符串）
+def _split_sources(value):
+    return tuple(value.split('\n')) if value else ()
+
+# 把一条节点记录转换为书签字典（children为空列表，由调用者填入子节点）；lookup按编号返回字符串
+def _decode_record(record, lookup):
+    fields, getter = _mask_fields(record[2])
+    item = dict(zip(fields, map(lookup, getter(record))))
+    if record[2] & SOURCES_BIT:
+        item['sources'] = list(_split_sources(item['sources']))
+    if record[1] & FLAG_DEPTH:
+        item['depth'] = record[6]
+    if record[EXTRA_FIELD] != NONE:
+        item.update(json.loads(lookup(record[EXTRA_FIELD])))
+    if record[1] & FLAG_CHILDREN:
+        item['children'] = []
+    return item
+
+# 快照中一个节点的只读视图：字段在访问时才从mmap中读取
+class NodeView:
+    __slots__ = ('snapshot', 'index', 'record')
+
+    def __init__(self, snapshot, index):
+        self.snapshot = snapshot
+        self.index = index
+        self.record = snapshot.record(index)
+
+    @property
+    def type(self):
+        return TYPE_NAMES.get(self.record[0]) or self.get('type')
+
+    @property
+    def name(self):
+        return self.get('name', '')
+
+    @property
+    def url(self):
+        return self.get('url')
+
+    @property
+    def parent(self):
+        return None if self.record[3] == NONE else NodeView(self.snapshot, self.record[3])
+
+    # 子节点（按顺序）
+    @property
+    def children(self):
+        return self.snapshot.siblings(self.record[4])
+
+    # 按字段名读取，与书签字典的get相同
+    def get(self, key, default=None):
+        if key in STRING_FIELDS:
+            index = self.record[FIELDS_START + STRING_FIELDS.index(key)]
+            if index != NONE:
+                value = self.snapshot.string(index)
+                return list(_split_sources(value)) if key == 'sources' else value
+        elif key == 'depth' and self.record[1] & FLAG_DEPTH:
+            return self.record[6]
+        if self.record[EXTRA_FIELD] != NONE:
+            return json.loads(self.snapshot.string(self.record[EXTRA_FIELD])).get(key, default)
+        return default
+
+    # 转换为书签字典（包括全部子节点）
+    def to_dict(self):
+        item = _decode_record(self.record, self.snapshot.string)
+        if 'children' in item:
+            item['children'] = [child.to_dict() for child in self.children]
+        return item
+
+    def __repr__(self):
+        return f"NodeView({self.index}, {self.type!r}, {self.name!r})"
+
+# 读取书签文件：.bksnap按二进制快照读取，其他按JSON读取
+def load_bookmarks(path):
+    if path.endswith(SUFFIX):
+        with BinarySnapshot(path) as snapshot:
+            return snapshot.to_bookmarks()
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="查看、导出和生成书签二进制快照（.bksnap）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    info_parser = subparsers.add_parser('info', help="显示快照的节点数、字符串数和顶层文件夹")
+    info_parser.add_argument('snapshot', help="二进制快照文件")
+    export_parser = subparsers.add_parser('export', help="把快照导出为JSON文件")
+    export_parser.add_argument('snapshot', help="二进制快照文件")
+    export_parser.add_argument('--output', help="输出的JSON文件（默认与快照同名，扩展名为.json）")
+    convert_parser = subparsers.add_parser('convert', help="把书签JSON文件转换为二进制快照")
+    convert_parser.add_argument('input', help="书签JSON文件")
+    convert_parser.add_argument('--output', help="输出的快照文件（默认与JSON文件同名，扩展名为.bksnap）")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        if args.command == 'info':
+            with BinarySnapshot(args.snapshot) as snapshot:
+                print(f"节点: {snapshot.node_count}，字符串: {snapshot.string_count}，"
+                      f"文件大小: {os.path.getsize(args.snapshot) / 1024:.1f} KB")
+                for node in snapshot.roots():
+                    count = sum(1 for _ in node.children)
+                    print(f"  {node.name or node.url} ({node.type}, {count} 个子项)")
+        elif args.command == 'export':
+            output = args.output or os.path.splitext(args.snapshot)[0] + '.json'
+            bookmarks = load_bookmarks(args.snapshot)
+            with open(output, 'w', encoding='utf-8') as f:
+                json.dump(bookmarks, f, ensure_ascii=False, indent=2)
+            print(f"已导出到: {output}")
+        elif args.command == 'convert':
+            output = args.output or os.path.splitext(args.input)[0] + SUFFIX
+            with open(args.input, 'r', encoding='utf-8') as f:
+                bookmarks = json.load(f)
+            write_snapshot(bookmarks, output)
+            print(f"已保存到: {output}")
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import argparse
+
+import source_cache
+import instrumentation
+from step3_merge_bookmarks import canonicalize_url
+
+# 合并结果的SQLite索引，每次合并后增量更新
+INDEX_FILE = os.path.join(source_cache.CACHE_DIR, 'bookmarks_index.sqlite3')
+
+# 索引格式版本，表结构变化时递增，旧的索引会被重建
+INDEX_VERSION = 1
+
+# 书签表按规范URL的哈希、文件夹路径和来源建立索引；
+# bookmarks_fts是书签表的外部内容FTS5表，由update_index与书签表同步更新
+# （不使用触发器：逐行触发的FTS写入比批量executemany慢好几倍）
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bookmarks (
+    id INTEGER PRIMARY KEY,
+    url_hash INTEGER NOT NULL,
+    canonical_url TEXT NOT NULL,
+    url TEXT NOT NULL,
+    title TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    source TEXT NOT NULL,
+    sources TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bookmarks_url_hash ON bookmarks(url_hash);
+CREATE INDEX IF NOT EXISTS bookmarks_folder ON bookmarks(folder);
+CREATE INDEX IF NOT EXISTS bookmarks_source ON bookmarks(source);
+CREATE VIRTUAL TABLE IF NOT EXISTS bookmarks_fts USING fts5(
+    title, url, content='bookmarks', content_rowid='id', tokenize='{tokenizer}'
+);
+'''
+
+# trigram分词器（SQLite 3.34+）支持任意子串搜索，中文等不以空格分词的标题也能搜到；
+# 更早的版本使用unicode61
+TRIGRAM_MIN_VERSION = (3, 34, 0)
+
+# 规范URL的64位哈希，作为书签表的查找键
+def url_hash(canonical):
+    return int.from_bytes(hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+# 打开（必要时创建）索引数据库
+def open_index(index_file=None):
+    index_file = index_file or INDEX_FILE
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+    conn = sqlite3.connect(index_file)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+
+    version = None
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        version = int(row[0]) if row else None
+    except sqlite3.OperationalError:
+        pass
+    if version is not None and version != INDEX_VERSION:
+        conn.close()
+        os.remove(index_file)
+        return open_index(index_file)
+
+    tokenizer = 'trigram' if sqlite3.sqlite_version_info >= TRIGRAM_MIN_VERSION else 'unicode61'
+    conn.executescript(SCHEMA.format(tokenizer=tokenizer))
+    conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('version', ?)", (str(INDEX_VERSION),))
+    conn.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('tokenizer', ?)", (tokenizer,))
+    conn.commit()
+    return conn
+
+# 遍历合并结果中的书签，产生{规范URL: (url, 标题, 文件夹路径, 来源, 所有来源)}
+# 合并结果已按规范URL去重，同一规范URL只保留第一次出现的书签
+def collect_rows(merged_bookmarks):
+    rows = {}
+    stack = [(iter(merged_bookmarks), '')]
+    while stack:
+        item = next(stack[-1][0], None)
+        if item is None:
+            stack.pop()
+            continue
+        folder = stack[-1][1]
+        if item.get('type') == 'folder':
+            name = item.get('name', '')
+            stack.append((iter(item.get('children', [])), f"{folder}/{name}" if folder else name))
+        elif item.get('url'):
+            canonical = canonicalize_url(item['url'])
+            if canonical not in rows:
+                rows[canonical] = (item['url'], item.get('name', ''), folder, item.get('source', ''),
+                                   ','.join(item.get('sources', [])))
+    return rows
+
+# 用合并结果增量更新索引：只删除、修改和插入有变化的书签，返回(新增, 删除, 修改)数量
+# digest为合并结果的摘要（source_cache.bookmarks_digest），与上次更新时相同则直接返回
+@instrumentation.timed('bookmark_index.update_index')
+def update_index(merged_bookmarks, index_file=None, digest=None):
+    conn = open_index(index_file)
+    try:
+        if digest:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'digest'").fetchone()
+            if row and row[0] == digest:
+                return 0, 0, 0
+
+        rows = collect_rows(merged_bookmarks)
+        existing = {}
+        for row in conn.execute('SELECT id, canonical_url, url, title, folder, source, sources FROM bookmarks'):
+            existing[row[1]] = (row[0], row[2:])
+        next_id = (conn.execute('SELECT MAX(id) FROM bookmarks').fetchone()[0] or 0) + 1
+
+        # FTS中要删除的旧内容(id, 标题, url)和要写入的新内容
+        fts_removed = []
+        fts_added = []
+        removed = []
+        for canonical in existing.keys() - rows.keys():
+            row_id, (url, title, _, _, _) = existing[canonical]
+            removed.append((row_id,))
+            fts_removed.append((row_id, title, url))
+
+        added = []
+        updated = []
+        for canonical, values in rows.items():
+            old = existing.get(canonical)
+            if old is None:
+                added.append((next_id, url_hash(canonical), canonical) + values)
+                fts_added.append((next_id, values[1], values[0]))
+                next_id += 1
+            elif old[1] != values:
+                row_id, old_values = old
+                updated.append(values + (row_id,))
+                if old_values[:2] != values[:2]:
+                    fts_removed.append((row_id, old_values[1], old_values[0]))
+                    fts_added.append((row_id, values[1], values[0]))
+
+        with conn:
+            conn.executemany("INSERT INTO bookmarks_fts(bookmarks_fts, rowid, title, url) VALUES ('delete', ?, ?, ?)",
+                             fts_removed)
+            conn.executemany('DELETE FROM bookmarks WHERE id = ?', removed)
+            conn.executemany('UPDATE bookmarks SET url = ?, title = ?, folder = ?, source = ?, sources = ? '
+                             'WHERE id = ?', updated)
+            conn.executemany('INSERT INTO bookmarks(id, url_hash, canonical_url, url, title, folder, source, sources) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', added)
+            conn.executemany('INSERT INTO bookmarks_fts(rowid, title, url) VALUES (?, ?, ?)', fts_added)
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('digest', ?)", (digest or '',))
+        instrumentation.count('index.rows_changed', len(added) + len(removed) + len(updated))
+        return len(added), len(removed), len(updated)
+    finally:
+        conn.close()
+
+# 把用户输入转换为FTS5查询：每个词作为带引号的短语，多个词之间为AND
+def build_match_query(query):
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in query.split())
+
+# 转义LIKE模式中的通配符（配合ESCAPE '\\'使用）
+def like_escape(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# 搜索书签，query匹配标题或URL（子串匹配），可按文件夹路径前缀和来源过滤
+# 返回[{'title', 'url', 'folder', 'source', 'sources'}]，按相关度排序
+def search(query, limit=20, folder=None, source=None, index_file=None):
+    conn = open_index(index_file)
+    try:
+        tokenizer = conn.execute("SELECT value FROM meta WHERE key = 'tokenizer'").fetchone()[0]
+        terms = query.split()
+        conditions = []
+        params = []
+        # trigram分词器无法匹配少于3个字符的词，这类查询改为在书签表上做LIKE匹配
+        if terms and (tokenizer != 'trigram' or all(len(term) >= 3 for term in terms)):
+            sql = ('SELECT b.title, b.url, b.folder, b.source, b.sources FROM bookmarks_fts f '
+                   'JOIN bookmarks b ON b.id = f.rowid WHERE bookmarks_fts MATCH ?')
+            params.append(build_match_query(query))
+            order = ' ORDER BY f.rank'
+        else:
+            sql = 'SELECT b.title, b.url, b.folder, b.source, b.sources FROM bookmarks b WHERE 1'
+            for term in terms:
+                conditions.append("(b.title LIKE ? ESCAPE '\\' OR b.url LIKE ? ESCAPE '\\')")
+                pattern = '%' + like_escape(term) + '%'
+                params.extend([pattern, pattern])
+            order = ' ORDER BY b.id'
+        if folder:
+            conditions.append("(b.folder = ? OR b.folder LIKE ? ESCAPE '\\')")
+            params.extend([folder, like_escape(folder) + '/%'])
+        if source:
+            conditions.append('b.source = ?')
+            params.append(source)
+        for condition in conditions:
+            sql += ' AND ' + condition
+        sql += order + ' LIMIT ?'
+        params.append(limit)
+        return [{'title': row[0], 'url': row[1], 'folder': row[2], 'source': row[3], 'sources': row[4]}
+                for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+# 按规范URL查找书签，返回与search相同格式的结果
+def lookup_url(url, index_file=None):
+    canonical = canonicalize_url(url)
+    conn = open_index(index_file)
+    try:
+        rows = conn.execute('SELECT title, url, folder, source, sources FROM bookmarks '
+                            'WHERE url_hash = ? AND canonical_url = ?', (url_hash(canonical), canonical))
+        return [{'title': row[0], 'url': row[1], 'folder': row[2], 'source': row[3], 'sources': row[4]}
+                for row in rows]
+    finally:
+        conn.close()
+
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="在合并书签的SQLite索引中搜索（索引由run_pipeline.py在每次合并后更新）")
+    parser.add_argument('--index', help="索引数据库路径（默认: .bookmarks_cache/bookmarks_index.sqlite3）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    search_parser = subparsers.add_parser('search', help="按标题或URL搜索书签")
+    search_parser.add_argument('query', nargs='+', help="搜索词，多个词之间为AND")
+    search_parser.add_argument('--folder', help="只搜索该文件夹（包括子文件夹）中的书签")
+    search_parser.add_argument('--source', choices=['Chrome', 'Safari', 'Firefox'], help="只搜索来自该浏览器的书签")
+    search_parser.add_argument('--limit', type=int, default=20, help="最多显示的结果数量（默认: 20）")
+
+    url_parser = subparsers.add_parser('url', help="按规范URL查找书签")
+    url_parser.add_argument('url', help="书签URL")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+    index_file = args.index or INDEX_FILE
+    if not os.path.exists(index_file):
+        print(f"错误: 索引不存在，请先运行run_pipeline.py: {index_file}")
+        return 1
+
+    start = time.perf_counter()
+    if args.command == 'search':
+        results = search(' '.join(args.query), args.limit, args.folder, args.source, index_file)
+    else:
+        results = lookup_url(args.url, index_file)
+    elapsed = time.perf_counter() - start
+
+    for item in results:
+        print(f"{item['title']}\n    {item['url']}\n    文件夹: {item['folder'] or '/'}  来源: {item['sources'] or item['source']}")
+    print(f"\n共 {len(results)} 个结果，耗时 {elapsed * 1000:.1f} 毫秒")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
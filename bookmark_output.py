@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import json
+import contextlib
+
+# 输出级别：只打印统计、交互式逐层浏览、完整输出树和列表
+OUTPUT_SUMMARY = 'summary'
+OUTPUT_BROWSE = 'browse'
+OUTPUT_FULL = 'full'
+OUTPUT_LEVELS = (OUTPUT_SUMMARY, OUTPUT_BROWSE, OUTPUT_FULL)
+
+# 完整输出时写缓冲区的大小
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# 交互式浏览时每页显示的条目数
+PAGE_SIZE = 30
+
+# 默认输出级别：在终端中交互运行时逐层浏览，否则（cron、重定向到日志）只打印统计
+def default_output_level():
+    if sys.stdin.isatty() and sys.stdout.isatty():
+        return OUTPUT_BROWSE
+    return OUTPUT_SUMMARY
+
+# 统计书签和文件夹数量、最大深度，以及每个顶层文件夹中的书签数量
+def collect_stats(bookmarks):
+    stats = {'bookmarks': 0, 'folders': 0, 'max_depth': 0, 'top_level': []}
+    for item in bookmarks:
+        if item['type'] != 'folder':
+            stats['bookmarks'] += 1
+            continue
+        folder_stats = {'name': item['name'], 'bookmarks': 0, 'folders': 1}
+        stats['top_level'].append(folder_stats)
+        stack = [(item['children'], 1)]
+        while stack:
+            children, depth = stack.pop()
+            stats['max_depth'] = max(stats['max_depth'], depth)
+            for child in children:
+                if child['type'] == 'folder':
+                    folder_stats['folders'] += 1
+                    stack.append((child['children'], depth + 1))
+                else:
+                    folder_stats['bookmarks'] += 1
+        stats['bookmarks'] += folder_stats['bookmarks']
+        stats['folders'] += folder_stats['folders']
+    return stats
+
+# 打印统计信息
+def print_summary(stats, title="书签"):
+    print(f"\n{title}统计:")
+    print("-" * 50)
+    for folder in stats['top_level']:
+        print(f"[{folder['name']}] {folder['bookmarks']} 个书签，{folder['folders'] - 1} 个子文件夹")
+    print("-" * 50)
+    print(f"总计: {stats['bookmarks']} 个书签，{stats['folders']} 个文件夹，最大深度 {stats['max_depth']}")
+
+# 以机器可读的JSON打印统计信息
+def print_json_stats(stats, source=None, out=None):
+    data = dict(stats)
+    if source:
+        data['source'] = source
+    print(json.dumps(data, ensure_ascii=False), file=out or sys.stdout)
+
+# 使用--json-stats时把其余提示信息改为输出到stderr，stdout中只有JSON统计；返回原来的stdout
+@contextlib.contextmanager
+def json_stats_stdout(enabled):
+    stdout = sys.stdout
+    if not enabled:
+        yield stdout
+        return
+    with contextlib.redirect_stdout(sys.stderr):
+        yield stdout
+
+# 打开一个大缓冲区的标准输出写入器，退出时统一刷新，整个输出只经过一个写缓冲区
+@contextlib.contextmanager
+def buffered_stdout():
+    sys.stdout.flush()
+    try:
+        fileno = sys.stdout.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        # 标准输出被替换为StringIO等对象时直接写入
+        yield sys.stdout
+        return
+    with open(fileno, 'w', encoding='utf-8', errors='replace', buffering=WRITE_BUFFER_SIZE, closefd=False) as out:
+        yield out
+
+# 逐行生成书签树的文本（显式栈，不受递归深度限制）
+def iter_tree_lines(bookmarks, indent=0):
+    stack = [(iter(bookmarks), indent)]
+    while stack:
+        item = next(stack[-1][0], None)
+        if item is None:
+            stack.pop()
+            continue
+        level = stack[-1][1]
+        # 缩进显示层级
+        prefix = '  ' * level
+        if item['type'] == 'folder':
+            # 文件夹用方括号标识
+            yield f"{prefix}[{item['name']}]\n"
+            stack.append((iter(item['children']), level + 1))
+        else:
+            # 书签显示名称和URL
+            yield f"{prefix}- {item['name']}: {item.get('url', '')}\n"
+
+# 截断过长的字符串以便于显示
+def truncate(text, width):
+    if len(text) > width - 2:
+        return text[:width - 5] + '...'
+    return text
+
+# 逐行生成扁平化的书签列表文本
+def iter_list_lines(bookmarks):
+    yield "\n书签列表:\n"
+    yield "-" * 100 + "\n"
+    yield f"{'标题':<40} {'路径':<30} {'URL':<40}\n"
+    yield "-" * 100 + "\n"
+
+    total = 0
+    stack = [iter(bookmarks)]
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop()
+            continue
+        if item['type'] == 'folder':
+            stack.append(iter(item['children']))
+            continue
+        total += 1
+        title = truncate(item['name'], 40)
+        path = truncate(item.get('path', ''), 30)
+        url = truncate(item.get('url', ''), 40)
+        yield f"{title:<40} {path:<30} {url:<40}\n"
+
+    yield "-" * 100 + "\n"
+    yield f"总计: {total} 个书签\n"
+
+# 通过一个缓冲写入器输出完整的书签树
+def write_tree(bookmarks, out=None):
+    if out is not None:
+        out.writelines(iter_tree_lines(bookmarks))
+        return
+    with buffered_stdout() as out:
+        out.writelines(iter_tree_lines(bookmarks))
+
+# 通过一个缓冲写入器输出完整的书签列表
+def write_list(bookmarks, out=None):
+    if out is not None:
+        out.writelines(iter_list_lines(bookmarks))
+        return
+    with buffered_stdout() as out:
+        out.writelines(iter_list_lines(bookmarks))
+
+# 交互式逐层浏览书签树：每次只显示当前文件夹的一页内容，输出量与显示的条目数有关，与书签总数无关
+# 命令：数字进入文件夹，..返回上一级，n/p下一页/上一页，q退出
+def browse_tree(bookmarks, page_size=PAGE_SIZE, input_func=input):
+    # 路径栈：(文件夹名称, 子项列表)
+    path = [('根目录', bookmarks)]
+    page = 0
+    while True:
+        name, items = path[-1]
+        pages = max(1, (len(items) + page_size - 1) // page_size)
+        page = min(page, pages - 1)
+        start = page * page_size
+        lines = [f"\n{' / '.join(folder for folder, _ in path)}  （第 {page + 1}/{pages} 页，共 {len(items)} 项）\n"]
+        for number, item in enumerate(items[start:start + page_size], start + 1):
+            if item['type'] == 'folder':
+                lines.append(f"{number:>5}. [{item['name']}] ({len(item['children'])} 项)\n")
+            else:
+                lines.append(f"{number:>5}. {item['name']}: {item.get('url', '')}\n")
+        sys.stdout.write(''.join(lines))
+
+        try:
+            command = input_func("输入编号进入文件夹，.. 返回上一级，n/p 翻页，q 退出: ").strip()
+        except EOFError:
+            return
+        if command == 'q':
+            return
+        if command == 'n':
+            page += 1
+        elif command == 'p':
+            page = max(0, page - 1)
+        elif command == '..':
+            if len(path) > 1:
+                path.pop()
+                page = 0
+        elif command.isdigit() and 1 <= int(command) <= len(items) and items[int(command) - 1]['type'] == 'folder':
+            folder = items[int(command) - 1]
+            path.append((folder['name'], folder['children']))
+            page = 0
+        else:
+            print("无效的输入")
+
+# 按输出级别显示书签；json_stats为True时只向json_out输出JSON格式的统计信息
+def show_bookmarks(bookmarks, level=None, json_stats=False, title="书签", source=None, json_out=None):
+    if json_stats:
+        print_json_stats(collect_stats(bookmarks), source, json_out)
+        return
+    level = level or default_output_level()
+    if level == OUTPUT_FULL:
+        with buffered_stdout() as out:
+            out.write("\n书签树结构:\n" + "-" * 50 + "\n")
+            write_tree(bookmarks, out)
+            write_list(bookmarks, out)
+        return
+    print_summary(collect_stats(bookmarks), title)
+    if level == OUTPUT_BROWSE:
+        browse_tree(bookmarks)
+
+# 给step1/step2的命令行添加输出级别参数
+def add_output_arguments(parser):
+    parser.add_argument('--output', choices=OUTPUT_LEVELS,
+                        help="输出级别：summary只打印统计，browse在终端中逐层浏览，full完整输出树和列表"
+                             "（默认在终端中为browse，否则为summary）")
+    parser.add_argument('--json-stats', action='store_true', help="只输出JSON格式的统计信息")
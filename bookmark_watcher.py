@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import select
+import struct
+import argparse
+import subprocess
+import ctypes
+import ctypes.util
+from datetime import datetime
+
+import step1_chrome_bookmarks_viewer_fixed as step1
+import step2_safari_bookmarks_viewer as step2
+import step4_sync_to_chrome as step4
+import step5_sync_to_safari as step5
+import source_cache
+import three_way_merge
+import bookmark_index
+import snapshot_store
+
+# 一次写入常常触发多个文件事件（Chrome先写临时文件再重命名，Safari会连续写几次），
+# 最后一个事件之后等待DEBOUNCE_SECONDS没有新的变化才开始同步，最多等待MAX_DEBOUNCE_SECONDS
+DEBOUNCE_SECONDS = 0.3
+MAX_DEBOUNCE_SECONDS = 5.0
+
+# 轮询方式检查文件变化的间隔
+POLL_INTERVAL = 1.0
+
+# 有等待写入的浏览器时，检查浏览器是否已经退出的间隔
+PENDING_CHECK_INTERVAL = 2.0
+
+# 浏览器运行时会用内存中的书签覆盖书签文件，也不会重新读取文件，所以只在浏览器退出后才写入它的书签文件
+# 各平台上用pgrep -x查找的进程名
+BROWSER_PROCESSES = {
+    'chrome': {'darwin': 'Google Chrome', 'linux': 'chrome'},
+    'safari': {'darwin': 'Safari'},
+}
+
+SIDE_NAMES = {'chrome': 'Chrome', 'safari': 'Safari'}
+
+# 判断浏览器是否正在运行
+def browser_running(side):
+    platform = 'linux' if sys.platform.startswith('linux') else sys.platform
+    name = BROWSER_PROCESSES[side].get(platform)
+    if not name:
+        return False
+    try:
+        return subprocess.run(['pgrep', '-x', name], stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL).returncode == 0
+    except OSError:
+        return False
+
+# 文件的签名：inode、大小和mtime_ns，文件不存在时为None
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+# 一组文件的签名：{绝对路径: 签名}
+def file_signatures(paths):
+    return {os.path.abspath(path): file_signature(path) for path in paths}
+
+# 返回签名与signatures中记录的不同的文件，并记录新的签名
+def update_signatures(signatures):
+    changed = set()
+    for path, previous in signatures.items():
+        signature = file_signature(path)
+        if signature != previous:
+            signatures[path] = signature
+            changed.add(path)
+    return changed
+
+# 三种监视方式共用的等待循环：wait_event在有文件事件（或轮询间隔到了）时返回，
+# 文件是否真的变化由签名比较决定，所以事件只用来唤醒，目录里其他文件的事件不会引起同步
+# 返回发生变化的文件集合；超时时返回空集合（timeout为None时一直等待）
+def wait_for_changes(signatures, wait_event, timeout=None):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            return set()
+        wait_event(remaining)
+        changed = update_signatures(signatures)
+        if changed:
+            return changed
+
+# 轮询：每隔interval秒检查一次文件签名
+class PollingWatcher:
+    name = 'polling'
+
+    def __init__(self, paths, interval=POLL_INTERVAL):
+        self.signatures = file_signatures(paths)
+        self.interval = interval
+
+    # 返回签名与上次不同的文件，并记录新的签名
+    def changed_paths(self):
+        return update_signatures(self.signatures)
+
+    # 等待文件变化，返回发生变化的文件集合
+    def wait(self, timeout=None):
+        return wait_for_changes(self.signatures, self._wait_event, timeout)
+
+    def _wait_event(self, timeout):
+        time.sleep(self.interval if timeout is None else min(self.interval, timeout))
+
+    def close(self):
+        pass
+
+# Linux：通过ctypes调用inotify，监视书签文件所在的目录（浏览器用重命名替换书签文件，直接监视文件会丢失）
+class InotifyWatcher:
+    name = 'inotify'
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, paths):
+        self.signatures = file_signatures(paths)
+        self.paths = list(self.signatures)
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.names = {os.path.basename(path).encode() for path in self.paths}
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        for directory in {os.path.dirname(path) for path in self.paths}:
+            if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+                error = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(error, os.strerror(error), directory)
+
+    # 返回签名与上次不同的文件，并记录新的签名
+    def changed_paths(self):
+        return update_signatures(self.signatures)
+
+    # 等待文件变化，返回发生变化的文件集合
+    def wait(self, timeout=None):
+        return wait_for_changes(self.signatures, self._wait_event, timeout)
+
+    # 读出所有已到达的事件，返回其中是否有书签文件的事件
+    def _drain(self):
+        relevant = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return relevant
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if name in self.names:
+                    relevant = True
+
+    def _wait_event(self, timeout):
+        while True:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if not readable or self._drain():
+                return
+
+    def close(self):
+        os.close(self.fd)
+
+# macOS/BSD：kqueue监视书签文件所在的目录（重命名替换）和书签文件本身（原地写入）
+class KqueueWatcher:
+    name = 'kqueue'
+
+    def __init__(self, paths):
+        self.signatures = file_signatures(paths)
+        self.paths = list(self.signatures)
+        self.kq = select.kqueue()
+        self.open_flags = getattr(os, 'O_EVTONLY', os.O_RDONLY)
+        self.dir_fds = []
+        for directory in {os.path.dirname(path) for path in self.paths}:
+            fd = os.open(directory, self.open_flags)
+            self.dir_fds.append(fd)
+            self.kq.control([select.kevent(fd, select.KQ_FILTER_VNODE, select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                                           select.KQ_NOTE_WRITE)], 0)
+        self.file_fds = {}
+        self._watch_files()
+
+    # 返回签名与上次不同的文件，并记录新的签名
+    def changed_paths(self):
+        return update_signatures(self.signatures)
+
+    # 等待文件变化，返回发生变化的文件集合
+    def wait(self, timeout=None):
+        return wait_for_changes(self.signatures, self._wait_event, timeout)
+
+    # 重新打开并监视书签文件（文件被重命名替换后，旧的文件描述符指向已经删除的文件）
+    def _watch_files(self):
+        for fd in self.file_fds.values():
+            os.close(fd)
+        self.file_fds = {}
+        fflags = (select.KQ_NOTE_WRITE | select.KQ_NOTE_EXTEND | select.KQ_NOTE_ATTRIB
+                  | select.KQ_NOTE_DELETE | select.KQ_NOTE_RENAME)
+        for path in self.paths:
+            try:
+                fd = os.open(path, self.open_flags)
+            except OSError:
+                continue
+            self.file_fds[path] = fd
+            self.kq.control([select.kevent(fd, select.KQ_FILTER_VNODE, select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                                           fflags)], 0)
+
+    def _wait_event(self, timeout):
+        events = self.kq.control(None, 16, timeout)
+        if any(event.ident in self.dir_fds or event.fflags & (select.KQ_NOTE_DELETE | select.KQ_NOTE_RENAME)
+               for event in events):
+            self._watch_files()
+
+    def close(self):
+        for fd in list(self.file_fds.values()) + self.dir_fds:
+            os.close(fd)
+        self.kq.close()
+
+# 按平台选择监视方式：backend为auto时macOS使用kqueue，Linux使用inotify，都不可用时退回轮询
+def create_watcher(paths, backend='auto', poll_interval=POLL_INTERVAL):
+    if backend in ('auto', 'kqueue') and hasattr(select, 'kqueue'):
+        try:
+            return KqueueWatcher(paths)
+        except OSError as e:
+            print(f"无法使用kqueue监视书签文件，改为轮询: {e}")
+    elif backend in ('auto', 'inotify') and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError) as e:
+            print(f"无法使用inotify监视书签文件，改为轮询: {e}")
+    elif backend != 'polling' and backend != 'auto':
+        print(f"当前平台不支持{backend}，改为轮询")
+    return PollingWatcher(paths, poll_interval)
+
+# 监视模式的同步会话：同步基线（合并结果和两侧的书签索引）常驻内存，
+# 每次只解析发生变化的一侧，未变化的一侧直接沿用基线中的索引，不读取也不解析它的书签文件
+class WatchSession:
+    def __init__(self, chrome_path, safari_path, profile=None, update_index=True, write_while_running=False):
+        self.paths = {'chrome': chrome_path, 'safari': safari_path}
+        self.sources = [('chrome', chrome_path), ('safari', safari_path)]
+        self.scope = profile if profile and profile != 'Default' else None
+        self.base_file = three_way_merge.profile_base_file(self.scope) if self.scope else None
+        self.update_index = update_index
+        self.write_while_running = write_while_running
+        self.base = three_way_merge.load_base(self.base_file)
+        # 上次写入后的Safari书签结构，Safari书签文件没有再变化时不必重新读取
+        self.safari_plist = None
+        self.safari_plist_fingerprint = None
+        # 因浏览器正在运行而推迟写入的一侧
+        self.pending = set()
+
+    # 解析发生变化的一侧
+    def parse_side(self, side):
+        if side == 'chrome':
+            return step1.read_chrome_bookmarks(self.paths['chrome'])
+        return step2.read_safari_bookmarks(self.paths['safari'])
+
+    # 同步一次，返回是否有书签写入了浏览器
+    def sync(self):
+        start = time.perf_counter()
+        recorded = self.base['fingerprints'] if self.base else {}
+        fingerprints = {side: source_cache.get_fingerprint(path, side, recorded.get(side))
+                        for side, path in self.sources}
+        changed = [side for side in self.paths
+                   if self.base is None or side not in self.base['sides']
+                   or source_cache.fingerprint_changed(recorded.get(side), fingerprints[side])]
+        if not changed and not self.pending:
+            return False
+
+        trees = {}
+        for side in changed:
+            print(f"{SIDE_NAMES[side]}书签有变化，重新解析: {self.paths[side]}")
+            trees[side] = self.parse_side(side)
+
+        merged, side_entries = three_way_merge.merge_with_base(
+            self.base, trees.get('chrome'), trees.get('safari'), fingerprints)
+        # 先转换Chrome书签结构：转换会给新书签补上guid等字段并回写到合并结果中，摘要包含这些字段，
+        # 写入Safari时也使用同样的时间
+        chrome_format = step4.convert_to_chrome_format(merged)
+        digest = source_cache.bookmarks_digest(merged)
+
+        # 先写入没有变化的一侧（即另一个浏览器），变化的一侧通常已经是合并后的内容
+        written = []
+        snapshot_store.begin_run(f"watch:{self.scope}" if self.scope else 'watch')
+        for side in sorted(self.paths, key=lambda side: side in changed):
+            if self.write_side(side, merged, chrome_format, digest, side_entries, fingerprints):
+                written.append(side)
+        snapshot_store.finish_run()
+
+        self.base = three_way_merge.save_base(merged, side_entries, fingerprints, self.base_file)
+        # 还有推迟写入的一侧时不记录同步指纹，之后运行run_pipeline.py不会误以为已经同步
+        if not self.pending:
+            source_cache.record_synced_sources(self.sources, self.scope)
+        if self.update_index:
+            try:
+                bookmark_index.update_index(merged, digest=digest)
+            except Exception as e:
+                print(f"更新书签索引时出错: {e}")
+
+        names = '、'.join(SIDE_NAMES[side] for side in written) or '无'
+        print(f"同步完成，写入: {names}，耗时 {time.perf_counter() - start:.3f} 秒")
+        return bool(written)
+
+    # 把合并结果写入一侧的书签文件；内容与文件相同时不写，浏览器正在运行时推迟到它退出后
+    # 写入成功时更新side_entries和fingerprints中该侧的索引和指纹，返回是否写入了文件
+    def write_side(self, side, merged, chrome_format, digest, side_entries, fingerprints):
+        path = self.paths[side]
+        if source_cache.written_unchanged(side, path, digest):
+            self.pending.discard(side)
+            return False
+
+        if side == 'chrome':
+            entries = three_way_merge.index_tree(three_way_merge.chrome_format_to_bookmarks(chrome_format))
+            if entries[three_way_merge.ROOT_KEY]['hash'] == side_entries['chrome'][three_way_merge.ROOT_KEY]['hash']:
+                self.pending.discard(side)
+                return False
+        else:
+            if self.safari_plist is None or source_cache.fingerprint_changed(
+                    self.safari_plist_fingerprint, fingerprints['safari']):
+                self.safari_plist = step5.load_safari_plist(path)
+            data, counts = step5.convert_to_safari_plist(merged, self.safari_plist)
+            if not any(counts.values()):
+                self.pending.discard(side)
+                return False
+
+        if not self.write_while_running and browser_running(side):
+            if side not in self.pending:
+                print(f"{SIDE_NAMES[side]}正在运行，等它退出后再写入书签文件")
+            self.pending.add(side)
+            # Safari书签结构已被修改，下次重新读取
+            self.safari_plist = None
+            return False
+
+        if side == 'chrome':
+            success = step4.save_to_chrome_bookmarks(chrome_format, path, save_copy=False)
+        else:
+            print(step5.describe_changes(counts))
+            success = step5.write_safari_plist(data, path)
+            entries = three_way_merge.index_tree(step2.parse_safari_bookmarks(data))
+        if not success:
+            self.safari_plist = None
+            return False
+
+        source_cache.record_written(side, path, digest)
+        fingerprints[side] = source_cache.get_fingerprint(path, side)
+        side_entries[side] = entries
+        if side == 'safari':
+            self.safari_plist_fingerprint = fingerprints[side]
+        self.pending.discard(side)
+        return True
+
+# 监视两个书签文件，有变化时增量同步；先同步一次，之后一直运行到按Ctrl+C
+def watch(chrome_path=None, safari_path=None, profile=None, debounce=DEBOUNCE_SECONDS, backend='auto',
+          poll_interval=POLL_INTERVAL, update_index=True, write_while_running=False):
+    chrome_path = chrome_path or step1.get_bookmarks_path()
+    safari_path = safari_path or step2.get_bookmarks_path()
+    for side, path in (('chrome', chrome_path), ('safari', safari_path)):
+        if not path or not os.path.exists(path):
+            print(f"错误: {SIDE_NAMES[side]}书签文件不存在: {path}")
+            return False
+
+    # 监视期间一直持有两个步骤的锁，避免与run_pipeline.py或单独运行的step1/step2同时写入
+    if not step1.acquire_lock(chrome_path) or not step2.acquire_lock():
+        print("另一个实例正在运行，退出...")
+        return False
+
+    session = WatchSession(chrome_path, safari_path, profile, update_index, write_while_running)
+    watcher = create_watcher([chrome_path, safari_path], backend, poll_interval)
+    print(f"正在监视书签文件（{watcher.name}）:\n  {chrome_path}\n  {safari_path}\n按Ctrl+C退出")
+    try:
+        session.sync()
+        # 忽略自己写入引起的变化
+        watcher.changed_paths()
+        while True:
+            changed = watcher.wait(PENDING_CHECK_INTERVAL if session.pending else None)
+            if changed:
+                first = time.monotonic()
+                while time.monotonic() - first < MAX_DEBOUNCE_SECONDS:
+                    more = watcher.wait(debounce)
+                    if not more:
+                        break
+                    changed |= more
+                names = '、'.join(SIDE_NAMES[side] for side, path in session.sources
+                                 if os.path.abspath(path) in changed)
+                print(f"\n[{datetime.now().strftime('%H:%M:%S')}] 检测到书签文件变化: {names}")
+            elif not any(not browser_running(side) for side in session.pending):
+                continue
+            try:
+                session.sync()
+            except Exception as e:
+                print(f"同步时出错: {e}")
+            watcher.changed_paths()
+    except KeyboardInterrupt:
+        print("\n停止监视")
+    finally:
+        watcher.close()
+    return True
+
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="监视Chrome和Safari的书签文件，有变化时增量同步")
+    parser.add_argument('--chrome-bookmarks', help="Chrome书签文件路径（默认自动检测）")
+    parser.add_argument('--safari-bookmarks', help="Safari书签文件路径（默认自动检测）")
+    parser.add_argument('--profile', help="Chrome配置文件目录名（使用该配置文件的同步基线）")
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE_SECONDS,
+                        help=f"最后一次文件变化后等待的秒数（默认: {DEBOUNCE_SECONDS}）")
+    parser.add_argument('--backend', choices=['auto', 'kqueue', 'inotify', 'polling'], default='auto',
+                        help="监视文件的方式（默认: macOS使用kqueue，Linux使用inotify，否则轮询）")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                        help=f"轮询间隔秒数（默认: {POLL_INTERVAL}）")
+    parser.add_argument('--no-index', action='store_true', help="同步后不更新书签搜索索引")
+    parser.add_argument('--write-while-running', action='store_true',
+                        help="浏览器正在运行时也写入它的书签文件（浏览器可能会覆盖写入的内容）")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+    chrome_path = args.chrome_bookmarks
+    if not chrome_path and args.profile:
+        chrome_path = step1.get_bookmarks_path(args.profile)
+    success = watch(chrome_path, args.safari_bookmarks, args.profile, args.debounce, args.backend,
+                    args.poll_interval, not args.no_index, args.write_while_running)
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
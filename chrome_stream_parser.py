@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+import re
+import json
+
+# 每次从文件中读取的字符数
+CHUNK_SIZE = 64 * 1024
+
+# JSON词法单元：结构字符、字符串、数字、true/false/null
+TOKEN_RE = re.compile(r'''
+    [ \t\r\n]*
+    (?:
+        (?P<punct>[{}\[\]:,])
+      | "(?P<string>[^"\\]*(?:\\.[^"\\]*)*)"
+      | (?P<number>-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?)
+      | (?P<literal>true|false|null)
+    )
+''', re.VERBOSE | re.DOTALL)
+
+WHITESPACE_RE = re.compile(r'[ \t\r\n]*')
+
+LITERALS = {'true': True, 'false': False, 'null': None}
+
+# 用于一次性解码缓冲区中完整的小对象
+DECODER = json.JSONDecoder()
+
+# 解析时保留的Chrome节点元数据，写回Chrome时沿用，使Chrome Sync不会把已有节点当成新节点，
+# 已有节点的id也保持不变
+CHROME_META_KEYS = ('id', 'guid', 'date_added', 'date_modified')
+
+# 流式读取JSON词法单元，内存占用只与缓冲区大小和最长的单个字符串有关
+class JsonTokenizer:
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    # 读取更多内容，并丢弃已经处理过的部分
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    # 返回下一个词法单元(类型, 值)，文件结束时返回None
+    # 类型为'punct'、'string'、'number'或'literal'
+    def next_token(self):
+        while True:
+            match = TOKEN_RE.match(self.buffer, self.pos)
+            # 匹配到缓冲区末尾时，词法单元可能被截断（如数字或字符串的一部分），先读入更多内容
+            if match is None or (match.end() == len(self.buffer) and not self.eof):
+                if self._fill():
+                    continue
+                if match is None:
+                    rest = WHITESPACE_RE.match(self.buffer, self.pos)
+                    if rest.end() == len(self.buffer):
+                        return None
+                    raise ValueError(f"无法解析的JSON内容: {self.buffer[self.pos:self.pos + 40]!r}")
+            self.pos = match.end()
+            kind = match.lastgroup
+            text = match.group(kind)
+            if kind == 'string':
+                if '\\' in text:
+                    text = json.loads(f'"{text}"')
+                return kind, text
+            if kind == 'number':
+                return kind, json.loads(text)
+            if kind == 'literal':
+                return kind, LITERALS[text]
+            return kind, text
+
+    # 刚读到'{'时调用：如果整个对象已经完整地位于缓冲区中，直接用json的C解码器解码并返回
+    # 对象超出缓冲区（较大的文件夹或被截断）时返回None，由调用方继续逐个词法单元解析
+    # 能被解码的对象不会超过缓冲区大小，因此不影响内存上限
+    def try_decode_object(self):
+        try:
+            obj, end = DECODER.raw_decode(self.buffer, self.pos - 1)
+        except ValueError:
+            return None
+        self.pos = end
+        return obj
+
+    # 读取下一个词法单元，并检查它是否为指定的结构字符
+    def expect(self, punct):
+        token = self.next_token()
+        if token != ('punct', punct):
+            raise ValueError(f"JSON格式错误: 期望 {punct!r}，实际为 {token!r}")
+
+    # 跳过一个完整的值（对象或数组整体跳过，不在内存中构建）
+    def skip_value(self, token=None):
+        if token is None:
+            token = self.next_token()
+        if token is None:
+            raise ValueError("JSON意外结束")
+        if token[0] != 'punct':
+            return
+        if token[1] not in '{[':
+            raise ValueError(f"JSON格式错误: 意外的 {token[1]!r}")
+        depth = 1
+        while depth:
+            token = self.next_token()
+            if token is None:
+                raise ValueError("JSON意外结束")
+            if token[0] == 'punct':
+                if token[1] in '{[':
+                    depth += 1
+                elif token[1] in '}]':
+                    depth -= 1
+
+# 遍历对象的键：每次返回键名，调用方负责读取或跳过对应的值
+def _iter_object_keys(tokenizer):
+    token = tokenizer.next_token()
+    if token == ('punct', '}'):
+        return
+    while True:
+        if token is None or token[0] != 'string':
+            raise ValueError(f"JSON格式错误: 期望对象键，实际为 {token!r}")
+        tokenizer.expect(':')
+        yield token[1]
+        token = tokenizer.next_token()
+        if token == ('punct', '}'):
+            return
+        if token != ('punct', ','):
+            raise ValueError(f"JSON格式错误: 期望 ',' 或 '}}'，实际为 {token!r}")
+        token = tokenizer.next_token()
+
+# 逐个解析书签节点，产生事件：
+#   ('begin', depth)            节点对象开始
+#   ('url', depth, info)        书签节点结束，info包含name、url等字段
+#   ('folder', depth, info)     文件夹节点结束（子节点的事件都在它之前产生）
+# Chrome写文件时children排在name、type之前，所以节点的信息只有在对象结束时才完整
+def _iter_node_events(tokenizer, depth):
+    # 显式栈，栈中保存每个打开的节点已读到的标量字段；内存只与树的深度有关
+    yield ('begin', depth)
+    stack = [({}, _iter_object_keys(tokenizer), None)]
+
+    while stack:
+        info, keys, children_state = stack[-1]
+        node_depth = depth + len(stack) - 1
+
+        if children_state is not None:
+            # 正在读取children数组
+            token = tokenizer.next_token()
+            if token == ('punct', ']'):
+                stack[-1] = (info, keys, None)
+                continue
+            if children_state == 'after_item':
+                if token != ('punct', ','):
+                    raise ValueError(f"JSON格式错误: children中期望 ','，实际为 {token!r}")
+                token = tokenizer.next_token()
+            stack[-1] = (info, keys, 'after_item')
+            if token != ('punct', '{'):
+                tokenizer.skip_value(token)
+                continue
+            child = tokenizer.try_decode_object()
+            if child is not None:
+                yield from _iter_dict_events(child, node_depth + 1)
+                continue
+            yield ('begin', node_depth + 1)
+            stack.append(({}, _iter_object_keys(tokenizer), None))
+            continue
+
+        key = next(keys, None)
+        if key is None:
+            # 节点对象结束
+            stack.pop()
+            node_type = info.get('type')
+            if node_type == 'folder':
+                yield ('folder', node_depth, info)
+            elif node_type == 'url':
+                yield ('url', node_depth, info)
+            else:
+                yield ('other', node_depth, info)
+            continue
+
+        if key == 'children':
+            tokenizer.expect('[')
+            stack[-1] = (info, keys, 'first_item')
+            continue
+
+        token = tokenizer.next_token()
+        if token is not None and token[0] != 'punct':
+            info[key] = token[1]
+        else:
+            # meta_info等嵌套对象不需要，直接跳过
+            tokenizer.skip_value(token)
+
+# 为已经解码成字典的节点产生与_iter_node_events相同的事件
+def _iter_dict_events(node, depth):
+    yield ('begin', depth)
+    stack = [(node, iter(node.get('children') or ()))]
+    while stack:
+        current, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            info = {k: v for k, v in current.items() if not isinstance(v, (dict, list))}
+            node_type = info.get('type')
+            kind = node_type if node_type in ('folder', 'url') else 'other'
+            yield (kind, depth + len(stack), info)
+            continue
+        if isinstance(child, dict):
+            yield ('begin', depth + len(stack))
+            stack.append((child, iter(child.get('children') or ())))
+
+# 流式解析Chrome书签文件，按根目录依次产生事件：
+#   ('root', root_name)  进入一个根目录（bookmark_bar、other、synced等）
+#   以及_iter_node_events产生的begin/url/folder事件
+# 整个文件不会被一次性读入内存，峰值内存取决于树的深度而不是文件大小
+def iter_bookmark_events(f, chunk_size=CHUNK_SIZE):
+    tokenizer = JsonTokenizer(f, chunk_size)
+    tokenizer.expect('{')
+    for key in _iter_object_keys(tokenizer):
+        if key != 'roots':
+            # checksum、version、sync_metadata等顶级字段
+            tokenizer.skip_value()
+            continue
+        tokenizer.expect('{')
+        for root_name in _iter_object_keys(tokenizer):
+            token = tokenizer.next_token()
+            if root_name in ('sync_transaction_version', 'version') or token != ('punct', '{'):
+                tokenizer.skip_value(token)
+                continue
+            yield ('root', root_name)
+            yield from _iter_node_events(tokenizer, 0)
+
+# 在事件流之上构建与step1_chrome_bookmarks_viewer_fixed.parse_bookmarks相同结构的书签列表
+# root_names为{根目录的键: 名称}时，对应根目录文件夹的名称改为给定的名称（其他Chromium系浏览器的根文件夹名称不同）
+def build_bookmarks(events, on_root=None, root_names=None):
+    bookmarks = []
+    # 每个打开的节点对应一个子项列表
+    stack = []
+    root_name = None
+    for event in events:
+        kind = event[0]
+        if kind == 'root':
+            root_name = event[1]
+            if on_root:
+                on_root(root_name)
+        elif kind == 'begin':
+            stack.append([])
+        else:
+            _, depth, info = event
+            children = stack.pop()
+            if kind == 'folder':
+                node = {
+                    'type': 'folder',
+                    'name': info.get('name', 'Unnamed Folder'),
+                    'path': '',
+                    'depth': depth,
+                    'children': children,
+                }
+            elif kind == 'url':
+                node = {
+                    'type': 'url',
+                    'name': info.get('name', 'Unnamed Bookmark'),
+                    'url': info.get('url', ''),
+                    'path': '',
+                    'depth': depth,
+                }
+            else:
+                continue
+            for key in CHROME_META_KEYS:
+                if key in info:
+                    node[key] = info[key]
+            if stack:
+                stack[-1].append(node)
+            else:
+                if root_names and kind == 'folder' and root_name in root_names:
+                    node['name'] = root_names[root_name]
+                bookmarks.append(node)
+
+    _assign_paths(bookmarks)
+    return bookmarks
+
+# 由于名称在子节点之后才读到，路径在整棵树建好之后自顶向下统一填写
+def _assign_paths(bookmarks):
+    stack = [(bookmarks, '')]
+    while stack:
+        items, path = stack.pop()
+        for item in items:
+            if item['type'] == 'folder':
+                item['path'] = f"{path}/{item['name']}" if path else item['name']
+                stack.append((item['children'], item['path']))
+            else:
+                item['path'] = path
+
+# 流式读取Chrome书签文件并返回书签列表
+def parse_bookmarks_file(bookmarks_file, on_root=None, root_names=None):
+    with open(bookmarks_file, 'r', encoding='utf-8') as f:
+        return build_bookmarks(iter_bookmark_events(f), on_root, root_names)
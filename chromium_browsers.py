@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+# Chromium系浏览器的书签文件与Chrome格式相同（用户数据目录/配置文件目录/Bookmarks），读取和写入共用step1和step4的代码，
+# 只有安装位置、进程名和根文件夹的名称不同：
+# - name: 显示名称
+# - user_data_dir: 各平台的用户数据目录（Windows上相对于%LOCALAPPDATA%）
+# - app: macOS上的应用名称（通过osascript退出）
+# - process: Windows上的映像名和Linux上的进程名（按名称完全匹配，pkill -x）；Chrome和Chromium在Windows上
+#   都是chrome.exe，另外用win_dir按程序所在的目录区分
+# - root_names: 写入书签文件时根文件夹（bookmark_bar、other、synced）使用的名称
+BROWSERS = {
+    'chrome': {
+        'name': 'Chrome',
+        'user_data_dir': {
+            'darwin': '~/Library/Application Support/Google/Chrome',
+            'win': r'Google\Chrome\User Data',
+            'linux': '~/.config/google-chrome',
+        },
+        'app': 'Google Chrome',
+        'process': {'win': 'chrome.exe', 'win_dir': r'Google\Chrome\Application', 'linux': 'chrome'},
+        'root_names': {'bookmark_bar': '书签栏', 'other': '其他书签', 'synced': '移动设备书签'},
+    },
+    'edge': {
+        'name': 'Edge',
+        'user_data_dir': {
+            'darwin': '~/Library/Application Support/Microsoft Edge',
+            'win': r'Microsoft\Edge\User Data',
+            'linux': '~/.config/microsoft-edge',
+        },
+        'app': 'Microsoft Edge',
+        'process': {'win': 'msedge.exe', 'linux': 'msedge'},
+        'root_names': {'bookmark_bar': '收藏夹栏', 'other': '其他收藏夹', 'synced': '移动收藏夹'},
+    },
+    'brave': {
+        'name': 'Brave',
+        'user_data_dir': {
+            'darwin': '~/Library/Application Support/BraveSoftware/Brave-Browser',
+            'win': r'BraveSoftware\Brave-Browser\User Data',
+            'linux': '~/.config/BraveSoftware/Brave-Browser',
+        },
+        'app': 'Brave Browser',
+        'process': {'win': 'brave.exe', 'linux': 'brave'},
+        'root_names': {'bookmark_bar': '书签栏', 'other': '其他书签', 'synced': '移动设备书签'},
+    },
+    'vivaldi': {
+        'name': 'Vivaldi',
+        'user_data_dir': {
+            'darwin': '~/Library/Application Support/Vivaldi',
+            'win': r'Vivaldi\User Data',
+            'linux': '~/.config/vivaldi',
+        },
+        'app': 'Vivaldi',
+        'process': {'win': 'vivaldi.exe', 'linux': 'vivaldi-bin'},
+        'root_names': {'bookmark_bar': '书签', 'other': '其他书签', 'synced': '移动设备书签'},
+    },
+    'chromium': {
+        'name': 'Chromium',
+        'user_data_dir': {
+            'darwin': '~/Library/Application Support/Chromium',
+            'win': r'Chromium\User Data',
+            'linux': '~/.config/chromium',
+        },
+        'app': 'Chromium',
+        'process': {'win': 'chrome.exe', 'win_dir': r'Chromium\Application', 'linux': 'chromium'},
+        'root_names': {'bookmark_bar': '书签栏', 'other': '其他书签', 'synced': '移动设备书签'},
+    },
+}
+
+# 合并时使用的根文件夹名称（与step4的CHROME_ROOTS相同，step3的ROOT_FOLDER_ALIASES可以识别）
+# 其他浏览器的根文件夹（如Edge的"收藏夹栏"、英文界面的"Favorites bar"）读取时按根目录的键改为这些名称
+CANONICAL_ROOT_NAMES = BROWSERS['chrome']['root_names']
+
+# 浏览器的显示名称
+def browser_name(browser):
+    return BROWSERS[browser]['name']
+
+# 浏览器的用户数据目录（包含Local State和各个配置文件的目录），不支持的操作系统返回None
+def get_user_data_dir(browser='chrome'):
+    paths = BROWSERS[browser]['user_data_dir']
+    # macOS路径
+    if sys.platform == 'darwin':
+        return os.path.expanduser(paths['darwin'])
+    # Windows路径
+    elif sys.platform.startswith('win'):
+        return os.path.join(os.environ['LOCALAPPDATA'], paths['win'])
+    # Linux路径
+    elif sys.platform.startswith('linux'):
+        return os.path.expanduser(paths['linux'])
+    else:
+        print(f"不支持的操作系统: {sys.platform}")
+        return None
+
+# 读取时替换的根文件夹名称：Chrome保持文件中的名称，其他浏览器改为CANONICAL_ROOT_NAMES
+def read_root_names(browser):
+    return None if browser == 'chrome' else CANONICAL_ROOT_NAMES
+
+# 检测已安装的浏览器，返回[(浏览器, Default配置文件的书签文件路径)]，按BROWSERS中的顺序（Chrome在前）
+def detect_browsers():
+    detected = []
+    for browser in BROWSERS:
+        user_data_dir = get_user_data_dir(browser)
+        bookmarks_file = user_data_dir and os.path.join(user_data_dir, 'Default', 'Bookmarks')
+        if bookmarks_file and os.path.exists(bookmarks_file):
+            detected.append((browser, bookmarks_file))
+    return detected
+
+# 按--browsers参数选择浏览器："all"表示检测到的全部浏览器，否则为逗号分隔的浏览器（如edge,brave）
+# 返回[(浏览器, 书签文件路径)]，有不支持或没有书签文件的浏览器时返回None
+def select_browsers(spec):
+    detected = detect_browsers()
+    if spec == 'all':
+        return detected
+
+    wanted = [name.strip().lower() for name in spec.split(',') if name.strip()]
+    for browser in wanted:
+        if browser not in BROWSERS:
+            print(f"错误: 不支持的浏览器: {browser}（支持: {', '.join(BROWSERS)}）")
+            return None
+        if browser not in dict(detected):
+            print(f"错误: 找不到{browser_name(browser)}的书签文件")
+            return None
+    return [(browser, path) for browser, path in detected if browser in wanted]
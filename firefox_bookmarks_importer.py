@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import configparser
+from urllib.parse import quote
+
+import instrumentation
+from step4_sync_to_chrome import CHROME_EPOCH_OFFSET
+from html_bookmarks_importer import ROOT_PATH, count_bookmarks
+
+# moz_bookmarks中的类型：书签、文件夹、分隔线
+TYPE_BOOKMARK = 1
+TYPE_FOLDER = 2
+
+# Firefox的根文件夹（按固定的guid识别）对应的名称：工具栏、其他书签和移动设备书签使用Chrome根文件夹的名称，
+# 合并时与Chrome对应的根文件夹合并（见step3的ROOT_FOLDER_ALIASES）；标签不是书签，不读取
+ROOT_GUID = 'root________'
+TAGS_GUID = 'tags________'
+ROOT_NAMES = {
+    'toolbar_____': 'Bookmarks Bar',
+    'unfiled_____': 'Other Bookmarks',
+    'mobile______': 'Mobile Bookmarks',
+    'menu________': 'Bookmarks Menu',
+}
+
+# 一次查询取出全部书签：递归CTE从根文件夹的子项开始逐层展开（跳过标签），按(层级, 父节点, 位置)排序，
+# 父文件夹总是先于它的子项出现，读取时一遍即可重建书签树
+BOOKMARKS_QUERY = """
+WITH RECURSIVE tree(id, level) AS (
+    SELECT b.id, 0 FROM moz_bookmarks b
+    WHERE b.parent = (SELECT id FROM moz_bookmarks WHERE guid = :root) AND b.guid <> :tags
+    UNION ALL
+    SELECT b.id, tree.level + 1 FROM moz_bookmarks b JOIN tree ON b.parent = tree.id
+)
+SELECT b.id, b.parent, b.type, b.title, b.guid, b.dateAdded, b.lastModified, p.url, tree.level
+FROM tree
+JOIN moz_bookmarks b ON b.id = tree.id
+LEFT JOIN moz_places p ON p.id = b.fk
+ORDER BY tree.level, b.parent, b.position
+"""
+
+# Firefox数据目录（包含profiles.ini）
+def get_firefox_dir():
+    # macOS路径
+    if sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Application Support/Firefox')
+    # Windows路径
+    elif sys.platform.startswith('win'):
+        return os.path.join(os.environ['APPDATA'], r'Mozilla\Firefox')
+    # Linux路径（snap安装的Firefox使用单独的目录）
+    elif sys.platform.startswith('linux'):
+        firefox_dir = os.path.expanduser('~/.mozilla/firefox')
+        snap_dir = os.path.expanduser('~/snap/firefox/common/.mozilla/firefox')
+        if not os.path.exists(firefox_dir) and os.path.exists(snap_dir):
+            return snap_dir
+        return firefox_dir
+    else:
+        print(f"不支持的操作系统: {sys.platform}")
+        return None
+
+# 从profiles.ini读取所有配置文件，返回[(配置文件名称, places.sqlite路径)]
+# 默认配置文件（[Install*]中的Default，其次是Default=1的配置文件）排在最前面，只返回存在places.sqlite的配置文件
+def list_profiles(firefox_dir=None):
+    firefox_dir = firefox_dir or get_firefox_dir()
+    if not firefox_dir:
+        return []
+
+    config = configparser.ConfigParser(interpolation=None)
+    try:
+        config.read(os.path.join(firefox_dir, 'profiles.ini'), encoding='utf-8')
+    except configparser.Error as e:
+        print(f"无法读取Firefox的profiles.ini: {e}")
+        return []
+
+    defaults = [config[section].get('Default') for section in config.sections() if section.startswith('Install')]
+    profiles = []
+    for section in config.sections():
+        if not section.startswith('Profile') or 'Path' not in config[section]:
+            continue
+        info = config[section]
+        path = info['Path']
+        profile_dir = os.path.join(firefox_dir, path) if info.get('IsRelative', '1') == '1' else path
+        places_file = os.path.join(profile_dir, 'places.sqlite')
+        if os.path.exists(places_file):
+            rank = 0 if path in defaults else 1 if info.get('Default') == '1' else 2
+            profiles.append((rank, info.get('Name') or path, places_file))
+    return [(name, places_file) for _, name, places_file in sorted(profiles, key=lambda profile: profile[0])]
+
+# 按配置文件名称（或places.sqlite/配置文件目录的路径）查找places.sqlite，name为空时使用默认配置文件
+def get_places_path(name=None, firefox_dir=None):
+    if name and os.path.isdir(name):
+        name = os.path.join(name, 'places.sqlite')
+    if name and os.path.isfile(name):
+        return name
+    for profile_name, places_file in list_profiles(firefox_dir):
+        if not name or profile_name == name:
+            return places_file
+    return None
+
+# 以只读的immutable URI打开places.sqlite：不加锁也不读取-wal文件，Firefox运行时（数据库被它独占锁定）也能读取；
+# Firefox还没有写回主文件的最近修改（仍在-wal中）要等它下次checkpoint或退出后才能读到
+def open_places(places_file):
+    uri = f"file:{quote(os.path.abspath(places_file))}?immutable=1"
+    return sqlite3.connect(uri, uri=True)
+
+# Firefox的时间（从1970年开始的微秒数）转换为Chrome使用的从1601年开始的微秒数，无效时返回None
+def to_chrome_timestamp(value):
+    if not value or value <= 0:
+        return None
+    return str(value + CHROME_EPOCH_OFFSET * 1000000)
+
+# 读取places.sqlite中的书签，返回与step1的parse_bookmarks相同结构的书签列表
+# Firefox的guid不是Chrome使用的UUID格式，不保留，写入Chrome时由step4生成
+@instrumentation.timed('firefox.read_firefox_bookmarks')
+def read_firefox_bookmarks(places_file):
+    wal_file = places_file + '-wal'
+    if os.path.exists(wal_file) and os.path.getsize(wal_file) > 0:
+        print("注意: Firefox最近的书签修改可能还在places.sqlite-wal中，要等Firefox写回主文件（通常在退出时）后才能读到")
+    connection = open_places(places_file)
+    try:
+        rows = connection.execute(BOOKMARKS_QUERY, {'root': ROOT_GUID, 'tags': TAGS_GUID}).fetchall()
+    finally:
+        connection.close()
+
+    bookmarks = []
+    # 文件夹id -> (子项列表, 文件夹路径, 子项的深度)
+    folders = {}
+    for item_id, parent, item_type, title, guid, date_added, last_modified, url, level in rows:
+        if level == 0:
+            target, parent_path, depth = bookmarks, '', 0
+        elif parent in folders:
+            target, parent_path, depth = folders[parent]
+        else:
+            continue
+
+        if item_type == TYPE_FOLDER:
+            name = (ROOT_NAMES.get(guid) if level == 0 else None) or title or 'Unnamed Folder'
+            path = f"{parent_path}/{name}" if parent_path else name
+            info = {'type': 'folder', 'name': name, 'path': path, 'depth': depth, 'children': []}
+            folders[item_id] = (info['children'], path, depth + 1)
+        elif item_type == TYPE_BOOKMARK and url and not url.startswith('place:'):
+            # place:开头的是"最近使用"等智能查询，不是网页
+            info = {'type': 'url', 'name': title or url, 'url': url, 'path': parent_path or ROOT_PATH, 'depth': depth}
+        else:
+            continue
+        date_added = to_chrome_timestamp(date_added)
+        if date_added:
+            info['date_added'] = date_added
+        date_modified = to_chrome_timestamp(last_modified) if item_type == TYPE_FOLDER else None
+        if date_modified:
+            info['date_modified'] = date_modified
+        target.append(info)
+
+    # 空的根文件夹（如没有使用过的书签菜单）不参与合并
+    bookmarks = [item for item in bookmarks if item['type'] != 'folder' or item['children']]
+    instrumentation.count('firefox.bytes_read', os.path.getsize(places_file))
+    instrumentation.count_nodes('firefox.nodes_parsed', bookmarks)
+    return bookmarks
+
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="读取Firefox的places.sqlite中的书签（Firefox运行时也可以读取）")
+    parser.add_argument('profile', nargs='?',
+                        help="Firefox配置文件名称、配置文件目录或places.sqlite路径（默认使用默认配置文件）")
+    parser.add_argument('--list-profiles', action='store_true', help="列出Firefox配置文件后退出")
+    parser.add_argument('--output', help="把书签保存为JSON文件（格式与step1/step2的输出相同）")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+    if args.list_profiles:
+        for name, places_file in list_profiles():
+            print(f"{name}: {places_file}")
+        return 0
+
+    places_file = get_places_path(args.profile)
+    if not places_file:
+        print(f"错误: 找不到Firefox书签数据库: {args.profile or '默认配置文件'}")
+        return 1
+
+    print(f"正在读取Firefox书签数据库: {places_file}")
+    try:
+        bookmarks = read_firefox_bookmarks(places_file)
+    except sqlite3.Error as e:
+        print(f"读取Firefox书签数据库时出错: {e}")
+        return 1
+    urls, folders = count_bookmarks(bookmarks)
+    print(f"共 {urls} 个书签，{folders} 个文件夹")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(bookmarks, f, ensure_ascii=False, indent=2)
+        print(f"书签已保存到: {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
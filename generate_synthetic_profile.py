@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import uuid
+import random
+import argparse
+import plistlib
+from datetime import datetime
+
+from step4_sync_to_chrome import compute_chrome_checksum
+
+# Chrome的时间戳从1601-01-01开始，单位为微秒
+CHROME_EPOCH_OFFSET = 11644473600
+
+# 生成标题时使用的词汇，覆盖多种文字和emoji
+ASCII_WORDS = ['python', 'docs', 'guide', 'news', 'blog', 'shop', 'music', 'video', 'api', 'forum',
+               'travel', 'recipe', 'design', 'cloud', 'linux', 'review', 'tutorial', 'weather']
+UNICODE_WORDS = ['书签', '学习', '工作', '新闻', '音乐', '旅行', 'ドキュメント', 'ニュース', '東京',
+                 'Новости', 'Музыка', 'Ελληνικά', 'café', 'naïve', 'Ümlaut', 'العربية', 'עברית',
+                 '한국어', '📚', '🎵', '🚀', '✈️']
+DOMAINS = ['example.com', 'python.org', 'github.com', 'wikipedia.org', 'baidu.com', 'news.ycombinator.com',
+           'developer.apple.com', 'stackoverflow.com', 'bilibili.com', 'zhihu.com', 'medium.com', 'youtube.com']
+
+# 由随机数生成器产生GUID，使相同的种子生成完全相同的文件
+def random_guid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+# Chrome和Safari共用的中间结构：文件夹为(名称, 子项列表)，书签为(名称, URL)
+class ProfileGenerator:
+    def __init__(self, seed=0, dup_rate=0.05, unicode_rate=0.3):
+        self.rng = random.Random(seed)
+        self.dup_rate = dup_rate
+        self.unicode_rate = unicode_rate
+        self.urls = []
+        self.counter = 0
+
+    # 生成标题，按unicode_rate混入非ASCII文字
+    def title(self, words=3):
+        rng = self.rng
+        parts = []
+        for _ in range(rng.randint(1, words)):
+            pool = UNICODE_WORDS if rng.random() < self.unicode_rate else ASCII_WORDS
+            parts.append(rng.choice(pool))
+        return ' '.join(parts).title() if parts[0] in ASCII_WORDS else ' '.join(parts)
+
+    # 生成URL，按dup_rate复用已有URL（附带大小写、尾部斜杠、跟踪参数等变体）
+    def url(self):
+        rng = self.rng
+        if self.urls and rng.random() < self.dup_rate:
+            url = rng.choice(self.urls)
+            variant = rng.randrange(4)
+            if variant == 1:
+                url = url + ('&' if '?' in url else '?') + 'utm_source=newsletter'
+            elif variant == 2:
+                url = url.replace('https://', 'https://WWW.', 1) if '://www.' not in url else url.upper()
+            elif variant == 3:
+                url = url.rstrip('/') if url.endswith('/') else url + '/'
+            return url
+
+        self.counter += 1
+        domain = rng.choice(DOMAINS)
+        path = '/'.join(rng.choice(ASCII_WORDS) for _ in range(rng.randint(0, 3)))
+        url = f"https://www.{domain}/{path}"
+        if rng.random() < 0.3:
+            url += f"?id={self.counter}"
+        else:
+            url += f"#{self.counter}" if rng.random() < 0.1 else ('/' if path else '') + str(self.counter)
+        self.urls.append(url)
+        return url
+
+    # 生成一棵包含count个书签的文件夹树
+    # 文件夹逐层展开：每个文件夹最多fanout个子项，其中一部分是子文件夹（深度未达到max_depth时）
+    # 所有文件夹都填满后剩余的书签直接放在顶层，模拟常见的大型平铺文件夹
+    def tree(self, count, max_depth=4, fanout=20, folder_rate=0.15):
+        rng = self.rng
+        root = []
+        queue = [(root, 0)]
+        remaining = count
+        head = 0
+        while remaining > 0 and head < len(queue):
+            children, depth = queue[head]
+            head += 1
+            for _ in range(fanout):
+                if remaining <= 0:
+                    break
+                if depth < max_depth and rng.random() < folder_rate:
+                    folder_children = []
+                    children.append((self.title(2), folder_children))
+                    queue.append((folder_children, depth + 1))
+                else:
+                    children.append((self.title(), self.url()))
+                    remaining -= 1
+        while remaining > 0:
+            root.append((self.title(), self.url()))
+            remaining -= 1
+        return root
+
+# 将中间结构转换为Chrome节点，返回(节点, 下一个可用id)
+def to_chrome_nodes(items, next_id, timestamp, rng):
+    result = []
+    # 显式栈，避免深层文件夹触发递归深度限制
+    stack = [(iter(items), result)]
+    while stack:
+        iterator, target = stack[-1]
+        item = next(iterator, None)
+        if item is None:
+            stack.pop()
+            continue
+        name, value = item
+        node = {'date_added': str(timestamp), 'guid': random_guid(rng), 'id': str(next_id), 'name': name}
+        next_id += 1
+        if isinstance(value, list):
+            node.update({'children': [], 'date_modified': str(timestamp), 'type': 'folder'})
+            stack.append((iter(value), node['children']))
+        else:
+            node.update({'type': 'url', 'url': value})
+        target.append(node)
+    return result, next_id
+
+# 生成Chrome书签文件内容（bookmark_bar、other、synced三个根目录）
+def build_chrome_profile(roots, rng):
+    timestamp = int((datetime.now().timestamp() + CHROME_EPOCH_OFFSET) * 1000000)
+    data = {'checksum': '', 'roots': {}, 'version': 1}
+    next_id = 4
+    for root_id, (root_key, root_name) in enumerate([('bookmark_bar', 'Bookmarks Bar'),
+                                                      ('other', 'Other Bookmarks'),
+                                                      ('synced', 'Mobile Bookmarks')], start=1):
+        children, next_id = to_chrome_nodes(roots.get(root_key, []), next_id, timestamp, rng)
+        data['roots'][root_key] = {
+            'children': children,
+            'date_added': str(timestamp),
+            'date_modified': str(timestamp),
+            'guid': random_guid(rng),
+            'id': str(root_id),
+            'name': root_name,
+            'type': 'folder',
+        }
+    data['checksum'] = compute_chrome_checksum(data['roots'])
+    return data
+
+# 将中间结构转换为Safari节点
+def to_safari_nodes(items, rng):
+    result = []
+    stack = [(iter(items), result)]
+    while stack:
+        iterator, target = stack[-1]
+        item = next(iterator, None)
+        if item is None:
+            stack.pop()
+            continue
+        name, value = item
+        if isinstance(value, list):
+            node = {
+                'Title': name,
+                'WebBookmarkType': 'WebBookmarkTypeList',
+                'WebBookmarkUUID': random_guid(rng).upper(),
+                'Children': [],
+            }
+            stack.append((iter(value), node['Children']))
+        else:
+            node = {
+                'URIDictionary': {'title': name},
+                'URLString': value,
+                'WebBookmarkType': 'WebBookmarkTypeLeaf',
+                'WebBookmarkUUID': random_guid(rng).upper(),
+            }
+        target.append(node)
+    return result
+
+# 生成Safari书签文件内容（BookmarksBar、BookmarksMenu、普通文件夹和阅读列表）
+def build_safari_profile(bar_items, other_items, rng):
+    def special_folder(title, children):
+        return {
+            'Title': title,
+            'WebBookmarkType': 'WebBookmarkTypeList',
+            'WebBookmarkUUID': random_guid(rng).upper(),
+            'Children': children,
+        }
+
+    return {
+        'Title': '',
+        'WebBookmarkFileVersion': 1,
+        'WebBookmarkType': 'WebBookmarkTypeList',
+        'WebBookmarkUUID': 'Root',
+        'Children': [
+            special_folder('BookmarksBar', to_safari_nodes(bar_items, rng)),
+            special_folder('BookmarksMenu', []),
+            *to_safari_nodes(other_items, rng),
+            special_folder('com.apple.ReadingList', []),
+        ],
+    }
+
+# 生成一对Chrome/Safari书签文件，返回(Chrome文件路径, Safari文件路径)
+# overlap为Safari书签中与Chrome相同URL的比例，用于模拟两个浏览器之间的重复书签
+def generate_profiles(output_dir, size=1000, safari_size=None, depth=4, fanout=20,
+                      dup_rate=0.05, unicode_rate=0.3, overlap=0.3, seed=0):
+    safari_size = size if safari_size is None else safari_size
+    os.makedirs(output_dir, exist_ok=True)
+
+    chrome_generator = ProfileGenerator(seed, dup_rate, unicode_rate)
+    bar_count = size * 3 // 10
+    mobile_count = size // 20
+    chrome_roots = {
+        'bookmark_bar': chrome_generator.tree(bar_count, depth, fanout),
+        'other': chrome_generator.tree(size - bar_count - mobile_count, depth, fanout),
+        'synced': chrome_generator.tree(mobile_count, depth, fanout),
+    }
+    chrome_file = os.path.join(output_dir, 'Bookmarks')
+    with open(chrome_file, 'w', encoding='utf-8') as f:
+        json.dump(build_chrome_profile(chrome_roots, chrome_generator.rng), f, ensure_ascii=False, indent=3)
+
+    # Safari复用Chrome生成器的URL池，按overlap比例产生两个浏览器共有的书签
+    safari_generator = ProfileGenerator(seed + 1, overlap, unicode_rate)
+    safari_generator.urls = chrome_generator.urls
+    bar_count = safari_size // 5
+    safari_data = build_safari_profile(
+        safari_generator.tree(bar_count, depth, fanout),
+        safari_generator.tree(safari_size - bar_count, depth, fanout),
+        safari_generator.rng,
+    )
+    safari_file = os.path.join(output_dir, 'Bookmarks.plist')
+    with open(safari_file, 'wb') as f:
+        plistlib.dump(safari_data, f, fmt=plistlib.FMT_BINARY)
+
+    return chrome_file, safari_file
+
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="生成用于测试和性能测试的Chrome/Safari书签文件")
+    parser.add_argument('output_dir', help="输出目录，生成Bookmarks和Bookmarks.plist")
+    parser.add_argument('--size', type=int, default=1000, help="Chrome书签数量（默认: 1000）")
+    parser.add_argument('--safari-size', type=int, help="Safari书签数量（默认与--size相同）")
+    parser.add_argument('--depth', type=int, default=4, help="文件夹最大嵌套深度（默认: 4）")
+    parser.add_argument('--fanout', type=int, default=20, help="每个文件夹的子项数量（默认: 20）")
+    parser.add_argument('--dup-rate', type=float, default=0.05, help="同一浏览器内重复URL的比例（默认: 0.05）")
+    parser.add_argument('--unicode-rate', type=float, default=0.3, help="标题中非ASCII词语的比例（默认: 0.3）")
+    parser.add_argument('--overlap', type=float, default=0.3, help="Safari中与Chrome重复的URL比例（默认: 0.3）")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子（默认: 0）")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+    chrome_file, safari_file = generate_profiles(
+        args.output_dir,
+        size=args.size,
+        safari_size=args.safari_size,
+        depth=args.depth,
+        fanout=args.fanout,
+        dup_rate=args.dup_rate,
+        unicode_rate=args.unicode_rate,
+        overlap=args.overlap,
+        seed=args.seed,
+    )
+    print(f"已生成Chrome书签文件: {chrome_file} ({os.path.getsize(chrome_file)} 字节)")
+    print(f"已生成Safari书签文件: {safari_file} ({os.path.getsize(safari_file)} 字节)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
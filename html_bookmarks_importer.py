@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import argparse
+from html.parser import HTMLParser
+
+from step4_sync_to_chrome import CHROME_EPOCH_OFFSET
+
+# 每次从文件中读取的字符数
+CHUNK_SIZE = 256 * 1024
+
+# 不在任何文件夹中的书签使用的路径，与Safari书签的顶层书签一致
+ROOT_PATH = "根目录"
+
+# 把HTML中的Unix时间戳（秒）转换为Chrome使用的从1601年开始的微秒数，无效时返回None
+def to_chrome_timestamp(value):
+    try:
+        seconds = int(value)
+    except (TypeError, ValueError):
+        return None
+    if seconds <= 0:
+        return None
+    return str((seconds + CHROME_EPOCH_OFFSET) * 1000000)
+
+# 把<H3>或<A>标签的ADD_DATE、LAST_MODIFIED、ICON属性保存到节点中
+# 时间保存为与Chrome书签相同的date_added/date_modified，后续写回Chrome和导出HTML时沿用
+def copy_html_attrs(attrs, info):
+    date_added = to_chrome_timestamp(attrs.get('add_date'))
+    if date_added:
+        info['date_added'] = date_added
+    date_modified = to_chrome_timestamp(attrs.get('last_modified'))
+    if date_modified:
+        info['date_modified'] = date_modified
+    if attrs.get('icon'):
+        info['icon'] = attrs['icon']
+
+# Netscape书签HTML（各浏览器"导出书签"生成的文件）的增量解析器
+# 可以分多次feed，已解析的部分不会保留在内存中；输出与step1的parse_bookmarks相同的节点结构
+# 文件中的<DT>和<p>标签都不闭合，因此只根据<H3>、<A>和<DL>来确定层级：
+# <H3>之后的第一个<DL>是该文件夹的子项列表，其他<DL>（如最外层的列表）不产生新的层级
+class NetscapeBookmarkParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.bookmarks = []
+        # 栈中保存(子项要追加到的列表, 当前路径, 子项的深度)
+        self.stack = [(self.bookmarks, '', 0)]
+        # 刚读完<H3>、还没有遇到<DL>的文件夹
+        self.pending_folder = None
+        # 正在读取标题的节点和标题文本片段
+        self.current = None
+        self.text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'h3' or tag == 'a':
+            attrs = dict(attrs)
+            target, path, depth = self.stack[-1]
+            if tag == 'h3':
+                info = {'type': 'folder', 'name': '', 'path': '', 'depth': depth, 'children': []}
+            else:
+                info = {'type': 'url', 'name': '', 'url': attrs.get('href') or '',
+                        'path': path or ROOT_PATH, 'depth': depth}
+            copy_html_attrs(attrs, info)
+            target.append(info)
+            self.current = info
+            self.text = []
+            self.pending_folder = None
+        elif tag == 'dl':
+            folder = self.pending_folder
+            if folder is not None:
+                self.stack.append((folder['children'], folder['path'], folder['depth'] + 1))
+            else:
+                self.stack.append(self.stack[-1])
+            self.pending_folder = None
+
+    def handle_endtag(self, tag):
+        if tag == 'h3' or tag == 'a':
+            info = self.current
+            if info is None:
+                return
+            name = ''.join(self.text).strip()
+            if info['type'] == 'folder':
+                info['name'] = name or 'Unnamed Folder'
+                parent_path = self.stack[-1][1]
+                info['path'] = f"{parent_path}/{info['name']}" if parent_path else info['name']
+                self.pending_folder = info
+            else:
+                info['name'] = name or 'Unnamed Bookmark'
+            self.current = None
+            self.text = []
+        elif tag == 'dl':
+            # 最外层不出栈，容忍多余的</DL>
+            if len(self.stack) > 1:
+                self.stack.pop()
+            self.pending_folder = None
+
+    def handle_data(self, data):
+        if self.current is not None:
+            self.text.append(data)
+
+# 解析Netscape书签HTML文件，返回书签列表
+# 文件按块读取并交给解析器，内存占用与书签数量有关，与文件中的图标等内容的总大小无关
+def read_html_bookmarks(html_file, chunk_size=CHUNK_SIZE):
+    parser = NetscapeBookmarkParser()
+    with open(html_file, 'r', encoding='utf-8', errors='replace') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            parser.feed(chunk)
+    parser.close()
+    return parser.bookmarks
+
+# 统计书签和文件夹数量
+def count_bookmarks(bookmarks):
+    urls = folders = 0
+    stack = [bookmarks]
+    while stack:
+        for item in stack.pop():
+            if item['type'] == 'folder':
+                folders += 1
+                stack.append(item['children'])
+            else:
+                urls += 1
+    return urls, folders
+
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="解析浏览器导出的Netscape书签HTML文件")
+    parser.add_argument('html_file', help="导出的书签HTML文件")
+    parser.add_argument('--output', help="把解析结果保存为JSON文件（格式与step1/step2的输出相同）")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.html_file):
+        print(f"错误: 书签HTML文件不存在: {args.html_file}")
+        return 1
+
+    print(f"正在读取书签HTML文件: {args.html_file}")
+    bookmarks = read_html_bookmarks(args.html_file)
+    urls, folders = count_bookmarks(bookmarks)
+    print(f"共解析 {urls} 个书签，{folders} 个文件夹")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(bookmarks, f, ensure_ascii=False, indent=2)
+        print(f"书签已保存到: {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
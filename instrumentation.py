@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+import functools
+import contextlib
+import tracemalloc
+from datetime import datetime
+
+import source_cache
+
+# 每次运行的指标文件保存在缓存目录中，只保留最近的MAX_METRICS_FILES个
+MAX_METRICS_FILES = 50
+
+# 指标目录在调用时按source_cache.CACHE_DIR计算，缓存目录被改到别处时指标文件也一起写到那里
+def metrics_dir():
+    return os.path.join(source_cache.CACHE_DIR, 'metrics')
+
+# 指标文件中保存的cProfile热点函数数量（按累计耗时排序）
+PROFILE_TOP = 30
+
+# 当前运行的指标；为None时measure、timed和count都直接返回，几乎没有额外开销
+_run = None
+_lock = threading.Lock()
+# 每个线程正在测量的调用栈，用于计算嵌套测量时外层的内存峰值
+_local = threading.local()
+
+# 开始记录一次运行的指标
+# trace_memory为True时用tracemalloc记录各步骤和函数的内存峰值（会明显拖慢运行，
+# 并且峰值只在各步骤依次执行时准确）；profile_step为要用cProfile分析的步骤或函数名称
+def start(trace_memory=False, profile_step=None):
+    global _run
+    _run = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'wall_start': time.perf_counter(),
+        'cpu_start': time.process_time(),
+        'trace_memory': trace_memory,
+        'profile_step': profile_step,
+        'profiler': cProfile.Profile() if profile_step else None,
+        'steps': {},
+        'functions': {},
+        'counters': {},
+    }
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+# 是否正在记录指标
+def enabled():
+    return _run is not None
+
+# 测量一段代码的墙钟时间、本线程的CPU时间和（可选的）内存峰值，结果累加到kind分区中名为name的条目
+# 内存峰值是相对于进入时已分配内存的增量；多次调用时取最大值
+# kind为'steps'（run_pipeline中的步骤）或'functions'（热点函数）
+@contextlib.contextmanager
+def measure(name, kind='functions'):
+    run = _run
+    if run is None:
+        yield
+        return
+
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    frame = {'inner_peak': 0}
+    if run['trace_memory']:
+        current, peak_before = tracemalloc.get_traced_memory()
+        frame['start'] = current
+        frame['peak_before'] = peak_before
+        tracemalloc.reset_peak()
+    stack.append(frame)
+
+    profiler = run['profiler'] if name == run['profile_step'] else None
+    if profiler is not None:
+        profiler.enable()
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.thread_time() - cpu_start
+        if profiler is not None:
+            profiler.disable()
+        stack.pop()
+
+        peak = None
+        if run['trace_memory'] and 'start' in frame:
+            # reset_peak会清掉外层已经达到的峰值，所以把本层看到的峰值交给外层
+            absolute_peak = max(tracemalloc.get_traced_memory()[1], frame['inner_peak'])
+            peak = absolute_peak - frame['start']
+            if stack:
+                stack[-1]['inner_peak'] = max(stack[-1]['inner_peak'], absolute_peak, frame['peak_before'])
+
+        with _lock:
+            entry = run[kind].setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+            entry['calls'] += 1
+            entry['wall_seconds'] += wall
+            entry['cpu_seconds'] += cpu
+            if peak is not None:
+                entry['peak_bytes'] = max(entry.get('peak_bytes', 0), peak)
+
+# 用timed装饰的函数的名称（模块导入时登记），供--cprofile检查要分析的函数是否存在
+TIMED_NAMES = set()
+
+# 装饰器：每次调用函数时用measure记录（不要用于递归函数，否则每层递归都会记录一次）
+def timed(name):
+    TIMED_NAMES.add(name)
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _run is None:
+                return func(*args, **kwargs)
+            with measure(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# 累加计数器，例如解析的节点数、去掉的重复书签数、写入的字节数
+def count(name, value=1):
+    run = _run
+    if run is None:
+        return
+    with _lock:
+        run['counters'][name] = run['counters'].get(name, 0) + value
+
+# 统计书签树中的节点数量并累加到计数器（未记录指标时不遍历）
+def count_nodes(name, bookmarks):
+    if _run is None or not bookmarks:
+        return
+    nodes = 0
+    stack = [bookmarks]
+    while stack:
+        for item in stack.pop():
+            nodes += 1
+            if item.get('type') == 'folder':
+                stack.append(item.get('children', []))
+    count(name, nodes)
+
+# 默认的指标文件路径：按运行时间命名
+def default_metrics_file():
+    return os.path.join(metrics_dir(), f"run_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.json")
+
+# 删除多余的旧指标文件（以及对应的pstats文件）
+def prune_metrics_dir(keep=MAX_METRICS_FILES):
+    try:
+        names = sorted(name for name in os.listdir(metrics_dir()) if name.startswith('run_'))
+    except OSError:
+        return
+    runs = sorted({name.split('.', 1)[0] for name in names})
+    stale = set(runs[:-keep]) if keep else set(runs)
+    for name in names:
+        if name.split('.', 1)[0] in stale:
+            try:
+                os.remove(os.path.join(metrics_dir(), name))
+            except OSError:
+                pass
+
+# 把cProfile结果中累计耗时最多的函数整理成可以写入JSON的列表
+def profile_summary(profiler, top=PROFILE_TOP):
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return [{'function': f"{os.path.basename(filename)}:{line}({func})", 'primitive_calls': primitive_calls,
+             'calls': calls, 'total_seconds': total, 'cumulative_seconds': cumulative}
+            for (filename, line, func), (primitive_calls, calls, total, cumulative, _) in rows]
+
+# 结束记录并把指标写入JSON文件（metrics_file为None时写入指标目录），返回指标文件路径
+# extra中的字段（例如运行参数、是否成功）原样写入指标文件
+# 分析了某个步骤时，另外把cProfile结果保存为同名的.pstats文件，可以用python3 -m pstats查看
+def finish(metrics_file=None, **extra):
+    global _run
+    run = _run
+    if run is None:
+        return None
+    _run = None
+
+    metrics = {
+        'started_at': run['started_at'],
+        'wall_seconds': time.perf_counter() - run['wall_start'],
+        'cpu_seconds': time.process_time() - run['cpu_start'],
+    }
+    metrics.update(extra)
+    if run['trace_memory']:
+        metrics['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    metrics['steps'] = run['steps']
+    metrics['functions'] = run['functions']
+    metrics['counters'] = run['counters']
+
+    auto_named = metrics_file is None
+    metrics_file = metrics_file or default_metrics_file()
+    os.makedirs(os.path.dirname(os.path.abspath(metrics_file)), exist_ok=True)
+    profiler = run['profiler']
+    if profiler is not None and profiler.getstats():
+        pstats_file = os.path.splitext(metrics_file)[0] + '.pstats'
+        profiler.dump_stats(pstats_file)
+        metrics['profile'] = {'step': run['profile_step'], 'pstats_file': pstats_file,
+                              'top': profile_summary(profiler)}
+
+    with open(metrics_file, 'w', encoding='utf-8') as f:
+        json.dump(metrics, f, ensure_ascii=False, indent=2)
+    if auto_named:
+        prune_metrics_dir()
+    return metrics_file
+
+# 打印指标文件中各热点函数的耗时和计数器
+def print_metrics(metrics_file):
+    with open(metrics_file, 'r', encoding='utf-8') as f:
+        metrics = json.load(f)
+    if metrics['functions']:
+        print("\n函数耗时:")
+        print("-" * 70)
+        print(f"{'函数':<36} {'调用':>6} {'墙钟(秒)':>10} {'CPU(秒)':>10} {'峰值(MB)':>10}")
+        for name, entry in sorted(metrics['functions'].items(), key=lambda item: -item[1]['wall_seconds']):
+            peak = entry.get('peak_bytes')
+            peak_text = f"{peak / 1024 / 1024:10.1f}" if peak is not None else f"{'-':>10}"
+            print(f"{name:<36} {entry['calls']:>6} {entry['wall_seconds']:10.3f} {entry['cpu_seconds']:10.3f} {peak_text}")
+    if metrics['counters']:
+        print("\n计数器:")
+        for name, value in sorted(metrics['counters'].items()):
+            print(f"  {name}: {value}")
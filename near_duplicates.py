@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import array
+import hashlib
+import operator
+import itertools
+import argparse
+import functools
+from urllib.parse import urlsplit
+
+import instrumentation
+import binary_snapshot
+from step3_merge_bookmarks import canonicalize_url, get_latest_bookmarks_file
+
+# MinHash签名长度（排列数）与LSH分段：NUM_PERM = BANDS * ROWS
+# 两个书签在某一段的ROWS个值全部相同时成为候选对，相似度s的书签成为候选对的概率为1-(1-s^ROWS)^BANDS，
+# 16x4时s=0.5约为64%，s=0.7约为98%，s=0.3只有12%
+NUM_PERM = 64
+BANDS = 16
+ROWS = 4
+
+# 默认的相似度阈值：候选对按签名估计的Jaccard相似度不低于该值才算近似重复
+DEFAULT_THRESHOLD = 0.7
+
+# 路径按字符切成SHINGLE_SIZE长的片段
+SHINGLE_SIZE = 4
+
+# 同一个LSH桶中的书签超过该数量时不逐对比较（通常是大量URL几乎相同的书签，例如同一站点的分页），
+# 避免退化为平方复杂度
+MAX_BUCKET_SIZE = 100
+
+# 只表示移动版、AMP等访问方式的主机名前缀，比较时去掉
+HOST_PREFIXES = ('www.', 'm.', 'mobile.', 'amp.', 'wap.')
+
+# 路径末尾的默认页面
+DEFAULT_PAGES = ('/index.html', '/index.htm', '/index.php', '/default.aspx')
+
+# 切词：ASCII字母数字、中日文字和其他文字分开切，"python教程"切成"python"和"教程"
+CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+WORD_RE = re.compile(f'[a-z0-9]+|[{CJK_CHARS}]+|[^\\W_a-z0-9{CJK_CHARS}]+')
+CJK_RE = re.compile(f'[{CJK_CHARS}]')
+
+# 在canonicalize_url的基础上做更激进的规范化，只用于计算相似度：
+# 去掉www./m.等主机前缀，路径转为小写并去掉默认页面，返回(主机名, 路径, 查询参数列表)
+def similarity_url(url):
+    canonical = canonicalize_url(url)
+    try:
+        parts = urlsplit(canonical)
+    except ValueError:
+        return '', canonical.lower(), []
+    host = parts.hostname or ''
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix) and host.count('.') > 1:
+            host = host[len(prefix):]
+            break
+    path = parts.path.lower()
+    for page in DEFAULT_PAGES:
+        if path.endswith(page):
+            path = path[:-len(page)]
+            break
+    return host, path, [param for param in parts.query.split('&') if param]
+
+# 把文本切成词；中日文不以空格分词，较长的连续中日文切成相邻两个字，略有差异的标题仍然相似
+def _words(text):
+    words = []
+    for word in WORD_RE.findall(text.lower()):
+        if len(word) <= 2 or not CJK_RE.match(word):
+            words.append(word)
+        else:
+            words.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return words
+
+# 书签的特征片段集合：
+# - 路径和排序后的查询参数按字符切成SHINGLE_SIZE长的片段（两端加上边界标记，很短的路径也有多个片段），
+#   另外整个路径和查询参数作为一个片段，URL在相似度中占主要比重
+# - 标题中的词，标题略有差异的同一页面仍然相似
+# 主机名不作为片段，只有主机名相同的书签才会互相比较（见find_near_duplicates）
+def shingles(path, query, title=''):
+    location = path.rstrip('/') + ('?' + '&'.join(sorted(query)) if query else '')
+    padded = f"^{location}$"
+    result = {padded[i:i + SHINGLE_SIZE] for i in range(max(1, len(padded) - SHINGLE_SIZE + 1))}
+    result.add('u:' + location)
+    result.update('t:' + word for word in _words(title))
+    return result
+
+# 一个片段在NUM_PERM个哈希函数下的值：一次shake_128调用产生全部NUM_PERM个32位哈希值，
+# 相当于NUM_PERM个独立的随机排列；路径和标题中的常用词会反复出现，因此缓存
+@functools.lru_cache(maxsize=262144)
+def shingle_hashes(shingle):
+    return array.array('I', hashlib.shake_128(shingle.encode('utf-8')).digest(NUM_PERM * 4))
+
+# 计算MinHash签名：每个哈希函数下所有片段的最小值
+def minhash(shingle_set):
+    if len(shingle_set) == 1:
+        return tuple(shingle_hashes(next(iter(shingle_set))))
+    return tuple(map(min, *map(shingle_hashes, shingle_set)))
+
+# 由两个签名估计Jaccard相似度：相同位置取值相同的比例
+def estimate_similarity(signature_a, signature_b):
+    return sum(map(operator.eq, signature_a, signature_b)) / len(signature_a)
+
+# 遍历书签树，返回[(书签, 所在文件夹路径)]
+def collect_bookmarks(bookmarks):
+    items = []
+    stack = [(iter(bookmarks), '')]
+    while stack:
+        item = next(stack[-1][0], None)
+        if item is None:
+            stack.pop()
+            continue
+        folder = stack[-1][1]
+        if item.get('type') == 'folder':
+            name = item.get('name', '')
+            stack.append((iter(item.get('children', [])), f"{folder}/{name}" if folder else name))
+        elif item.get('url'):
+            items.append((item, folder))
+    return items
+
+# 并查集：查找根节点（路径减半）
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+# 查找近似重复的书签：MinHash签名 + LSH分段找出候选对，再按签名估计的相似度过滤，最后用并查集聚类
+# 不同网站的书签标题再相似也不是重复，LSH桶按(主机名, 签名片段)划分，只比较同一网站的书签
+# 整体复杂度与书签数量近似线性，不需要逐对比较所有书签
+# 返回[{'score': 簇内相似度的平均值, 'min_score': 最低值, 'items': [(书签, 文件夹路径), ...]}]，按簇的大小和相似度排序
+@instrumentation.timed('near_duplicates.find_near_duplicates')
+def find_near_duplicates(bookmarks, threshold=DEFAULT_THRESHOLD):
+    items = collect_bookmarks(bookmarks)
+    hosts = []
+    signatures = []
+    for item, _ in items:
+        host, path, query = similarity_url(item['url'])
+        hosts.append(host)
+        signatures.append(minhash(shingles(path, query, item.get('name', ''))))
+
+    parent = list(range(len(items)))
+    edges = {}
+    for band in range(BANDS):
+        buckets = {}
+        band_values = map(operator.itemgetter(slice(band * ROWS, (band + 1) * ROWS)), signatures)
+        for i, key in enumerate(zip(hosts, band_values)):
+            buckets.setdefault(key, []).append(i)
+        for members in buckets.values():
+            if len(members) < 2 or len(members) > MAX_BUCKET_SIZE:
+                continue
+            for pair in itertools.combinations(members, 2):
+                if pair in edges:
+                    continue
+                score = edges[pair] = estimate_similarity(signatures[pair[0]], signatures[pair[1]])
+                if score >= threshold:
+                    root_a, root_b = _find(parent, pair[0]), _find(parent, pair[1])
+                    if root_a != root_b:
+                        parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    # 相似的两个书签一定在同一簇中，按簇的根节点收集相似度
+    cluster_scores = {}
+    for (a, _), score in edges.items():
+        if score >= threshold:
+            cluster_scores.setdefault(_find(parent, a), []).append(score)
+    members = {root: [] for root in cluster_scores}
+    for i in range(len(items)):
+        root = _find(parent, i)
+        if root in members:
+            members[root].append(i)
+
+    result = []
+    for root, scores in cluster_scores.items():
+        result.append({
+            'score': sum(scores) / len(scores),
+            'min_score': min(scores),
+            'items': [items[i] for i in members[root]],
+        })
+    result.sort(key=lambda cluster: (-len(cluster['items']), -cluster['score']))
+    return result
+
+# 合并相似度不低于threshold的近似重复簇：每簇保留第一个书签（合并结果中Chrome的书签在前），
+# 其余书签从书签树中删除，它们的来源记录到保留的书签中；返回删除的书签数量
+def collapse_near_duplicates(bookmarks, threshold):
+    removed_ids = set()
+    for cluster in find_near_duplicates(bookmarks, threshold):
+        survivor = cluster['items'][0][0]
+        sources = survivor.setdefault('sources', [survivor['source']] if survivor.get('source') else [])
+        for item, _ in cluster['items'][1:]:
+            removed_ids.add(id(item))
+            for source in item.get('sources') or [item.get('source', '')]:
+                if source and source not in sources:
+                    sources.append(source)
+
+    if removed_ids:
+        stack = [bookmarks]
+        while stack:
+            children = stack.pop()
+            children[:] = [item for item in children if id(item) not in removed_ids]
+            stack.extend(item['children'] for item in children if item.get('type') == 'folder' and 'children' in item)
+    instrumentation.count('near_duplicates.collapsed', len(removed_ids))
+    return len(removed_ids)
+
+# 把近似重复簇转换为可以写入JSON的格式
+def clusters_to_json(clusters):
+    return [{'score': round(cluster['score'], 3), 'min_score': round(cluster['min_score'], 3),
+             'items': [{'title': item.get('name', ''), 'url': item['url'], 'folder': folder,
+                        'source': item.get('source', '')} for item, folder in cluster['items']]}
+            for cluster in clusters]
+
+# 打印近似重复簇
+def print_clusters(clusters, limit=None):
+    for cluster in clusters[:limit]:
+        print(f"\n相似度 {cluster['score']:.2f}（最低 {cluster['min_score']:.2f}），{len(cluster['items'])} 个书签:")
+        for item, folder in cluster['items']:
+            print(f"  {item.get('name', '')}\n      {item['url']}  [{folder or '/'}]")
+    total = sum(len(cluster['items']) for cluster in clusters)
+    print(f"\n共 {len(clusters)} 组近似重复，涉及 {total} 个书签")
+
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="用MinHash/LSH查找合并结果中的近似重复书签")
+    parser.add_argument('input', nargs='?',
+                        help="书签文件，JSON或二进制快照（默认使用step3merged目录中最新的合并结果）")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"相似度阈值（默认: {DEFAULT_THRESHOLD}）")
+    parser.add_argument('--limit', type=int, default=50, help="最多显示的组数（默认: 50）")
+    parser.add_argument('--json', dest='json_file', help="把近似重复簇保存为JSON文件")
+    parser.add_argument('--collapse', type=float, metavar='THRESHOLD',
+                        help="合并相似度不低于该值的近似重复书签，结果写入--output")
+    parser.add_argument('--output', help="--collapse时保存合并结果的JSON文件")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+    input_file = args.input or get_latest_bookmarks_file(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'step3merged'))
+    if not input_file or not os.path.exists(input_file):
+        print(f"错误: 书签文件不存在: {input_file}")
+        return 1
+    if args.collapse is not None and not args.output:
+        print("错误: --collapse需要同时指定--output")
+        return 1
+
+    bookmarks = binary_snapshot.load_bookmarks(input_file)
+
+    clusters = find_near_duplicates(bookmarks, args.threshold)
+    print_clusters(clusters, args.limit)
+    if args.json_file:
+        with open(args.json_file, 'w', encoding='utf-8') as f:
+            json.dump(clusters_to_json(clusters), f, ensure_ascii=False, indent=2)
+        print(f"近似重复簇已保存到: {args.json_file}")
+
+    if args.collapse is not None:
+        removed = collapse_near_duplicates(bookmarks, args.collapse)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(bookmarks, f, ensure_ascii=False, indent=2)
+        print(f"合并了 {removed} 个近似重复书签，结果已保存到: {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
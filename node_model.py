@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+from array import array
+
+# 节点类型
+FOLDER = 0
+URL = 1
+
+# 无父节点/无子节点/无字符串
+NONE = -1
+# 属性值等于根据父节点推导出的值（path、depth），不单独存储
+DERIVED = -2
+# 整数属性不存在
+MISSING_INT = -(2 ** 63)
+
+# 节点结构中的固定字段，其余字段都作为属性列存储
+STRUCTURAL_KEYS = ('type', 'name', 'url', 'children')
+
+# 字符串驻留表：相同的名称、URL、路径只保存一份，节点中只记录下标
+# 字符串以UTF-8连续存放在一个bytearray中，避免为每个字符串单独创建Python对象
+class StringTable:
+    __slots__ = ('data', 'offsets', 'index')
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array('q', [0])
+        # 字符串到下标的索引，只在构建期间需要
+        self.index = {}
+
+    def intern(self, value):
+        if self.index is None:
+            self.index = {self.get(i): i for i in range(len(self))}
+        string_id = self.index.get(value)
+        if string_id is None:
+            string_id = len(self.offsets) - 1
+            self.data += value.encode('utf-8', 'surrogatepass')
+            self.offsets.append(len(self.data))
+            self.index[value] = string_id
+        return string_id
+
+    def get(self, string_id):
+        offsets = self.offsets
+        return self.data[offsets[string_id]:offsets[string_id + 1]].decode('utf-8', 'surrogatepass')
+
+    # 构建完成后丢弃索引，只保留紧凑的字符串数据
+    def freeze(self):
+        self.index = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # 序列化时不保存索引，在第一次需要驻留新字符串时才重建
+    def __getstate__(self):
+        return self.data, self.offsets
+
+    def __setstate__(self, state):
+        self.data, self.offsets = state
+        self.index = None
+
+# 紧凑的书签树：每个节点是若干并行数组中的一个下标，不再为每个节点创建字典
+# 节点之间通过父节点下标和first_child/next_sibling链接，文件夹路径由父节点推导，不在每个子节点中重复保存
+# 目前只用于在同步基线文件中保存合并结果（three_way_merge.save_base），读取、合并和转换各步骤仍然使用字典结构
+class BookmarkTree:
+    __slots__ = ('kinds', 'parents', 'first_child', 'last_child', 'next_sibling',
+                 'names', 'urls', 'strings', 'str_columns', 'int_columns', 'extras', 'roots')
+
+    def __init__(self):
+        self.kinds = bytearray()
+        self.parents = array('i')
+        self.first_child = array('i')
+        self.last_child = array('i')
+        self.next_sibling = array('i')
+        self.names = array('i')
+        self.urls = array('i')
+        self.strings = StringTable()
+        # 字符串属性列（如path、source、original_path），值为字符串下标
+        self.str_columns = {}
+        # 整数属性列（如depth）
+        self.int_columns = {}
+        # 其他类型的属性（如sources列表），稀疏保存：{下标: {键: 值}}
+        self.extras = {}
+        # 顶级节点的下标
+        self.roots = array('i')
+
+    def __len__(self):
+        return len(self.kinds)
+
+    # 添加一个节点，返回其下标；parent为NONE时作为顶级节点
+    def add(self, kind, parent, name, url=None):
+        index = len(self.kinds)
+        self.kinds.append(kind)
+        self.parents.append(parent)
+        self.first_child.append(NONE)
+        self.last_child.append(NONE)
+        self.next_sibling.append(NONE)
+        self.names.append(self.strings.intern(name))
+        self.urls.append(self.strings.intern(url) if url is not None else NONE)
+
+        if parent == NONE:
+            self.roots.append(index)
+        else:
+            last = self.last_child[parent]
+            if last == NONE:
+                self.first_child[parent] = index
+            else:
+                self.next_sibling[last] = index
+            self.last_child[parent] = index
+        return index
+
+    # 属性列按需延长，比最后一个设置过的节点更靠后的节点视为没有该属性
+    @staticmethod
+    def _column_slot(columns, key, typecode, missing, index):
+        column = columns.get(key)
+        if column is None:
+            column = columns[key] = array(typecode)
+        if len(column) <= index:
+            column.extend([missing] * (index + 1 - len(column)))
+        return column
+
+    # 设置字符串属性
+    def set_str(self, index, key, value):
+        column = self._column_slot(self.str_columns, key, 'i', NONE, index)
+        column[index] = value if value in (NONE, DERIVED) else self.strings.intern(value)
+
+    # 设置整数属性
+    def set_int(self, index, key, value):
+        column = self._column_slot(self.int_columns, key, 'q', MISSING_INT, index)
+        column[index] = value
+
+    # 读取字符串属性，不存在时返回default
+    def get_str(self, index, key, default=None):
+        column = self.str_columns.get(key)
+        if column is None or index >= len(column) or column[index] == NONE:
+            return default
+        if column[index] == DERIVED:
+            return self.folder_path(index)
+        return self.strings.get(column[index])
+
+    # 读取整数属性，不存在时返回default
+    def get_int(self, index, key, default=None):
+        column = self.int_columns.get(key)
+        if column is None or index >= len(column) or column[index] == MISSING_INT:
+            return default
+        if column[index] == DERIVED:
+            return self.depth(index)
+        return column[index]
+
+    # 设置其他类型的属性
+    def set_extra(self, index, key, value):
+        self.extras.setdefault(index, {})[key] = value
+
+    def name(self, index):
+        return self.strings.get(self.names[index])
+
+    def url(self, index):
+        string_id = self.urls[index]
+        return self.strings.get(string_id) if string_id != NONE else None
+
+    def is_folder(self, index):
+        return self.kinds[index] == FOLDER
+
+    # 遍历某个节点的子节点下标；parent为NONE时遍历顶级节点
+    def children(self, parent):
+        if parent == NONE:
+            yield from self.roots
+            return
+        child = self.first_child[parent]
+        while child != NONE:
+            yield child
+            child = self.next_sibling[child]
+
+    # 节点的深度（顶级节点为0）
+    def depth(self, index):
+        depth = 0
+        parent = self.parents[index]
+        while parent != NONE:
+            depth += 1
+            parent = self.parents[parent]
+        return depth
+
+    # 节点所在的文件夹路径（与parse_bookmarks的path字段一致：文件夹为包含自身的路径，书签为所在文件夹的路径）
+    def folder_path(self, index):
+        parts = []
+        node = index if self.kinds[index] == FOLDER else self.parents[index]
+        while node != NONE:
+            parts.append(self.name(node))
+            node = self.parents[node]
+        return '/'.join(reversed(parts))
+
+    # 先序遍历所有节点，返回(下标, 深度)
+    def iter_preorder(self):
+        stack = [(index, 0) for index in reversed(self.roots)]
+        while stack:
+            index, depth = stack.pop()
+            yield index, depth
+            child = self.last_child[index]
+            if child != NONE:
+                children = list(self.children(index))
+                stack.extend((c, depth + 1) for c in reversed(children))
+
+    # 统计书签和文件夹数量，source_key不为空时按该属性分组
+    def count(self, source_key=None):
+        column = self.str_columns.get(source_key) if source_key else None
+        counts = {}
+        for index, kind in enumerate(self.kinds):
+            group = self.get_str(index, source_key) if column is not None else None
+            key = (group, 'folder' if kind == FOLDER else 'url')
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    # 从现有JSON结构（parse_bookmarks、parse_safari_bookmarks、merge_bookmarks的输出）构建紧凑树
+    @classmethod
+    def from_bookmarks(cls, bookmarks):
+        tree = cls()
+        # 栈中保存(待处理的子项迭代器, 父节点下标, 父节点路径, 深度)
+        stack = [(iter(bookmarks), NONE, '', 0)]
+        while stack:
+            items, parent, parent_path, depth = stack[-1]
+            item = next(items, None)
+            if item is None:
+                stack.pop()
+                continue
+
+            kind = FOLDER if item.get('type') == 'folder' else URL
+            name = item.get('name', '')
+            index = tree.add(kind, parent, name, item.get('url') if kind == URL else None)
+            # 与推导值相同的path、depth只记为DERIVED，不保存字符串
+            own_path = (f"{parent_path}/{name}" if parent_path else name) if kind == FOLDER else parent_path
+            for key, value in item.items():
+                if key in STRUCTURAL_KEYS:
+                    continue
+                if key == 'path' and value == own_path:
+                    tree.set_str(index, key, DERIVED)
+                elif key == 'depth' and value == depth:
+                    tree.set_int(index, key, DERIVED)
+                elif isinstance(value, str):
+                    tree.set_str(index, key, value)
+                elif isinstance(value, int) and not isinstance(value, bool):
+                    tree.set_int(index, key, value)
+                else:
+                    tree.set_extra(index, key, value)
+            if kind == URL and 'url' not in item:
+                tree.set_extra(index, 'url', None)
+
+            if kind == FOLDER:
+                stack.append((iter(item.get('children', [])), index, own_path, depth + 1))
+        tree.strings.freeze()
+        return tree
+
+    # 转换回现有的JSON结构
+    def to_bookmarks(self):
+        get_string = self.strings.get
+        str_columns = list(self.str_columns.items())
+        int_columns = list(self.int_columns.items())
+        result = []
+        # 每个文件夹只计算一次路径，子节点共享同一个字符串
+        paths = {NONE: ''}
+        nodes = {}
+        for index in range(len(self.kinds)):
+            parent = self.parents[index]
+            kind = self.kinds[index]
+            name = get_string(self.names[index])
+            parent_path = paths[parent]
+            if kind == FOLDER:
+                own_path = f"{parent_path}/{name}" if parent_path else name
+                paths[index] = own_path
+                node = {'type': 'folder', 'name': name}
+            else:
+                own_path = parent_path
+                node = {'type': 'url', 'name': name}
+                url_id = self.urls[index]
+                if url_id != NONE:
+                    node['url'] = get_string(url_id)
+            depth = None
+            for key, column in str_columns:
+                value = column[index] if index < len(column) else NONE
+                if value == DERIVED:
+                    node[key] = own_path
+                elif value != NONE:
+                    node[key] = get_string(value)
+            for key, column in int_columns:
+                value = column[index] if index < len(column) else MISSING_INT
+                if value == DERIVED:
+                    if depth is None:
+                        depth = self.depth(index)
+                    node[key] = depth
+                elif value != MISSING_INT:
+                    node[key] = value
+            extra = self.extras.get(index)
+            if extra:
+                for key, value in extra.items():
+                    if key == 'url' and value is None:
+                        continue
+                    node[key] = value
+            if kind == FOLDER:
+                node['children'] = []
+            nodes[index] = node
+            (nodes[parent]['children'] if parent != NONE else result).append(node)
+        return result
@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# 在同一个Python进程中导入各步骤模块，避免重复启动解释器
+import step1_chrome_bookmarks_viewer_fixed as step1
+import step2_safari_bookmarks_viewer as step2
+import step3_merge_bookmarks as step3
+import step4_sync_to_chrome as step4
+import step5_sync_to_safari as step5
+import source_cache
+import three_way_merge
+import bookmark_index
+import instrumentation
+import snapshot_store
+import bookmark_watcher
+import near_duplicates
+import firefox_bookmarks_importer
+import chromium_browsers
+from html_bookmarks_importer import read_html_bookmarks
+from step_graph import StepGraph
+
+# 同步流程中的步骤名称（StepGraph中的步骤），可以用--cprofile分析
+PIPELINE_STEPS = (['close_chrome', 'close_safari', 'parse_chromium', 'read_safari', 'read_firefox', 'merge',
+                   'update_index', 'write_safari', 'safari_html', 'save_base']
+                  + [f'{action}_{browser}' for action in ('read', 'write') for browser in chromium_browsers.BROWSERS])
+
+# 在run_pipeline中直接用instrumentation.measure记录的函数
+MEASURED_NAMES = ['source_cache.bookmarks_digest']
+
+# 步骤1：读取Chrome（或browser指定的其他Chromium系浏览器）的书签，返回(书签列表, 文件指纹)
+def read_chrome(chrome_path=None, use_cache=True, browser='chrome'):
+    name = chromium_browsers.browser_name(browser)
+    bookmarks_file = chrome_path or step1.get_bookmarks_path(browser=browser)
+    if not bookmarks_file or not os.path.exists(bookmarks_file):
+        print(f"错误: {name}书签文件不存在: {bookmarks_file}")
+        return None, None
+
+    print(f"正在读取{name}书签文件: {bookmarks_file}")
+    bookmarks, fingerprint, from_cache = source_cache.cached_parse(
+        'chrome', bookmarks_file, functools.partial(step1.read_chrome_bookmarks, browser=browser), use_cache)
+    instrumentation.count('chrome.parse_cache_hits' if from_cache else 'chrome.parse_cache_misses')
+    return bookmarks, fingerprint
+
+# 步骤2：读取Safari书签，返回(书签列表, 文件指纹)
+def read_safari(safari_path=None, use_cache=True):
+    bookmarks_file = safari_path or step2.get_bookmarks_path()
+    if not bookmarks_file or not os.path.exists(bookmarks_file):
+        print(f"错误: Safari书签文件不存在: {bookmarks_file}")
+        return None, None
+
+    print(f"正在读取Safari书签文件: {bookmarks_file}")
+    bookmarks, fingerprint, from_cache = source_cache.cached_parse(
+        'safari', bookmarks_file, step2.read_safari_bookmarks, use_cache)
+    instrumentation.count('safari.parse_cache_hits' if from_cache else 'safari.parse_cache_misses')
+    return bookmarks, fingerprint
+
+# 读取Firefox的places.sqlite中的书签，返回(书签列表, 文件指纹)；数据库未变化时使用缓存的解析结果
+def read_firefox(places_file, use_cache=True):
+    if not os.path.exists(places_file):
+        print(f"错误: Firefox书签数据库不存在: {places_file}")
+        return None, None
+
+    print(f"正在读取Firefox书签数据库: {places_file}")
+    try:
+        bookmarks, fingerprint, from_cache = source_cache.cached_parse(
+            'firefox', places_file, firefox_bookmarks_importer.read_firefox_bookmarks, use_cache)
+    except sqlite3.Error as e:
+        print(f"读取Firefox书签数据库时出错: {e}")
+        return None, None
+    instrumentation.count('firefox.parse_cache_hits' if from_cache else 'firefox.parse_cache_misses')
+    return bookmarks, fingerprint
+
+# 读取其他浏览器导出的书签HTML文件，全部成功时返回合在一起的书签列表，否则返回None
+def read_html_exports(html_files):
+    bookmarks = []
+    for html_file in html_files:
+        if not os.path.exists(html_file):
+            print(f"错误: 书签HTML文件不存在: {html_file}")
+            return None
+        print(f"正在读取书签HTML文件: {html_file}")
+        bookmarks.extend(read_html_bookmarks(html_file))
+    return bookmarks
+
+# 执行step1到step5，书签数据在内存中直接传递，合并只执行一次
+# save_intermediate为真时保存各步骤的中间结果（step1-step3为二进制快照，为'json'时另外保存JSON）
+# 各步骤组成有向无环图：关闭并读取Chrome与关闭并读取Safari互不依赖，写入Chrome与写入Safari互不依赖，
+# 互不依赖的步骤并发执行（jobs为同时执行的步骤数量，1表示依次执行）
+# force为False时，如果两个书签文件自上次成功同步以来都没有变化，直接退出；
+# 合并结果与上次写入的相同、且书签文件自上次写入后没有被修改时，跳过对应的写入步骤
+# 合并以上次同步的结果为基线做三方合并；full_merge为True时忽略基线，做完整合并并重新建立基线
+# Safari书签直接写入Bookmarks.plist；safari_html为True时另外生成供step6导入的HTML文件
+# import_html中的书签HTML文件与Safari书签一起参与合并，合并后写入两个浏览器
+# firefox为places.sqlite的路径时，Firefox书签也参与合并：在基线中单独作为一侧，只应用Firefox自己的修改（只读取，不写回Firefox）
+# profile为Chrome配置文件目录名，Default以外的配置文件使用各自的同步基线和同步指纹
+# browsers为[(浏览器, 书签文件)]时同步多个Chromium系浏览器（代替chrome_path）：各浏览器的书签并行读取，
+# 分别与基线比较后并入合并结果（fan-in），合并结果只转换一次Chrome书签结构，再写回全部浏览器（fan-out）
+# update_index为True时，合并后增量更新供bookmark_index.py搜索的SQLite索引（与写入步骤并发执行）
+# collapse_threshold不为None时，合并后把相似度不低于该值的近似重复书签合并为一个（见near_duplicates.py）
+def run_pipeline(chrome_path=None, safari_path=None, save_intermediate=False,
+                 close_browsers=True, write_chrome=True, write_safari=True,
+                 use_cache=True, force=False, full_merge=False, safari_html=False,
+                 import_html=None, jobs=None, print_timings=True, profile=None, update_index=True,
+                 collapse_threshold=None, firefox=None, browsers=None):
+    browsers = browsers or [('chrome', chrome_path or step1.get_bookmarks_path())]
+    chromium_names = '、'.join(chromium_browsers.browser_name(browser) for browser, _ in browsers)
+    safari_path = safari_path or step2.get_bookmarks_path()
+    sources = [('chrome', path) for _, path in browsers] + [('safari', safari_path)]
+    if firefox:
+        sources.append(('firefox', firefox))
+    scope = profile if profile and profile != 'Default' else None
+    base_file = three_way_merge.profile_base_file(scope) if scope else None
+    # 同步指纹按参与同步的浏览器分别记录：只同步Chrome时合并结果的变化不会写入其他浏览器，
+    # 之后再同步全部浏览器时，不能因为每个书签文件都与它上次同步时相同就直接退出
+    synced_scope = scope
+    if [browser for browser, _ in browsers] != ['chrome']:
+        synced_scope = f"{scope or 'Default'}:{'+'.join(browser for browser, _ in browsers)}"
+
+    # 快速路径：只做stat（必要时计算哈希），不关闭浏览器也不解析书签
+    if use_cache and not force and not import_html and all(path and os.path.exists(path) for _, path in sources):
+        unchanged, _ = source_cache.sources_unchanged_since_sync(sources, synced_scope)
+        if unchanged:
+            print(f"{chromium_names}和Safari书签自上次同步以来都没有变化，无需同步 (nothing to do)")
+            instrumentation.count('runs_unchanged')
+            return True
+
+    # 两个步骤各自的锁都要拿到，避免与单独运行的step1/step2同时读写；Chrome的锁按书签文件区分
+    if not all(step1.acquire_lock(path) for _, path in browsers) or not step2.acquire_lock():
+        print("另一个实例正在运行，退出...")
+        return False
+
+    # 本次运行中写入浏览器之前的书签文件和保存的中间结果都记录到同一个快照清单中
+    snapshot_store.begin_run(f"sync:{profile}" if profile else 'sync')
+
+    graph = StepGraph()
+    chrome_deps = safari_deps = ()
+    if close_browsers:
+        print(f"正在关闭{chromium_names}和Safari浏览器...")
+        graph.add('close_chrome', lambda: all(step1.close_chrome(browser) or True for browser, _ in browsers),
+                  label=f'关闭{chromium_names}')
+        graph.add('close_safari', lambda: step2.close_safari() or True, label='关闭Safari')
+        chrome_deps, safari_deps = ('close_chrome',), ('close_safari',)
+
+    # 多个Chromium系浏览器的书签先在多个进程中并行解析（写入解析缓存），各读取步骤直接使用缓存
+    if len(browsers) > 1 and use_cache:
+        graph.add('parse_chromium', lambda *_: warm_chromium_caches(browsers), chrome_deps,
+                  label=f'解析{chromium_names}')
+        chrome_deps = ('parse_chromium',)
+
+    # 每个Chromium系浏览器一个读取步骤，中间结果只保存第一个浏览器的书签
+    def read_chrome_step(browser, path, save):
+        def read_step(*_):
+            print(f"\n[步骤1] 读取{chromium_browsers.browser_name(browser)}书签")
+            chrome_bookmarks, chrome_fingerprint = read_chrome(path, use_cache, browser)
+            if chrome_bookmarks is None:
+                return None
+            if save:
+                step1.save_bookmarks(chrome_bookmarks, save_intermediate == 'json')
+            return chrome_bookmarks, chrome_fingerprint
+        return read_step
+
+    def read_safari_step(*_):
+        print("\n[步骤2] 读取Safari书签")
+        safari_bookmarks, safari_fingerprint = read_safari(safari_path, use_cache)
+        if safari_bookmarks is None:
+            return None
+        if import_html:
+            imported = read_html_exports(import_html)
+            if imported is None:
+                return None
+            safari_bookmarks = safari_bookmarks + imported
+            # 导入的书签不在Safari书签文件中，不能沿用基线里Safari一侧的索引
+            safari_fingerprint = None
+        if save_intermediate:
+            step2.save_bookmarks(safari_bookmarks, save_intermediate == 'json')
+        return safari_bookmarks, safari_fingerprint
+
+    # Firefox不需要关闭（只读方式打开数据库），与其他读取步骤并发执行
+    def read_firefox_step():
+        print("\n读取Firefox书签")
+        firefox_bookmarks, firefox_fingerprint = read_firefox(firefox, use_cache)
+        if firefox_bookmarks is None:
+            return None
+        return firefox_bookmarks, firefox_fingerprint
+
+    def merge_step(safari_result, *results):
+        print("\n[步骤3] 合并书签")
+        safari_bookmarks, safari_fingerprint = safari_result
+        chrome_results = results[:len(browsers)]
+        fingerprints = {'safari': safari_fingerprint}
+        # Firefox在基线中是只读的一侧：只比较Firefox自己相对基线的变化，不会把在其他浏览器中删除的书签加回来
+        readonly_sides = []
+        if firefox:
+            firefox_bookmarks, fingerprints['firefox'] = results[len(browsers)]
+            readonly_sides.append(('firefox', 'Firefox', firefox_bookmarks))
+        # 基线中每个Chromium系浏览器以浏览器的键（chrome、edge……）为一侧，各自记录索引和指纹
+        chrome_bookmarks = None
+        extra_sides = []
+        for (browser, _), (bookmarks, fingerprint) in zip(browsers, chrome_results):
+            fingerprints[browser] = fingerprint
+            if browser == 'chrome':
+                chrome_bookmarks = bookmarks
+            else:
+                extra_sides.append((browser, chromium_browsers.browser_name(browser), bookmarks))
+        base = None if full_merge else three_way_merge.load_base(base_file)
+        merged_bookmarks, side_entries = three_way_merge.merge_with_base(
+            base, chrome_bookmarks, safari_bookmarks, fingerprints, extra_sides, readonly_sides)
+        if collapse_threshold is not None:
+            removed = near_duplicates.collapse_near_duplicates(merged_bookmarks, collapse_threshold)
+            print(f"合并了 {removed} 个近似重复书签（相似度不低于 {collapse_threshold}）")
+        step3.print_merged_stats(merged_bookmarks)
+        if save_intermediate:
+            step3.save_merged_bookmarks(merged_bookmarks, save_intermediate == 'json')
+        # 合并结果只转换一次Chrome书签结构，各Chromium系浏览器的写入步骤（可能并发执行）共用转换结果和它的索引。
+        # 转换会给新书签补上guid、date_added、date_modified并回写到合并结果中，因此要在这里完成：
+        # 摘要包含这些字段，下次合并结果不变时摘要相同；写入Safari和更新索引的步骤读取时合并结果也不再被修改
+        converted = None
+        if write_chrome:
+            chrome_format = step4.convert_to_chrome_format(merged_bookmarks)
+            converted = (chrome_format, three_way_merge.index_tree(
+                three_way_merge.chrome_format_to_bookmarks(chrome_format)))
+        with instrumentation.measure('source_cache.bookmarks_digest'):
+            digest = source_cache.bookmarks_digest(merged_bookmarks) if use_cache else None
+        return {'merged': merged_bookmarks, 'side_entries': side_entries,
+                'fingerprints': fingerprints, 'digest': digest, 'converted': converted}
+
+    read_steps = []
+    for index, (browser, path) in enumerate(browsers):
+        graph.add(f'read_{browser}', read_chrome_step(browser, path, save_intermediate and index == 0), chrome_deps,
+                  label=f'[步骤1] 读取{chromium_browsers.browser_name(browser)}')
+        read_steps.append(f'read_{browser}')
+    graph.add('read_safari', read_safari_step, safari_deps, label='[步骤2] 读取Safari')
+    if firefox:
+        graph.add('read_firefox', read_firefox_step, label='读取Firefox')
+        read_steps.append('read_firefox')
+    graph.add('merge', merge_step, ('read_safari', *read_steps), label='[步骤3] 合并')
+
+    # 写入步骤返回(该侧书签索引, 写入后的文件指纹)，由保存基线的步骤统一更新
+    def write_chromium_step(browser, path, save_copy):
+        def write_step(merge):
+            print(f"\n[步骤4] 同步到{chromium_browsers.browser_name(browser)}")
+            chrome_format, entries = merge['converted']
+            chrome_format = step4.localize_chrome_format(chrome_format, browser)
+            if not step4.save_to_chrome_bookmarks(chrome_format, path, save_copy=save_copy, browser=browser):
+                return None
+            if use_cache:
+                source_cache.record_written('chrome', path, merge['digest'])
+            # 基线中该浏览器一侧记录为刚写入的内容（读取时根目录名称会改回Chrome的名称，索引相同），
+            # 下次只比较用户在此之后的修改
+            return entries, source_cache.get_fingerprint(path, 'chrome')
+        return write_step
+
+    def write_safari_step(merge):
+        print("\n[步骤5] 同步到Safari")
+        if not step5.save_to_safari_bookmarks(merge['merged'], safari_path):
+            return None
+        if use_cache:
+            source_cache.record_written('safari', safari_path, merge['digest'])
+        # 与Chrome相同，基线中的Safari一侧记录为刚写入的内容
+        return (three_way_merge.index_tree(step2.read_safari_bookmarks(safari_path)),
+                source_cache.get_fingerprint(safari_path, 'safari'))
+
+    def safari_html_step(merge):
+        safari_format = step5.convert_to_safari_format(merge['merged'])
+        if not step5.save_to_step5sync2safari(safari_format):
+            return None
+        step5.create_import_instructions()
+        return True
+
+    def unchanged_since_written(kind, path):
+        if not use_cache or force:
+            return None
+        def skip_if(merge):
+            if source_cache.written_unchanged(kind, path, merge['digest']):
+                print(f"合并结果与上次写入的相同，跳过写入: {path}")
+                return True
+            return False
+        return skip_if
+
+    # 索引只用于搜索，更新失败不影响同步结果
+    def index_step(merge):
+        try:
+            added, removed, updated = bookmark_index.update_index(merge['merged'], digest=merge['digest'])
+            print(f"书签索引已更新: 新增 {added}，删除 {removed}，修改 {updated}")
+        except Exception as e:
+            print(f"更新书签索引时出错: {e}")
+        return True
+
+    if update_index:
+        graph.add('update_index', index_step, ('merge',), label='更新书签索引')
+
+    write_steps = []
+    # 写入步骤 -> 基线中对应的侧
+    write_sides = {}
+    if write_chrome:
+        for index, (browser, path) in enumerate(browsers):
+            graph.add(f'write_{browser}', write_chromium_step(browser, path, bool(save_intermediate) and index == 0),
+                      ('merge',), skip_if=unchanged_since_written('chrome', path),
+                      label=f'[步骤4] 写入{chromium_browsers.browser_name(browser)}')
+            write_steps.append(f'write_{browser}')
+            write_sides[f'write_{browser}'] = browser
+    if write_safari:
+        graph.add('write_safari', write_safari_step, ('merge',),
+                  skip_if=unchanged_since_written('safari', safari_path), label='[步骤5] 写入Safari')
+        write_steps.append('write_safari')
+        write_sides['write_safari'] = 'safari'
+        if safari_html:
+            graph.add('safari_html', safari_html_step, ('merge',), label='[步骤5] 生成HTML')
+            write_steps.append('safari_html')
+
+    def save_base_step(merge, *written):
+        side_entries = merge['side_entries']
+        fingerprints = merge['fingerprints']
+        for name, result in zip(write_steps, written):
+            # 跳过写入时书签文件与上次写入后相同，读取时得到的索引和指纹仍然有效
+            if name in write_sides and result is not None:
+                side = write_sides[name]
+                side_entries[side], fingerprints[side] = result
+        three_way_merge.save_base(merge['merged'], side_entries, fingerprints, base_file)
+        return True
+
+    graph.add('save_base', save_base_step, ('merge', *write_steps), label='保存同步基线')
+
+    start = time.perf_counter()
+    graph.run(max_workers=jobs)
+    success = graph.succeeded()
+    snapshot_store.finish_run()
+    if print_timings:
+        graph.print_report(time.perf_counter() - start)
+
+    # 在写回浏览器文件之后记录指纹，下次运行时如果用户没有修改书签即可直接退出
+    if success and use_cache:
+        source_cache.record_synced_sources(sources, synced_scope)
+
+    return success
+
+# 在子进程中解析一个Chrome配置文件（或其他Chromium系浏览器）的书签并写入解析缓存
+def warm_chrome_cache(bookmarks_file, browser='chrome'):
+    try:
+        return source_cache.warm_cache(
+            'chrome', bookmarks_file, functools.partial(step1.read_chrome_bookmarks, browser=browser))
+    except Exception as e:
+        print(f"预先解析{chromium_browsers.browser_name(browser)}书签文件时出错: {bookmarks_file}: {e}")
+        return False
+
+# 在多个进程中并行解析各Chromium系浏览器的书签并写入解析缓存，browsers为[(浏览器, 书签文件)]
+# 在同步流程的线程中调用，使用spawn方式启动子进程（在多线程的进程中fork可能复制其他线程持有的锁）
+def warm_chromium_caches(browsers):
+    print(f"正在并行解析 {len(browsers)} 个浏览器的书签...")
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(len(browsers), os.cpu_count() or 1), mp_context=context) as executor:
+        list(executor.map(warm_chrome_cache, [path for _, path in browsers], [browser for browser, _ in browsers]))
+    return True
+
+# 按--profiles参数选择Chrome配置文件："all"表示全部，否则为逗号分隔的目录名或显示名称
+# 返回[(配置文件目录名, 显示名称, 书签文件路径)]，有找不到的配置文件时返回None
+def select_profiles(spec, user_data_dir=None):
+    profiles = step1.list_profiles(user_data_dir)
+    if spec == 'all':
+        return profiles
+
+    selected = []
+    for wanted in (name.strip() for name in spec.split(',') if name.strip()):
+        matches = [profile for profile in profiles if wanted in (profile[0], profile[1])]
+        if not matches:
+            print(f"错误: 找不到Chrome配置文件: {wanted}")
+            return None
+        for profile in matches:
+            if profile not in selected:
+                selected.append(profile)
+    return selected
+
+# 把多个Chrome配置文件分别与Safari同步
+# 各配置文件的Chrome书签先在多个进程中并行解析（写入解析缓存），之后依次执行各配置文件的同步流程：
+# 所有配置文件共用同一个Safari书签文件，必须在上一个配置文件写入Safari之后再读取，否则会丢失修改
+def run_profiles(profiles, safari_path=None, close_browsers=True, use_cache=True, **options):
+    if close_browsers:
+        print("正在关闭Chrome和Safari浏览器...")
+        step1.close_chrome()
+        step2.close_safari()
+
+    if use_cache and len(profiles) > 1:
+        print(f"正在并行解析 {len(profiles)} 个Chrome配置文件的书签...")
+        with ProcessPoolExecutor(max_workers=min(len(profiles), os.cpu_count() or 1)) as executor:
+            list(executor.map(warm_chrome_cache, [path for _, _, path in profiles]))
+
+    results = []
+    for profile_dir, name, bookmarks_file in profiles:
+        print(f"\n===== Chrome配置文件: {name} ({profile_dir}) =====")
+        success = run_pipeline(chrome_path=bookmarks_file, safari_path=safari_path, close_browsers=False,
+                               use_cache=use_cache, profile=profile_dir, **options)
+        results.append((name, profile_dir, success))
+        # 导入的HTML书签和Firefox书签写入Safari后，其余配置文件会从Safari读到它们，只需导入一次
+        if success:
+            options['import_html'] = None
+            options['firefox'] = None
+
+    print("\n各配置文件的同步结果:")
+    for name, profile_dir, success in results:
+        print(f"  {name} ({profile_dir}): {'成功' if success else '失败'}")
+    return all(success for _, _, success in results)
+
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="在单个进程中执行完整的书签同步流程（step1到step5）")
+    parser.add_argument('--chrome-bookmarks', help="Chrome书签文件路径（默认自动检测）")
+    parser.add_argument('--profiles',
+                        help="同步的Chrome配置文件：all表示全部，或逗号分隔的配置文件目录名/显示名称（从Local State读取）")
+    parser.add_argument('--list-profiles', action='store_true', help="列出Chrome配置文件后退出")
+    parser.add_argument('--chrome-user-data-dir', help="Chrome用户数据目录（默认自动检测）")
+    parser.add_argument('--browsers',
+                        help="同时同步的Chromium系浏览器：all表示检测到的全部，或逗号分隔的浏览器"
+                             f"（{','.join(chromium_browsers.BROWSERS)}），各浏览器的Default配置文件与Safari一次合并并全部写回")
+    parser.add_argument('--list-browsers', action='store_true', help="列出支持的Chromium系浏览器及检测到的书签文件后退出")
+    parser.add_argument('--safari-bookmarks', help="Safari书签文件路径（默认自动检测）")
+    parser.add_argument('--save-intermediate', nargs='?', const='bksnap', choices=['bksnap', 'json'],
+                        help="同时把step1/step2/step3/step4的中间结果写入各自目录；"
+                             "step1-step3默认保存为二进制快照，--save-intermediate json时另外保存JSON")
+    parser.add_argument('--no-close-browsers', action='store_true', help="不自动关闭浏览器")
+    parser.add_argument('--skip-chrome-write', action='store_true', help="不写回Chrome书签文件")
+    parser.add_argument('--skip-safari-write', action='store_true', help="不写回Safari书签文件")
+    parser.add_argument('--safari-html', action='store_true',
+                        help="另外在step5sync2safari目录生成HTML导入文件（供step6通过Safari界面导入）")
+    parser.add_argument('--import-html', action='append', metavar='HTML_FILE',
+                        help="导入浏览器导出的书签HTML文件，与Safari书签一起合并（可以指定多次）")
+    parser.add_argument('--firefox', nargs='?', const='', metavar='PROFILE',
+                        help="同时读取Firefox的书签（places.sqlite，Firefox运行时也可以读取），与Safari书签一起合并；"
+                             "可以指定Firefox配置文件名称或places.sqlite路径，默认使用默认配置文件")
+    parser.add_argument('--jobs', type=int,
+                        help="同时执行的步骤数量（默认不限制，1表示依次执行各步骤）")
+    parser.add_argument('--no-index', action='store_true', help="合并后不更新书签搜索索引")
+    parser.add_argument('--no-cache', action='store_true', help="不使用解析缓存，也不检查书签文件是否变化")
+    parser.add_argument('--force', action='store_true', help="即使书签文件没有变化也执行完整同步")
+    parser.add_argument('--full-merge', action='store_true',
+                        help="忽略上次同步的基线，对两个浏览器的书签做完整合并并重新建立基线")
+    parser.add_argument('--collapse-near-duplicates', type=float, metavar='THRESHOLD',
+                        help="合并后把相似度不低于该值（0到1）的近似重复书签合并为一个，如0.9"
+                             "（先用near_duplicates.py查看会合并哪些书签）")
+    parser.add_argument('--watch', action='store_true',
+                        help="持续监视Chrome和Safari的书签文件，有变化时增量同步（见bookmark_watcher.py）")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="把本次运行的各步骤耗时、内存峰值和计数器写入该JSON文件"
+                             "（默认写入.bookmarks_cache/metrics，保留最近50次）")
+    parser.add_argument('--no-metrics', action='store_true', help="不记录本次运行的指标")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="用tracemalloc记录各步骤和热点函数的内存峰值（明显变慢，各步骤会依次执行）")
+    parser.add_argument('--cprofile', metavar='STEP',
+                        help="用cProfile分析一个步骤（如read_chrome、merge、write_chrome）或热点函数"
+                             "（如step4.convert_to_chrome_format），结果保存为与指标文件同名的.pstats文件")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.list_profiles:
+        for profile_dir, name, bookmarks_file in step1.list_profiles(args.chrome_user_data_dir):
+            print(f"{profile_dir:<16} {name:<20} {bookmarks_file}")
+        return 0
+
+    if args.list_browsers:
+        detected = dict(chromium_browsers.detect_browsers())
+        for browser in chromium_browsers.BROWSERS:
+            print(f"{browser:<10} {chromium_browsers.browser_name(browser):<10} {detected.get(browser, '（未检测到）')}")
+        return 0
+
+    if args.watch:
+        if args.profiles or args.browsers:
+            print("错误: --watch只能监视一个Chrome配置文件，不能与--profiles或--browsers同时使用")
+            return 1
+        chrome_path = args.chrome_bookmarks
+        if not chrome_path and args.chrome_user_data_dir:
+            chrome_path = step1.get_bookmarks_path(user_data_dir=args.chrome_user_data_dir)
+        success = bookmark_watcher.watch(chrome_path, args.safari_bookmarks, update_index=not args.no_index)
+        return 0 if success else 1
+
+    if args.collapse_near_duplicates is not None and not 0 < args.collapse_near_duplicates <= 1:
+        print("错误: --collapse-near-duplicates的取值应在0到1之间")
+        return 1
+
+    firefox = None
+    if args.firefox is not None:
+        firefox = firefox_bookmarks_importer.get_places_path(args.firefox or None)
+        if not firefox:
+            print(f"错误: 找不到Firefox书签数据库: {args.firefox or '默认配置文件'}")
+            return 1
+
+    if args.cprofile and args.cprofile not in set(PIPELINE_STEPS + MEASURED_NAMES) | instrumentation.TIMED_NAMES:
+        print(f"错误: --cprofile只能指定同步步骤或热点函数: {args.cprofile}")
+        print(f"  步骤: {', '.join(PIPELINE_STEPS)}")
+        print(f"  函数: {', '.join(sorted(instrumentation.TIMED_NAMES | set(MEASURED_NAMES)))}")
+        return 1
+
+    record_metrics = bool(not args.no_metrics or args.metrics or args.trace_memory or args.cprofile)
+    if record_metrics:
+        instrumentation.start(trace_memory=args.trace_memory, profile_step=args.cprofile)
+
+    options = dict(
+        safari_path=args.safari_bookmarks,
+        save_intermediate=args.save_intermediate,
+        close_browsers=not args.no_close_browsers,
+        write_chrome=not args.skip_chrome_write,
+        write_safari=not args.skip_safari_write,
+        use_cache=not args.no_cache,
+        force=args.force,
+        full_merge=args.full_merge,
+        safari_html=args.safari_html,
+        import_html=args.import_html,
+        # 内存峰值和cProfile只在各步骤依次执行时才能归属到单个步骤
+        jobs=1 if args.trace_memory or args.cprofile else args.jobs,
+        update_index=not args.no_index,
+        collapse_threshold=args.collapse_near_duplicates,
+        firefox=firefox,
+    )
+    if args.browsers:
+        if args.profiles or args.chrome_bookmarks or args.chrome_user_data_dir:
+            print("错误: --browsers不能与--profiles、--chrome-bookmarks或--chrome-user-data-dir同时使用")
+            return 1
+        browsers = chromium_browsers.select_browsers(args.browsers)
+        if not browsers:
+            print("错误: 没有可同步的Chromium系浏览器")
+            return 1
+        success = run_pipeline(browsers=browsers, **options)
+    elif args.profiles:
+        if args.chrome_bookmarks:
+            print("错误: --profiles和--chrome-bookmarks不能同时使用")
+            return 1
+        profiles = select_profiles(args.profiles, args.chrome_user_data_dir)
+        if not profiles:
+            print("错误: 没有可同步的Chrome配置文件")
+            return 1
+        success = run_profiles(profiles, **options)
+    else:
+        chrome_path = args.chrome_bookmarks
+        if not chrome_path and args.chrome_user_data_dir:
+            chrome_path = step1.get_bookmarks_path(user_data_dir=args.chrome_user_data_dir)
+        success = run_pipeline(chrome_path=chrome_path, **options)
+
+    if record_metrics:
+        metrics_file = instrumentation.finish(args.metrics, success=success, argv=sys.argv[1:] if argv is None else argv)
+        if args.metrics or args.trace_memory or args.cprofile:
+            instrumentation.print_metrics(metrics_file)
+        print(f"\n运行指标已保存到: {metrics_file}")
+    if success:
+        print("\n书签同步流程完成!")
+    else:
+        print("\n书签同步流程失败，请检查错误信息。")
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import zlib
+import time
+import base64
+import hashlib
+import plistlib
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+import source_cache
+import instrumentation
+
+# 快照存储：各步骤的输出和写入浏览器书签文件之前的原内容都保存在这里
+# objects目录中的对象按内容哈希寻址并用zlib压缩：每个文件夹（连同其中的书签）是一个对象，子文件夹以哈希引用，
+# 内容没有变化的文件夹在不同的运行之间只保存一次；runs目录中每次运行只有一个记录各条目根哈希的小清单
+# 目录在调用时按source_cache.CACHE_DIR计算，缓存目录被改到别处（如benchmark_pipeline的临时目录）时快照也一起写到那里
+def snapshot_dir():
+    return os.path.join(source_cache.CACHE_DIR, 'snapshots')
+
+def objects_dir():
+    return os.path.join(snapshot_dir(), 'objects')
+
+def runs_dir():
+    return os.path.join(snapshot_dir(), 'runs')
+
+# 保留策略：最近KEEP_LAST次运行，以及最近KEEP_DAYS天中每天的最后一次运行
+KEEP_LAST = 20
+KEEP_DAYS = 14
+
+# 清理对象时只删除修改时间早于该秒数的对象，避免删掉另一个进程正在保存、清单还没写入的对象
+GC_GRACE_SECONDS = 3600
+
+# 当前正在记录的运行；为None时每次记录单独成为一次运行
+_run = None
+_lock = threading.RLock()
+
+# 把书签树（或浏览器书签文件的内容）编码为对象：文件夹（带children/Children列表的字典）单独保存，以哈希引用
+# plist中的bytes和datetime转换为带标记的字典，读取时还原
+def _encode(value):
+    if isinstance(value, dict):
+        encoded = {key: _encode(item) for key, item in value.items()}
+        if isinstance(value.get('children', value.get('Children')), list):
+            return {'$ref': _put(encoded)}
+        return encoded
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, bytes):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, datetime):
+        return {'$date': value.isoformat()}
+    return value
+
+# 对象文件路径：按哈希前两位分目录
+def _object_path(digest):
+    return os.path.join(objects_dir(), digest[:2], digest[2:])
+
+# 保存一个对象，返回内容哈希；已经存在的对象只更新修改时间（防止被并发的清理删除）
+def _put(obj):
+    data = json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    path = _object_path(digest)
+    try:
+        os.utime(path)
+        return digest
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(zlib.compress(data))
+    os.replace(tmp_path, path)
+    instrumentation.count('snapshot.objects_written')
+    instrumentation.count('snapshot.bytes_written', os.path.getsize(path))
+    return digest
+
+# 读取一个对象（不展开其中的引用）
+def _get(digest):
+    with open(_object_path(digest), 'rb') as f:
+        return json.loads(zlib.decompress(f.read()))
+
+# 展开对象中的引用和带标记的值
+def _decode(value):
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if '$ref' in value:
+                return _decode(_get(value['$ref']))
+            if '$bytes' in value:
+                return base64.b64decode(value['$bytes'])
+            if '$date' in value:
+                return datetime.fromisoformat(value['$date'])
+        return {key: _decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+# 保存一棵书签树，返回根对象的哈希
+@instrumentation.timed('snapshot_store.store_tree')
+def store_tree(value):
+    encoded = _encode(value)
+    if isinstance(encoded, dict) and list(encoded) == ['$ref']:
+        return encoded['$ref']
+    return _put(encoded)
+
+# 按根哈希读取完整的书签树
+def load_tree(digest):
+    return _decode(_get(digest))
+
+# 开始记录一次运行，之后record和record_file保存的条目都写入同一个清单，直到finish_run
+def begin_run(label):
+    global _run
+    with _lock:
+        _run = {'label': label, 'created_at': datetime.now(), 'entries': {}}
+
+# 结束当前运行：有条目时写入清单并按保留策略清理，返回清单路径
+def finish_run():
+    global _run
+    with _lock:
+        run, _run = _run, None
+    if run is None or not run['entries']:
+        return None
+    return _write_manifest(run)
+
+# 写入运行清单
+def _write_manifest(run):
+    os.makedirs(runs_dir(), exist_ok=True)
+    run_id = run['created_at'].strftime('%Y%m%d_%H%M%S_%f')
+    manifest = {
+        'id': run_id,
+        'created_at': run['created_at'].isoformat(timespec='seconds'),
+        'label': run['label'],
+        'entries': run['entries'],
+    }
+    path = os.path.join(runs_dir(), f"{run_id}.json")
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    prune()
+    return path
+
+# 记录一个条目；没有正在记录的运行时单独写入一个清单
+def _add_entry(name, entry):
+    with _lock:
+        if _run is not None:
+            _run['entries'][name] = entry
+            return
+    _write_manifest({'label': name, 'created_at': datetime.now(), 'entries': {name: entry}})
+
+# 记录步骤的输出（书签列表或Chrome书签结构）
+def record(name, value, kind='json'):
+    _add_entry(name, {'kind': kind, 'root': store_tree(value)})
+
+# 记录书签文件的当前内容（kind为'chrome'、'safari'或'json'），用于回滚；文件不存在时什么也不做
+@instrumentation.timed('snapshot_store.record_file')
+def record_file(name, path, kind):
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        content = f.read()
+    value = plistlib.loads(content) if kind == 'safari' else json.loads(content)
+    _add_entry(name, {'kind': kind, 'path': os.path.abspath(path), 'size': len(content),
+                      'root': store_tree(value)})
+
+# 按时间顺序列出所有运行清单
+def list_runs():
+    try:
+        names = sorted(name for name in os.listdir(runs_dir()) if name.endswith('.json'))
+    except OSError:
+        return []
+    runs = []
+    for name in names:
+        try:
+            with open(os.path.join(runs_dir(), name), 'r', encoding='utf-8') as f:
+                runs.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return runs
+
+# 按运行ID（或其唯一前缀、或负数表示倒数第几次）查找运行清单
+def find_run(run_id):
+    runs = list_runs()
+    if run_id.lstrip('-').isdigit() and int(run_id) < 0:
+        return runs[int(run_id)] if -int(run_id) <= len(runs) else None
+    matches = [run for run in runs if run['id'].startswith(run_id)]
+    return matches[0] if len(matches) == 1 else None
+
+# 按保留策略决定保留哪些运行：最近keep_last次，以及最近keep_days天中每天的最后一次
+def runs_to_keep(runs, keep_last=KEEP_LAST, keep_days=KEEP_DAYS, now=None):
+    now = now or datetime.now()
+    keep = {run['id'] for run in runs[-keep_last:]} if keep_last else set()
+    first_day = (now - timedelta(days=keep_days - 1)).date() if keep_days else None
+    last_of_day = {}
+    for run in runs:
+        day = datetime.fromisoformat(run['created_at']).date()
+        if first_day and day >= first_day:
+            last_of_day[day] = run['id']
+    keep.update(last_of_day.values())
+    return keep
+
+# 删除保留策略之外的运行清单，并清理不再被任何清单引用的对象；返回删除的运行数
+def prune(keep_last=KEEP_LAST, keep_days=KEEP_DAYS):
+    runs = list_runs()
+    keep = runs_to_keep(runs, keep_last, keep_days)
+    removed = 0
+    for run in runs:
+        if run['id'] not in keep:
+            try:
+                os.remove(os.path.join(runs_dir(), f"{run['id']}.json"))
+                removed += 1
+            except OSError:
+                pass
+    if removed:
+        collect_garbage()
+    return removed
+
+# 标记-清除：从所有清单的根哈希出发标记可达对象，删除其余的（只删除超过GC_GRACE_SECONDS的对象）
+def collect_garbage():
+    reachable = set()
+    stack = [entry['root'] for run in list_runs() for entry in run['entries'].values()]
+    while stack:
+        digest = stack.pop()
+        if digest in reachable:
+            continue
+        reachable.add(digest)
+        try:
+            obj = _get(digest)
+        except (OSError, ValueError, zlib.error):
+            continue
+        _collect_refs(obj, stack)
+
+    cutoff = time.time() - GC_GRACE_SECONDS
+    removed = 0
+    for prefix in _listdir(objects_dir()):
+        directory = os.path.join(objects_dir(), prefix)
+        for name in _listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                if prefix + name not in reachable and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+# 收集对象中引用的哈希
+def _collect_refs(value, refs):
+    if isinstance(value, dict):
+        if len(value) == 1 and '$ref' in value:
+            refs.append(value['$ref'])
+            return
+        for item in value.values():
+            _collect_refs(item, refs)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_refs(item, refs)
+
+# 列出目录内容，目录不存在时返回空列表
+def _listdir(directory):
+    try:
+        return os.listdir(directory)
+    except OSError:
+        return []
+
+# 统计存储占用的空间：(对象数, 对象总字节数)
+def storage_usage():
+    count = size = 0
+    for prefix in _listdir(objects_dir()):
+        directory = os.path.join(objects_dir(), prefix)
+        for name in _listdir(directory):
+            try:
+                size += os.path.getsize(os.path.join(directory, name))
+                count += 1
+            except OSError:
+                pass
+    return count, size
+
+# 把某次运行中保存的书签文件恢复到原路径（或path）：Chrome书签经过step4的原子写入和checksum校验，
+# Safari书签经过step5的原子写入和校验；恢复前的内容同样会先保存到快照存储中，因此恢复本身也可以撤销
+def restore(run, name, path=None):
+    entry = run['entries'].get(name)
+    if entry is None:
+        print(f"错误: 运行 {run['id']} 中没有条目: {name}")
+        return False
+    path = path or entry.get('path')
+    if not path:
+        print(f"错误: 条目 {name} 不是书签文件，请用export导出或指定--path")
+        return False
+    value = load_tree(entry['root'])
+    if entry['kind'] == 'chrome':
+        import step4_sync_to_chrome
+        # 重新计算checksum，原文件的checksum与内容不一致时恢复后的文件也能通过校验
+        value['checksum'] = ''
+        return step4_sync_to_chrome.save_to_chrome_bookmarks(value, path, save_copy=False)
+    if entry['kind'] == 'safari':
+        import step5_sync_to_safari
+        return step5_sync_to_safari.write_safari_plist(value, path)
+    record_file(f"{name}_before_restore", path, entry['kind'])
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(value, f, ensure_ascii=False, indent=2)
+    print(f"已恢复到: {path}")
+    return True
+
+# 把书签文件旁边堆积的.backup.<时间>备份导入快照存储并删除；sources为[(kind, 书签文件路径)]
+# 同一时间的Chrome和Safari备份属于同一次同步，记录到同一个清单中；返回每种书签导入的数量
+def import_backups(sources):
+    runs = {}
+    imported = {}
+    for kind, path in sources:
+        directory = os.path.dirname(os.path.abspath(path))
+        prefix = os.path.basename(path) + '.backup.'
+        imported[kind] = 0
+        for name in sorted(_listdir(directory)):
+            if not name.startswith(prefix):
+                continue
+            backup_path = os.path.join(directory, name)
+            try:
+                created_at = datetime.strptime(name[len(prefix):], '%Y%m%d_%H%M%S')
+            except ValueError:
+                created_at = datetime.fromtimestamp(os.path.getmtime(backup_path))
+            with open(backup_path, 'rb') as f:
+                content = f.read()
+            value = plistlib.loads(content) if kind == 'safari' else json.loads(content)
+            run = runs.setdefault(created_at, {'label': 'import-backups', 'created_at': created_at, 'entries': {}})
+            run['entries'][f"{kind}_before_write"] = {'kind': kind, 'path': os.path.abspath(path),
+                                                      'size': len(content), 'root': store_tree(value)}
+            run.setdefault('files', []).append(backup_path)
+            imported[kind] += 1
+
+    # 清单写入之后才删除备份文件
+    for created_at in sorted(runs):
+        run = runs[created_at]
+        _write_manifest(run)
+        for backup_path in run['files']:
+            os.remove(backup_path)
+    return imported
+
+# 打印运行列表
+def print_runs(runs):
+    for run in runs:
+        names = ', '.join(run['entries'])
+        print(f"{run['id']}  {run['created_at']}  {run['label']:<16} {names}")
+    count, size = storage_usage()
+    print(f"\n共 {len(runs)} 次运行，{count} 个对象，{size / 1024:.1f} KB")
+
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="查看、导出和恢复书签快照")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help="列出保存的运行")
+    show_parser = subparsers.add_parser('show', help="显示一次运行的清单")
+    show_parser.add_argument('run', help="运行ID（或唯一前缀，-1表示最近一次）")
+    export_parser = subparsers.add_parser('export', help="把一次运行中的条目导出为JSON文件")
+    export_parser.add_argument('run', help="运行ID（或唯一前缀，-1表示最近一次）")
+    export_parser.add_argument('name', help="条目名称，如chrome_before_write、step3_merged")
+    export_parser.add_argument('--output', required=True, help="输出的JSON文件")
+    restore_parser = subparsers.add_parser('restore', help="把一次运行中保存的书签文件恢复到原位置")
+    restore_parser.add_argument('run', help="运行ID（或唯一前缀，-1表示最近一次）")
+    restore_parser.add_argument('name', help="条目名称，如chrome_before_write、safari_before_write")
+    restore_parser.add_argument('--path', help="恢复到其他路径")
+    prune_parser = subparsers.add_parser('prune', help="按保留策略清理旧的运行和对象")
+    prune_parser.add_argument('--keep-last', type=int, default=KEEP_LAST,
+                              help=f"保留最近的运行次数（默认: {KEEP_LAST}）")
+    prune_parser.add_argument('--keep-days', type=int, default=KEEP_DAYS,
+                              help=f"另外保留最近几天中每天的最后一次运行（默认: {KEEP_DAYS}）")
+    import_parser = subparsers.add_parser('import-backups', help="把书签文件旁边的.backup.*备份导入快照存储并删除")
+    import_parser.add_argument('--chrome-bookmarks', help="Chrome书签文件路径")
+    import_parser.add_argument('--safari-bookmarks', help="Safari书签文件路径")
+    return parser.parse_args(argv)
+
+# 按命令行参数查找运行清单
+def _find_run_or_report(run_id):
+    run = find_run(run_id)
+    if run is None:
+        print(f"错误: 找不到运行: {run_id}")
+    return run
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == 'list':
+        print_runs(list_runs())
+    elif args.command == 'show':
+        run = _find_run_or_report(args.run)
+        if run is None:
+            return 1
+        print(json.dumps(run, ensure_ascii=False, indent=2))
+    elif args.command == 'export':
+        run = _find_run_or_report(args.run)
+        if run is None:
+            return 1
+        entry = run['entries'].get(args.name)
+        if entry is None:
+            print(f"错误: 运行 {run['id']} 中没有条目: {args.name}")
+            return 1
+        value = load_tree(entry['root'])
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False, indent=2, default=str)
+        print(f"已导出到: {args.output}")
+    elif args.command == 'restore':
+        run = _find_run_or_report(args.run)
+        if run is None:
+            return 1
+        begin_run(f"restore:{run['id']}")
+        success = restore(run, args.name, args.path)
+        finish_run()
+        if not success:
+            return 1
+    elif args.command == 'prune':
+        removed = prune(args.keep_last, args.keep_days)
+        count, size = storage_usage()
+        print(f"删除了 {removed} 次运行，剩余 {count} 个对象，{size / 1024:.1f} KB")
+    elif args.command == 'import-backups':
+        import step1_chrome_bookmarks_viewer_fixed as step1
+        import step2_safari_bookmarks_viewer as step2
+        sources = [(kind, path) for kind, path in (('chrome', args.chrome_bookmarks or step1.get_bookmarks_path()),
+                                                   ('safari', args.safari_bookmarks or step2.get_bookmarks_path()))
+                   if path]
+        imported = import_backups(sources)
+        for kind, path in sources:
+            print(f"导入了 {imported[kind]} 个{kind}备份: {path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import json
+import pickle
+import hashlib
+import threading
+
+# 缓存目录：保存解析结果和上次同步时各书签文件的指纹
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.bookmarks_cache')
+STATE_FILE = os.path.join(CACHE_DIR, 'state.json')
+
+# 解析结果的格式版本，解析器输出的字段变化时递增，使旧的缓存失效
+TREE_FORMAT_VERSION = 2
+
+# 计算内容哈希时每次读取的块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 状态文件的读-改-写需要加锁，run_pipeline中读取Chrome和Safari的步骤在不同线程中执行
+STATE_LOCK = threading.RLock()
+
+# Chrome书签文件开头的checksum字段
+CHROME_CHECKSUM_RE = re.compile(rb'"checksum"\s*:\s*"([0-9a-fA-F]*)"')
+
+# 缓存和状态文件中使用的书签源键，例如 "chrome:/path/to/Bookmarks"
+def source_key(kind, path):
+    return f"{kind}:{os.path.abspath(path)}"
+
+# 计算书签文件指纹：大小、mtime_ns、内容SHA-256，Chrome文件另外记录其自带的checksum
+# 如果大小和mtime_ns都与previous相同，直接沿用previous的内容哈希，不再读取文件
+def get_fingerprint(path, kind=None, previous=None):
+    stat = os.stat(path)
+    if (previous and previous.get('size') == stat.st_size
+            and previous.get('mtime_ns') == stat.st_mtime_ns and previous.get('sha256')):
+        return dict(previous)
+
+    digest = hashlib.sha256()
+    checksum = None
+    with open(path, 'rb') as f:
+        first_chunk = True
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            if first_chunk and kind == 'chrome':
+                match = CHROME_CHECKSUM_RE.search(chunk[:4096])
+                if match:
+                    checksum = match.group(1).decode('ascii')
+            first_chunk = False
+            digest.update(chunk)
+
+    fingerprint = {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': digest.hexdigest(),
+    }
+    if checksum is not None:
+        fingerprint['checksum'] = checksum
+    return fingerprint
+
+# 判断指纹是否表示文件内容发生了变化
+def fingerprint_changed(old, new):
+    if not old or not new:
+        return True
+    if old.get('checksum') != new.get('checksum'):
+        return True
+    return old.get('sha256') != new.get('sha256')
+
+# 读取缓存状态文件
+def load_state():
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# 写入缓存状态文件（先写临时文件再重命名，避免中途退出留下损坏的状态）
+def save_state(state):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_file = STATE_FILE + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, STATE_FILE)
+
+# 读取上次记录的指纹（section为"parsed"、"synced"或"written"）
+def get_recorded_fingerprint(key, section='parsed'):
+    return load_state().get(section, {}).get(key)
+
+# 记录指纹
+def record_fingerprint(key, fingerprint, section='parsed'):
+    with STATE_LOCK:
+        state = load_state()
+        state.setdefault(section, {})[key] = fingerprint
+        save_state(state)
+
+# 解析结果缓存文件的路径
+def _tree_cache_file(key):
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, f"tree_{name}.pickle")
+
+# 读取与指纹对应的解析结果，内容不一致或缓存损坏时返回None
+def load_cached_tree(key, fingerprint):
+    try:
+        with open(_tree_cache_file(key), 'rb') as f:
+            cached = pickle.load(f)
+    except (OSError, pickle.PickleError, EOFError, AttributeError, ValueError):
+        return None
+
+    if cached.get('version') != TREE_FORMAT_VERSION:
+        return None
+    if fingerprint_changed(cached.get('fingerprint'), fingerprint):
+        return None
+    return cached.get('tree')
+
+# 以指纹为键保存解析结果
+def store_cached_tree(key, fingerprint, tree):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cache_file = _tree_cache_file(key)
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump({'version': TREE_FORMAT_VERSION, 'fingerprint': fingerprint, 'tree': tree}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+
+# 带缓存的解析：文件指纹未变时直接返回缓存的解析结果，否则调用parse_func重新解析
+# 返回(书签列表, 指纹, 是否来自缓存)
+def cached_parse(kind, path, parse_func, use_cache=True):
+    key = source_key(kind, path)
+    previous = get_recorded_fingerprint(key)
+    fingerprint = get_fingerprint(path, kind, previous)
+
+    if use_cache:
+        tree = load_cached_tree(key, fingerprint)
+        if tree is not None:
+            print(f"书签文件未变化，使用缓存的解析结果: {path}")
+            if fingerprint != previous:
+                # 文件被touch过但内容未变，更新大小和mtime，下次可直接走快速路径
+                record_fingerprint(key, fingerprint)
+            return tree, fingerprint, True
+
+    tree = parse_func(path)
+    if use_cache and tree is not None:
+        try:
+            store_cached_tree(key, fingerprint, tree)
+            record_fingerprint(key, fingerprint)
+        except OSError as e:
+            print(f"写入解析缓存时出错: {e}")
+    return tree, fingerprint, False
+
+# 预先解析并缓存书签文件，供之后的cached_parse直接使用；用于在子进程中并行解析多个文件
+# 只写入该文件自己的解析缓存，不修改状态文件（多个进程同时读-改-写状态文件会互相覆盖）
+# 返回是否重新解析了文件
+def warm_cache(kind, path, parse_func):
+    key = source_key(kind, path)
+    fingerprint = get_fingerprint(path, kind, get_recorded_fingerprint(key))
+    if load_cached_tree(key, fingerprint) is not None:
+        return False
+    tree = parse_func(path)
+    if tree is not None:
+        store_cached_tree(key, fingerprint, tree)
+    return True
+
+# 记录同步指纹的状态分区：同一个Safari书签文件会分别与多个Chrome配置文件同步，
+# 每个配置文件（scope）需要单独记录"上次同步时"Safari的指纹
+def _synced_section(scope=None):
+    return f'synced:{scope}' if scope else 'synced'
+
+# 判断自上次成功同步以来，给定的书签源是否都没有变化
+# sources为[(kind, path), ...]，返回(是否全部未变化, {key: 当前指纹})
+def sources_unchanged_since_sync(sources, scope=None):
+    synced = load_state().get(_synced_section(scope), {})
+    unchanged = True
+    fingerprints = {}
+    for kind, path in sources:
+        key = source_key(kind, path)
+        previous = synced.get(key)
+        fingerprint = get_fingerprint(path, kind, previous)
+        fingerprints[key] = fingerprint
+        if fingerprint_changed(previous, fingerprint):
+            unchanged = False
+    return unchanged, fingerprints
+
+# 记录一次成功同步后各书签源的指纹（应在写回浏览器文件之后调用）
+def record_synced_sources(sources, scope=None):
+    with STATE_LOCK:
+        state = load_state()
+        synced = state.setdefault(_synced_section(scope), {})
+        for kind, path in sources:
+            if path and os.path.exists(path):
+                key = source_key(kind, path)
+                synced[key] = get_fingerprint(path, kind, synced.get(key))
+        save_state(state)
+
+# 计算合并结果的摘要，用于判断写入浏览器的内容是否与上次相同
+# 按键排序序列化：从基线重建的合并结果字段顺序与上次不同，内容相同时摘要也要相同
+def bookmarks_digest(bookmarks):
+    return hashlib.sha256(json.dumps(bookmarks, sort_keys=True, separators=(',', ':')).encode('ascii')).hexdigest()
+
+# 记录写入书签文件的内容摘要和写入后的文件指纹
+def record_written(kind, path, digest):
+    key = source_key(kind, path)
+    record_fingerprint(key, {'digest': digest, 'fingerprint': get_fingerprint(path, kind)}, section='written')
+
+# 判断书签文件自上次写入后没有被修改，并且这次要写入的内容与上次相同（可以跳过写入）
+def written_unchanged(kind, path, digest):
+    if not path or not os.path.exists(path):
+        return False
+    written = get_recorded_fingerprint(source_key(kind, path), section='written')
+    if not written or written.get('digest') != digest:
+        return False
+    previous = written.get('fingerprint')
+    return not fingerprint_changed(previous, get_fingerprint(path, kind, previous))
@@ -5,17 +5,37 @@ import json
 import sys
 import fcntl
 import atexit
+import hashlib
+import functools
 import tempfile
+import argparse
 from datetime import datetime
 
-# 关闭chrome
-def close_chrome():
+import source_cache
+import chrome_stream_parser
+import instrumentation
+import snapshot_store
+import binary_snapshot
+import bookmark_output
+import chromium_browsers
+
+# 关闭chrome（browser为chromium_browsers.BROWSERS中的浏览器，如edge、brave）
+# 按进程名完全匹配，不会关闭命令行中恰好包含该名称的其他进程（如其他Chromium系浏览器或同步进程本身）
+def close_chrome(browser='chrome'):
+    info = chromium_browsers.BROWSERS[browser]
+    process = info['process']
     if sys.platform == 'darwin':
-        os.system('osascript -e \'tell application "Google Chrome" to quit\'')
+        os.system(f'osascript -e \'tell application "{info["app"]}" to quit\'')
     elif sys.platform.startswith('win'):
-        os.system('taskkill /f /im chrome.exe')
+        if process.get('win_dir'):
+            # 映像名相同的浏览器（Chrome和Chromium都是chrome.exe）按程序所在的目录区分
+            image = os.path.splitext(process['win'])[0]
+            os.system(f'powershell -NoProfile -Command "Get-Process -Name {image} -ErrorAction SilentlyContinue | '
+                      f"Where-Object {{ $_.Path -like '*\\{process['win_dir']}\\*' }} | Stop-Process -Force\"")
+        else:
+            os.system(f'taskkill /f /im {process["win"]}')
     elif sys.platform.startswith('linux'):
-        os.system('pkill -f chrome')
+        os.system(f'pkill -x {process["linux"]}')
     else:
         print(f"不支持的操作系统: {sys.platform}")
 # 关闭safari
@@ -29,56 +49,95 @@ def close_safari():
     else:
         print(f"不支持的操作系统: {sys.platform}")
 
-# 锁文件路径
+# 锁文件路径（未指定书签文件时使用）
 LOCK_FILE = os.path.join(tempfile.gettempdir(), 'chrome_bookmarks_viewer.lock')
 
-# 锁文件句柄
-lock_handle = None
+# 已获取的锁：{锁文件路径: 文件句柄}
+lock_handles = {}
+
+# 每个书签文件（即每个Chrome配置文件）使用单独的锁文件，不同配置文件可以同时同步
+def get_lock_file(bookmarks_file=None):
+    if not bookmarks_file:
+        return LOCK_FILE
+    name = hashlib.sha1(os.path.abspath(bookmarks_file).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'chrome_bookmarks_viewer_{name}.lock')
 
 # 清理锁文件
 def cleanup_lock():
-    global lock_handle
-    if lock_handle:
+    for lock_file, handle in list(lock_handles.items()):
         try:
-            fcntl.flock(lock_handle, fcntl.LOCK_UN)
-            lock_handle.close()
-            os.unlink(LOCK_FILE)
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+            os.unlink(lock_file)
         except:
             pass
+        lock_handles.pop(lock_file, None)
 
-# 获取锁
-def acquire_lock():
-    global lock_handle
+# 获取锁，bookmarks_file为要读写的书签文件；同一进程内重复获取同一个锁直接返回True
+def acquire_lock(bookmarks_file=None):
+    lock_file = get_lock_file(bookmarks_file)
+    if lock_file in lock_handles:
+        return True
+    handle = None
     try:
-        lock_handle = open(LOCK_FILE, 'w')
-        fcntl.flock(lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        handle = open(lock_file, 'w')
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
         # 写入PID
-        lock_handle.write(str(os.getpid()))
-        lock_handle.flush()
+        handle.write(str(os.getpid()))
+        handle.flush()
         # 注册退出时清理
-        atexit.register(cleanup_lock)
+        if not lock_handles:
+            atexit.register(cleanup_lock)
+        lock_handles[lock_file] = handle
         return True
     except IOError:
         # 已被锁定
-        if lock_handle:
-            lock_handle.close()
-            lock_handle = None
+        if handle:
+            handle.close()
         return False
 
-# 定义Chrome书签文件的路径（根据操作系统不同）
-def get_bookmarks_path():
-    # macOS路径
-    if sys.platform == 'darwin':
-        return os.path.expanduser('~/Library/Application Support/Google/Chrome/Default/Bookmarks')
-    # Windows路径
-    elif sys.platform.startswith('win'):
-        return os.path.join(os.environ['LOCALAPPDATA'], r'Google\Chrome\User Data\Default\Bookmarks')
-    # Linux路径
-    elif sys.platform.startswith('linux'):
-        return os.path.expanduser('~/.config/google-chrome/Default/Bookmarks')
-    else:
-        print(f"不支持的操作系统: {sys.platform}")
+# Chrome用户数据目录（包含Local State和各个配置文件的目录），其他Chromium系浏览器的位置见chromium_browsers
+def get_user_data_dir(browser='chrome'):
+    return chromium_browsers.get_user_data_dir(browser)
+
+# 定义Chrome书签文件的路径（根据操作系统不同），profile为配置文件目录名
+def get_bookmarks_path(profile='Default', user_data_dir=None, browser='chrome'):
+    user_data_dir = user_data_dir or get_user_data_dir(browser)
+    if not user_data_dir:
         return None
+    return os.path.join(user_data_dir, profile, 'Bookmarks')
+
+# 从Local State读取所有配置文件，返回[(配置文件目录名, 显示名称, 书签文件路径)]
+# 只返回存在书签文件的配置文件；Local State不存在或无法解析时只返回Default
+def list_profiles(user_data_dir=None, browser='chrome'):
+    user_data_dir = user_data_dir or get_user_data_dir(browser)
+    if not user_data_dir:
+        return []
+
+    profiles = {}
+    try:
+        with open(os.path.join(user_data_dir, 'Local State'), 'r', encoding='utf-8') as f:
+            info_cache = json.load(f).get('profile', {}).get('info_cache', {})
+        for profile_dir, info in info_cache.items():
+            profiles[profile_dir] = (info or {}).get('name') or profile_dir
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"无法读取{chromium_browsers.browser_name(browser)}的Local State，只使用Default配置文件: {e}")
+    if not profiles:
+        profiles['Default'] = 'Default'
+
+    result = []
+    # Default排在最前面，其余按目录名排序（Profile 1、Profile 2……）
+    for profile_dir in sorted(profiles, key=lambda name: (name != 'Default', name)):
+        bookmarks_file = get_bookmarks_path(profile_dir, user_data_dir)
+        if os.path.exists(bookmarks_file):
+            result.append((profile_dir, profiles[profile_dir], bookmarks_file))
+    return result
+
+# 保留节点的id、guid、date_added等元数据
+def copy_chrome_meta(node, info):
+    for key in chrome_stream_parser.CHROME_META_KEYS:
+        if key in node:
+            info[key] = node[key]
 
 # 递归解析书签文件夹
 def parse_bookmarks(node, depth=0, path=""):
@@ -98,6 +157,7 @@ def parse_bookmarks(node, depth=0, path=""):
             'depth': depth,
             'children': []
         }
+        copy_chrome_meta(node, folder_info)
         
         # 递归处理子项
         if 'children' in node:
@@ -116,71 +176,34 @@ def parse_bookmarks(node, depth=0, path=""):
             'path': path,
             'depth': depth
         }
+        copy_chrome_meta(node, bookmark_info)
         results.append(bookmark_info)
     
     return results
 
-# 打印书签树
+# 读取并解析Chrome书签文件，返回书签列表（供main和run_pipeline.py共用）
+# 使用流式解析器逐个读取节点，不再先用json.load把整个文件读成字典
+# browser为其他Chromium系浏览器时，根文件夹改为Chrome的名称，合并时与Chrome的根文件夹对应
+@instrumentation.timed('step1.read_chrome_bookmarks')
+def read_chrome_bookmarks(bookmarks_file, browser='chrome'):
+    bookmarks = chrome_stream_parser.parse_bookmarks_file(
+        bookmarks_file, on_root=lambda root_name: print(f"处理书签根目录: {root_name}"),
+        root_names=chromium_browsers.read_root_names(browser))
+    instrumentation.count('chrome.bytes_read', os.path.getsize(bookmarks_file))
+    instrumentation.count_nodes('chrome.nodes_parsed', bookmarks)
+    return bookmarks
+
+# 打印书签树（通过一个缓冲写入器输出，不再每行调用一次print）
 def print_bookmarks_tree(bookmarks, indent=0):
-    for item in bookmarks:
-        # 缩进显示层级
-        prefix = '  ' * indent
-        
-        if item['type'] == 'folder':
-            # 文件夹用方括号标识
-            print(f"{prefix}[{item['name']}]")
-            # 递归打印子项
-            print_bookmarks_tree(item['children'], indent + 1)
-        else:
-            # 书签显示名称和URL
-            print(f"{prefix}- {item['name']}: {item['url']}")
+    with bookmark_output.buffered_stdout() as out:
+        out.writelines(bookmark_output.iter_tree_lines(bookmarks, indent))
 
 # 打印书签列表（扁平化显示）
 def print_bookmarks_list(bookmarks):
-    flat_list = []
-    
-    # 递归展平书签树
-    def flatten(items, current_path=""):
-        for item in items:
-            if item['type'] == 'folder':
-                path = item['path']
-                flatten(item['children'], path)
-            else:
-                flat_list.append({
-                    'name': item['name'],
-                    'url': item['url'],
-                    'path': item['path']
-                })
-    
-    flatten(bookmarks)
-    
-    # 打印表头
-    print("\n书签列表:")
-    print("-" * 100)
-    print(f"{'标题':<40} {'路径':<30} {'URL':<40}")
-    print("-" * 100)
-    
-    # 打印书签
-    for bookmark in flat_list:
-        title = bookmark['name']
-        path = bookmark['path']
-        url = bookmark['url']
-        
-        # 截断过长的字符串以便于显示
-        if len(title) > 38:
-            title = title[:35] + '...'
-        if len(path) > 28:
-            path = path[:25] + '...'
-        if len(url) > 38:
-            url = url[:35] + '...'
-            
-        print(f"{title:<40} {path:<30} {url:<40}")
-    
-    print("-" * 100)
-    print(f"总计: {len(flat_list)} 个书签")
+    bookmark_output.write_list(bookmarks)
 
-# 保存书签到JSON文件
-def save_bookmarks(bookmarks):
+# 保存书签：默认保存为二进制快照（.bksnap），后续步骤通过mmap读取，不需要解析JSON；save_json为True时另外保存JSON文件
+def save_bookmarks(bookmarks, save_json=False):
     # 创建输出目录
     output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'step1chromebookmarks')
     
@@ -198,70 +221,79 @@ def save_bookmarks(bookmarks):
     
     # 创建时间戳文件名
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    json_file = os.path.join(output_dir, f"chrome_bookmarks_{timestamp}.json")
+    snapshot_file = os.path.join(output_dir, f"chrome_bookmarks_{timestamp}{binary_snapshot.SUFFIX}")
+    binary_snapshot.write_snapshot(bookmarks, snapshot_file)
+    print(f"书签已保存到: {snapshot_file}")
     
-    # 保存为JSON格式
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(bookmarks, f, ensure_ascii=False, indent=2)
+    # 需要时另外保存为JSON格式（也可以之后用binary_snapshot.py export导出）
+    if save_json:
+        json_file = os.path.join(output_dir, f"chrome_bookmarks_{timestamp}.json")
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump(bookmarks, f, ensure_ascii=False, indent=2)
+        print(f"书签已保存到: {json_file}")
     
-    print(f"书签已保存到: {json_file}")
-    return json_file
+    # 目录中只保留最新的文件，历史版本保存在快照存储中
+    snapshot_store.record('step1_chrome', bookmarks)
+    return snapshot_file
 
-# 主函数
-def main():
-    # 关闭Chrome浏览器以确保书签文件可以被读取
-    print("正在关闭Chrome浏览器...")
-    close_chrome()
+# 读取、显示并保存书签；stdout为显示JSON统计时使用的标准输出
+def view_bookmarks(args, stdout):
+    name = chromium_browsers.browser_name(args.browser)
+
+    # 关闭浏览器以确保书签文件可以被读取
+    print(f"正在关闭{name}浏览器...")
+    close_chrome(args.browser)
     
-    # 尝试获取锁
-    if not acquire_lock():
+    # 获取书签文件路径
+    bookmarks_file = get_bookmarks_path(browser=args.browser)
+
+    # 尝试获取锁（与run_pipeline.py同步同一个配置文件时使用同一个锁）
+    if not acquire_lock(bookmarks_file):
         print("另一个实例正在运行，退出...")
         return
 
     print(f"脚本路径: {os.path.abspath(__file__)}")
-
-    # 获取Chrome书签文件路径
-    bookmarks_file = get_bookmarks_path()
     if not bookmarks_file or not os.path.exists(bookmarks_file):
-        print(f"错误: Chrome书签文件不存在: {bookmarks_file}")
+        print(f"错误: {name}书签文件不存在: {bookmarks_file}")
         return
     
-    print(f"正在读取Chrome书签文件: {bookmarks_file}")
+    print(f"正在读取{name}书签文件: {bookmarks_file}")
     
     try:
-        # 读取并解析书签文件
-        with open(bookmarks_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Chrome书签文件的根结构
-        roots = data.get('roots', {})
-        bookmarks = []
-        
-        # 处理主要的书签文件夹（书签栏、其他书签等）
-        for root_name, root_data in roots.items():
-            if root_name not in ['sync_transaction_version', 'version']:
-                print(f"处理书签根目录: {root_name}")
-                root_bookmarks = parse_bookmarks(root_data)
-                bookmarks.extend(root_bookmarks)
+        # 读取并解析书签文件（文件未变化时直接使用缓存的解析结果）
+        bookmarks, _, _ = source_cache.cached_parse(
+            'chrome', bookmarks_file, functools.partial(read_chrome_bookmarks, browser=args.browser))
         
         if not bookmarks:
             print("未找到书签")
             return
         
-        # 打印书签树（层级结构）
-        print("\n书签树结构:")
-        print("-" * 50)
-        print_bookmarks_tree(bookmarks)
+        # 按输出级别打印统计、逐层浏览或完整的书签树和列表
+        bookmark_output.show_bookmarks(bookmarks, args.output, args.json_stats, f"{name}书签", args.browser, stdout)
         
-        # 打印书签列表
-        print_bookmarks_list(bookmarks)
-        
-        # 保存书签到JSON文件
-        save_bookmarks(bookmarks)
+        # 保存书签（二进制快照，--save-json时另外保存JSON文件）
+        save_bookmarks(bookmarks, args.save_json)
         
     except Exception as e:
         print(f"读取或解析书签文件时出错: {e}")
 
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="读取Chrome书签，打印统计或书签树，并保存到step1chromebookmarks目录")
+    bookmark_output.add_output_arguments(parser)
+    parser.add_argument('--browser', choices=list(chromium_browsers.BROWSERS), default='chrome',
+                        help="读取的Chromium系浏览器（默认chrome），书签文件格式与Chrome相同")
+    parser.add_argument('--save-json', action='store_true',
+                        help="除二进制快照（.bksnap）外另外保存JSON格式的书签文件")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+    # --json-stats时stdout中只输出JSON统计，其余提示信息输出到stderr
+    with bookmark_output.json_stats_stdout(args.json_stats) as stdout:
+        view_bookmarks(args, stdout)
+
 if __name__ == "__main__":
     try:
         main()
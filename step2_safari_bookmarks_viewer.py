@@ -6,10 +6,18 @@ import sys
 import fcntl
 import atexit
 import tempfile
+import argparse
 import subprocess
 import plistlib
 from datetime import datetime
 
+import source_cache
+from html_bookmarks_importer import read_html_bookmarks
+import bookmark_output
+import instrumentation
+import snapshot_store
+import binary_snapshot
+
 # 关闭chrome
 def close_chrome():
     if sys.platform == 'darwin':
@@ -171,7 +179,7 @@ def get_actual_safari_bookmarks():
             print("  1. 打开Safari浏览器")
             print("  2. 菜单栏选择 '文件' → '导出书签...'")
             print("  3. 将导出的HTML文件保存到项目目录")
-            print("  4. 脚本可以解析HTML格式的书签文件")
+            print("  4. 再次运行脚本，会自动解析项目目录中最新的HTML书签文件")
             print("\n方案2: 直接读取Safari书签文件")
             print("  - 脚本会尝试直接读取 ~/Library/Safari/Bookmarks.plist 文件")
             print("  - 这需要完整磁盘访问权限")
@@ -332,131 +340,106 @@ def export_safari_bookmarks():
         print(f"导出Safari书签时出错: {e}")
         return None
 
-# 递归解析Safari书签
+# 需要跳过的系统文件夹，其中的子项直接并入上一级
+SKIP_FOLDERS = ('com.apple.ReadingList', 'BookmarksMenu', 'BookmarksBar', 'Menu')
+
+# 解析Safari书签
+# 使用显式栈一次遍历整棵树，子项通过引用直接追加到所属文件夹的children中，耗时与书签数量成线性关系
 def parse_safari_bookmarks(node, path=""):
     results = []
-    
-    # 跳过特定的系统文件夹
-    skip_folders = ['com.apple.ReadingList', 'BookmarksMenu', 'BookmarksBar', 'Menu']
-    
-    # 处理文件夹
-    if 'Children' in node and isinstance(node['Children'], list):
-        folder_name = node.get('Title', 'Unnamed Folder')
-        
-        # 跳过系统文件夹
-        if folder_name in skip_folders or node.get('WebBookmarkType') == 'WebBookmarkTypeList':
-            current_path = path
-        else:
-            # 更新路径
-            current_path = f"{path}/{folder_name}" if path else folder_name
-            
-            # 添加文件夹信息
+    # 栈中保存(待处理的子项迭代器, 子项要追加到的列表, 当前路径)
+    stack = [(iter((node,)), results, path)]
+
+    while stack:
+        items, target, current_path = stack[-1]
+        item = next(items, None)
+        if item is None:
+            stack.pop()
+            continue
+        if not isinstance(item, dict):
+            continue
+
+        # 处理文件夹
+        children = item.get('Children')
+        if isinstance(children, list):
+            folder_name = item.get('Title', 'Unnamed Folder')
+
+            # 跳过系统文件夹和没有标题的列表容器（书签文件的根），子项并入当前列表；
+            # Safari中用户的文件夹同样是WebBookmarkTypeList，但有标题，作为文件夹保留
+            if folder_name in SKIP_FOLDERS or (item.get('WebBookmarkType') == 'WebBookmarkTypeList'
+                                               and not item.get('Title')):
+                stack.append((iter(children), target, current_path))
+                continue
+
+            folder_path = f"{current_path}/{folder_name}" if current_path else folder_name
             folder_info = {
                 'type': 'folder',
                 'name': folder_name,
-                'path': current_path,
+                'path': folder_path,
                 'children': []
             }
-            
-            results.append(folder_info)
-        
-        # 递归处理子项
-        for child in node['Children']:
-            child_items = parse_safari_bookmarks(child, current_path)
-            
-            # 如果当前是文件夹，将子项添加到children中
-            if folder_name not in skip_folders and node.get('WebBookmarkType') != 'WebBookmarkTypeList' and child_items:
-                for item in results:
-                    if item['type'] == 'folder' and item['name'] == folder_name:
-                        item['children'].extend(child_items)
-                        break
-            else:
-                results.extend(child_items)
+            target.append(folder_info)
+            stack.append((iter(children), folder_info['children'], folder_path))
+
+        # 处理书签
+        elif item.get('WebBookmarkType') == 'WebBookmarkTypeLeaf' and 'URLString' in item:
+            # 尝试多种方式获取标题
+            title = ''
+            uri_dictionary = item.get('URIDictionary')
+            if uri_dictionary and 'title' in uri_dictionary:
+                title = uri_dictionary['title']
+            elif 'Title' in item:
+                title = item['Title']
+
+            # 如果没有标题，使用默认名称
+            if not title:
+                title = 'Unnamed Bookmark'
+
+            target.append({
+                'type': 'url',
+                'name': title,
+                'url': item.get('URLString', ''),
+                'path': current_path if current_path else "根目录"
+            })
+
+    return results
+
+# 在项目目录中查找最新的书签HTML文件（Safari菜单"文件" → "导出书签..."生成的文件）
+def find_exported_html_file():
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    html_files = [os.path.join(project_dir, name) for name in os.listdir(project_dir)
+                  if name.lower().endswith(('.html', '.htm'))]
+    if not html_files:
+        return None
+    return max(html_files, key=os.path.getmtime)
+
+# 读取并解析Safari书签文件，返回书签列表（供main和run_pipeline.py共用）
+def read_safari_bookmarks(bookmarks_file):
+    with instrumentation.measure('step2.plistlib.load'), open(bookmarks_file, 'rb') as f:
+        data = plistlib.load(f)
+    instrumentation.count('safari.bytes_read', os.path.getsize(bookmarks_file))
     
-    # 处理书签
-    elif node.get('WebBookmarkType') == 'WebBookmarkTypeLeaf' and 'URLString' in node:
-        # 尝试多种方式获取标题
-        title = ''
-        if 'URIDictionary' in node and node['URIDictionary'] and 'title' in node['URIDictionary']:
-            title = node['URIDictionary']['title']
-        elif 'Title' in node:
-            title = node['Title']
-        
-        # 如果没有标题，使用默认名称
-        if not title:
-            title = 'Unnamed Bookmark'
-        
-        bookmark_info = {
-            'type': 'url',
-            'name': title,
-            'url': node.get('URLString', ''),
-            'path': path if path else "根目录"
-        }
-        results.append(bookmark_info)
+    # Safari书签文件的根结构
+    if 'Children' not in data:
+        return []
     
-    return results
+    print("解析Safari书签文件...")
+    with instrumentation.measure('step2.parse_safari_bookmarks'):
+        bookmarks = parse_safari_bookmarks(data)
+    instrumentation.count_nodes('safari.nodes_parsed', bookmarks)
+    return bookmarks
 
-# 打印书签树
+# 打印书签树（通过一个缓冲写入器输出，不再每行调用一次print）
 def print_bookmarks_tree(bookmarks, indent=0):
-    for item in bookmarks:
-        # 缩进显示层级
-        prefix = '  ' * indent
-        
-        if item['type'] == 'folder':
-            # 文件夹用方括号标识
-            print(f"{prefix}[{item['name']}]")
-            # 递归打印子项
-            print_bookmarks_tree(item['children'], indent + 1)
-        else:
-            # 书签显示名称和URL
-            print(f"{prefix}- {item['name']}: {item.get('url', '')}")
+    with bookmark_output.buffered_stdout() as out:
+        out.writelines(bookmark_output.iter_tree_lines(bookmarks, indent))
 
 # 打印书签列表（扁平化显示）
 def print_bookmarks_list(bookmarks):
-    flat_list = []
-    
-    # 递归展平书签树
-    def flatten(items, current_path=""):
-        for item in items:
-            if item['type'] == 'folder':
-                path = item['path']
-                flatten(item['children'], path)
-            else:
-                flat_list.append({
-                    'name': item['name'],
-                    'url': item.get('url', ''),
-                    'path': item['path']
-                })
-    
-    flatten(bookmarks)
-    
-    # 打印表头
-    print("\n书签列表:")
-    print("-" * 100)
-    print(f"{'标题':<40} {'路径':<30} {'URL':<40}")
-    print("-" * 100)
-    
-    # 打印书签
-    for bookmark in flat_list:
-        title = bookmark['name']
-        path = bookmark['path']
-        url = bookmark.get('url', '')
-        
-        # 截断过长的字符串以便于显示
-        if len(title) > 38:
-            title = title[:35] + '...'
-        if len(path) > 28:
-            path = path[:25] + '...'
-        if len(url) > 38:
-            url = url[:35] + '...'
-            
-        print(f"{title:<40} {path:<30} {url:<40}")
-    
-    print("-" * 100)
-    print(f"总计: {len(flat_list)} 个书签")
+    bookmark_output.write_list(bookmarks)
 
-# 保存书签到JSON文件
-def save_bookmarks(bookmarks):
+# 保存书签：默认保存为二进制快照（.bksnap），后续步骤通过mmap读取，不需要解析JSON；save_json为True时另外保存JSON文件
+def save_bookmarks(bookmarks, save_json=False):
     # 创建输出目录
     output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'step2safaribookmarks')
     
@@ -474,14 +457,20 @@ def save_bookmarks(bookmarks):
     
     # 创建时间戳文件名
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    json_file = os.path.join(output_dir, f"safari_bookmarks_{timestamp}.json")
+    snapshot_file = os.path.join(output_dir, f"safari_bookmarks_{timestamp}{binary_snapshot.SUFFIX}")
+    binary_snapshot.write_snapshot(bookmarks, snapshot_file)
+    print(f"书签已保存到: {snapshot_file}")
     
-    # 保存为JSON格式
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(bookmarks, f, ensure_ascii=False, indent=2)
+    # 需要时另外保存为JSON格式（也可以之后用binary_snapshot.py export导出）
+    if save_json:
+        json_file = os.path.join(output_dir, f"safari_bookmarks_{timestamp}.json")
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump(bookmarks, f, ensure_ascii=False, indent=2)
+        print(f"书签已保存到: {json_file}")
     
-    print(f"书签已保存到: {json_file}")
-    return json_file
+    # 目录中只保留最新的文件，历史版本保存在快照存储中
+    snapshot_store.record('step2_safari', bookmarks)
+    return snapshot_file
 
 # 生成示例书签数据
 def generate_sample_bookmarks():
@@ -821,8 +810,8 @@ def generate_sample_bookmarks():
         }
     ]
 
-# 主函数
-def main():
+# 读取、显示并保存书签；stdout为显示JSON统计时使用的标准输出
+def view_bookmarks(args, stdout):
     # 关闭Safari浏览器以确保书签文件可以被读取
     print("正在关闭Safari浏览器...")
     close_safari()
@@ -842,20 +831,24 @@ def main():
         print(f"正在读取Safari书签文件: {bookmarks_file}")
         
         try:
-            # 读取并解析plist文件
-            with open(bookmarks_file, 'rb') as f:
-                data = plistlib.load(f)
-            
-            # Safari书签文件的根结构
-            if 'Children' in data:
-                print("解析Safari书签文件...")
-                bookmarks = parse_safari_bookmarks(data)
+            # 读取并解析plist文件（文件未变化时直接使用缓存的解析结果）
+            bookmarks, _, _ = source_cache.cached_parse('safari', bookmarks_file, read_safari_bookmarks)
         except Exception as e:
             print(f"读取或解析Safari书签文件时出错: {e}")
     else:
         print(f"Safari书签文件不存在或无法访问")
     
-    # 方法2: 如果直接读取失败，尝试使用AppleScript导出
+    # 方法2: 如果直接读取失败，解析用户手动导出到项目目录的HTML书签文件
+    if not bookmarks:
+        html_file = find_exported_html_file()
+        if html_file:
+            print(f"正在读取导出的书签HTML文件: {html_file}")
+            try:
+                bookmarks = read_html_bookmarks(html_file)
+            except Exception as e:
+                print(f"读取或解析书签HTML文件时出错: {e}")
+
+    # 方法3: 如果仍然没有书签，尝试使用AppleScript导出
     if not bookmarks:
         print("尝试使用AppleScript导出Safari书签...")
         applescript_bookmarks = export_safari_bookmarks()
@@ -880,16 +873,26 @@ def main():
         print("未找到书签")
         return
     
-    # 打印书签树（层级结构）
-    print("\n书签树结构:")
-    print("-" * 50)
-    print_bookmarks_tree(bookmarks)
-    
-    # 打印书签列表
-    print_bookmarks_list(bookmarks)
+    # 按输出级别打印统计、逐层浏览或完整的书签树和列表
+    bookmark_output.show_bookmarks(bookmarks, args.output, args.json_stats, "Safari书签", 'safari', stdout)
     
-    # 保存书签到JSON文件
-    save_bookmarks(bookmarks)
+    # 保存书签（二进制快照，--save-json时另外保存JSON文件）
+    save_bookmarks(bookmarks, args.save_json)
+
+# 解析命令行参数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="读取Safari书签，打印统计或书签树，并保存到step2safaribookmarks目录")
+    bookmark_output.add_output_arguments(parser)
+    parser.add_argument('--save-json', action='store_true',
+                        help="除二进制快照（.bksnap）外另外保存JSON格式的书签文件")
+    return parser.parse_args(argv)
+
+# 主函数
+def main(argv=None):
+    args = parse_args(argv)
+    # --json-stats时stdout中只输出JSON统计，其余提示信息输出到stderr
+    with bookmark_output.json_stats_stdout(args.json_stats) as stdout:
+        view_bookmarks(args, stdout)
 
 # 全局变量，用于标记脚本是否已经执行过
 _SCRIPT_EXECUTED = False
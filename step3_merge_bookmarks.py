@@ -4,8 +4,14 @@ import os
 import sys
 import json
 import shutil
+import functools
 import importlib.util
 from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import instrumentation
+import snapshot_store
+import binary_snapshot
 
 # 导入Chrome和Safari书签脚本作为模块
 def import_script(script_path):
@@ -15,37 +21,218 @@ def import_script(script_path):
     spec.loader.exec_module(module)
     return module
 
-# 获取最新的JSON文件
-def get_latest_json_file(directory):
+# 获取最新的书签文件（二进制快照或JSON）；同一次保存的两种文件都存在时使用二进制快照
+def get_latest_bookmarks_file(directory):
     if not os.path.exists(directory):
         return None
     
-    json_files = [f for f in os.listdir(directory) if f.endswith('.json')]
-    if not json_files:
+    latest = {}
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        if ext in ('.json', binary_snapshot.SUFFIX):
+            mtime = os.path.getmtime(os.path.join(directory, name))
+            latest[stem] = max(latest.get(stem, mtime), mtime)
+    if not latest:
         return None
     
-    # 按文件修改时间排序，获取最新的
-    latest_file = max(json_files, key=lambda f: os.path.getmtime(os.path.join(directory, f)))
-    return os.path.join(directory, latest_file)
+    stem = max(latest, key=latest.get)
+    snapshot_file = os.path.join(directory, stem + binary_snapshot.SUFFIX)
+    return snapshot_file if os.path.exists(snapshot_file) else os.path.join(directory, stem + '.json')
+
+# 各协议的默认端口，规范化时去掉
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21}
+
+# 需要去掉的跟踪参数（utm_*另外按前缀匹配）
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid', 'igshid', 'spm', '_hsenc', '_hsmi'}
+
+# Chrome根文件夹在不同语言下的名称，统一映射为固定的键，避免根文件夹改名被当成移动
+ROOT_FOLDER_ALIASES = {
+    'Bookmarks Bar': 'bookmark_bar',
+    'Bookmarks bar': 'bookmark_bar',
+    '书签栏': 'bookmark_bar',
+    'Other Bookmarks': 'other',
+    'Other bookmarks': 'other',
+    '其他书签': 'other',
+    'Mobile Bookmarks': 'synced',
+    'Mobile bookmarks': 'synced',
+    '移动设备书签': 'synced',
+}
+
+# 主机名规范化（小写+IDNA），同一主机在书签中会重复出现成千上万次，因此单独缓存
+@functools.lru_cache(maxsize=65536)
+def canonicalize_host(host):
+    host = host.lower().rstrip('.')
+    try:
+        return host.encode('idna').decode('ascii')
+    except UnicodeError:
+        # 无法IDNA编码的主机名（如过长的标签）保持小写原样
+        return host
+
+# 计算书签URL的规范形式，作为去重索引的键
+@functools.lru_cache(maxsize=262144)
+def canonicalize_url(url):
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+
+    scheme = parts.scheme.lower()
+    # javascript:、chrome://、file:等非网络地址只做去空白处理
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return url
+
+    netloc = canonicalize_host(parts.hostname)
+    if ':' in netloc:
+        # IPv6地址需要重新加上方括号
+        netloc = f"[{netloc}]"
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        netloc = f"{netloc}:{port}"
+    if parts.username:
+        userinfo = parts.username
+        if parts.password:
+            userinfo = f"{userinfo}:{parts.password}"
+        netloc = f"{userinfo}@{netloc}"
+
+    # 路径：空路径视为"/"，非根路径去掉末尾斜杠
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+
+    # 查询参数：去掉utm_*等跟踪参数，其余保持原有顺序
+    query = parts.query
+    if query:
+        params = [(k, v) for k, v in parse_qsl(query, keep_blank_values=True)
+                  if not k.lower().startswith('utm_') and k.lower() not in TRACKING_PARAMS]
+        query = urlencode(params)
+
+    # 片段：只保留单页应用的路由片段（#!或#/），普通锚点去掉
+    fragment = parts.fragment
+    if not fragment.startswith(('!', '/')):
+        fragment = ''
+
+    return urlunsplit((scheme, netloc, path, query, fragment))
+
+# 文件夹名称的规范形式：忽略大小写和多余的空白，"Work  Infra"与"work infra"视为同一个文件夹
+def normalize_folder_name(name):
+    return ' '.join(name.split()).casefold()
+
+# 计算文件夹的规范路径，返回(文件夹的键, 其子项所在的路径)
+# parent_path为None表示顶层。顶层的Chrome根目录文件夹（书签栏、其他书签等）以固定的键标识，
+# 其子项与Safari顶层的书签处在同一层（Safari读取时已去掉书签栏、菜单等系统文件夹），
+# 因此Chrome书签栏中的Work、其他书签中的Work和Safari顶层的Work是同一个文件夹
+def folder_path(parent_path, name):
+    if parent_path is None and name in ROOT_FOLDER_ALIASES:
+        return f"root:{ROOT_FOLDER_ALIASES[name]}", ''
+    segment = normalize_folder_name(name)
+    path = f"{parent_path}/{segment}" if parent_path else segment
+    return path, path
+
+# 按规范文件夹路径合并多棵书签树（按优先级排列，Chrome在前），一次遍历完成
+# - 规范路径相同的文件夹只保留第一次出现的节点，之后出现的同名文件夹的子项并入其中
+# - 书签按规范URL去重，保留第一次出现的书签，并在sources中记录所有来源
+# - 子项顺序稳定交错：第一次出现的文件夹中的子项保持原顺序，之后并入的新子项紧跟在它在原列表中
+#   前一个已经存在于该文件夹的兄弟节点之后，开头的新子项放在最前面
+# 返回(合并后的列表, 移除的重复书签数, 合并的文件夹数)
+def merge_trees(trees):
+    root = {'type': 'folder', 'name': '', 'children': []}
+    folders = {}     # 规范路径 -> 保留的文件夹节点
+    urls = {}        # 规范URL -> 保留的书签
+    parents = {}     # id(节点) -> 所在的合并后文件夹
+    heads = {}       # id(文件夹) -> 插入到文件夹开头的新子项
+    followers = {}   # id(节点) -> 紧跟在该节点之后插入的新子项
+    touched = {}     # id(文件夹) -> 有子项并入、需要重新排列的文件夹
+    counts = {'removed': 0, 'folders': 0}
+
+    # 把一个来源中的子项并入合并后的folder；fresh为True时items就是folder原来的子项（第一次出现）
+    def merge_children(folder, items, path, fresh):
+        kept = []
+        run = kept if fresh else heads.setdefault(id(folder), [])
+        if not fresh:
+            touched[id(folder)] = folder
+        for item in items:
+            existing = None
+            if item['type'] == 'url' and item.get('url'):
+                key = canonicalize_url(item['url'])
+                existing = urls.get(key)
+                source = item.get('source', '')
+                if existing is None:
+                    item['sources'] = [source]
+                    urls[key] = item
+                else:
+                    if source not in existing['sources']:
+                        existing['sources'].append(source)
+                    counts['removed'] += 1
+            elif item['type'] == 'folder':
+                key, child_path = folder_path(path, item.get('name', ''))
+                existing = folders.get(key)
+                children = item.get('children') or []
+                if existing is None:
+                    folders[key] = item
+                    if 'children' in item:
+                        merge_children(item, children, child_path, True)
+                else:
+                    counts['folders'] += 1
+                    existing.setdefault('children', [])
+                    merge_children(existing, children, child_path, False)
+
+            if existing is None:
+                parents[id(item)] = folder
+                run.append(item)
+            elif not fresh and parents.get(id(existing)) is folder:
+                # 已经在该文件夹中的节点作为锚点，之后的新子项插入到它后面
+                run = followers.setdefault(id(existing), [])
+        if fresh:
+            folder['children'] = kept
+
+    for index, items in enumerate(trees):
+        merge_children(root, items, None, index == 0)
+
+    # 按锚点展开稳定交错后的子项顺序
+    def ordered(nodes):
+        result = []
+        stack = [iter(nodes)]
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                stack.pop()
+                continue
+            result.append(node)
+            after = followers.get(id(node))
+            if after:
+                stack.append(iter(after))
+        return result
+
+    for folder in touched.values():
+        lead = heads.get(id(folder), [])
+        # 顶层没有可以对齐的位置（Chrome的根目录文件夹在Safari中不存在），新增的顶层项放在最后
+        folder['children'] = ordered(folder['children'] + lead if folder is root else lead + folder['children'])
+
+    return root['children'], counts['removed'], counts['folders']
 
 # 合并书签
-def merge_bookmarks(chrome_bookmarks, safari_bookmarks):
+@instrumentation.timed('step3.merge_bookmarks')
+# extra_sources为其他只读取的来源[(来源, 书签列表)]（如Firefox），排在Safari之后合并
+def merge_bookmarks(chrome_bookmarks, safari_bookmarks, extra_sources=()):
+    trees = [('Chrome', chrome_bookmarks), ('Safari', safari_bookmarks), *extra_sources]
+
     # 为每个书签添加来源标记
-    for bookmark in chrome_bookmarks:
-        add_source_to_bookmarks(bookmark, 'Chrome')
-    
-    for bookmark in safari_bookmarks:
-        add_source_to_bookmarks(bookmark, 'Safari')
-    
+    for source, bookmarks in trees:
+        for bookmark in bookmarks:
+            add_source_to_bookmarks(bookmark, source)
+
     # 修改所有书签的path为"Bookmarks Bar"，depth设为0
-    for bookmark in chrome_bookmarks:
-        normalize_bookmark_path(bookmark)
-    
-    for bookmark in safari_bookmarks:
-        normalize_bookmark_path(bookmark)
-    
-    # 合并两个列表
-    merged_bookmarks = chrome_bookmarks + safari_bookmarks
+    for _, bookmarks in trees:
+        for bookmark in bookmarks:
+            normalize_bookmark_path(bookmark)
+
+    # 按文件夹路径合并各来源的书签树，并按规范URL去掉重复的书签（Chrome中的书签优先保留）
+    merged_bookmarks, removed, folders_merged = merge_trees([bookmarks for _, bookmarks in trees])
+    print(f"按规范URL去重: 移除 {removed} 个重复书签")
+    print(f"按文件夹路径合并: 合并 {folders_merged} 个同名文件夹")
+    instrumentation.count('step3.duplicates_removed', removed)
+    instrumentation.count('step3.folders_merged', folders_merged)
     return merged_bookmarks
 
 # 递归添加来源标记
@@ -74,8 +261,8 @@ def normalize_bookmark_path(bookmark):
         for child in bookmark['children']:
             normalize_bookmark_path(child)
 
-# 保存合并后的书签
-def save_merged_bookmarks(bookmarks):
+# 保存合并后的书签：默认保存为二进制快照（.bksnap），save_json为True时另外保存JSON文件
+def save_merged_bookmarks(bookmarks, save_json=False):
     # 创建输出目录
     output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'step3merged')
     
@@ -93,49 +280,50 @@ def save_merged_bookmarks(bookmarks):
     
     # 创建时间戳文件名
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    json_file = os.path.join(output_dir, f"merged_bookmarks_{timestamp}.json")
+    snapshot_file = os.path.join(output_dir, f"merged_bookmarks_{timestamp}{binary_snapshot.SUFFIX}")
+    binary_snapshot.write_snapshot(bookmarks, snapshot_file)
+    print(f"合并书签已保存到: {snapshot_file}")
     
-    # 保存为JSON格式
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(bookmarks, f, ensure_ascii=False, indent=2)
+    # 需要时另外保存为JSON格式（也可以之后用binary_snapshot.py export导出）
+    if save_json:
+        json_file = os.path.join(output_dir, f"merged_bookmarks_{timestamp}.json")
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump(bookmarks, f, ensure_ascii=False, indent=2)
+        print(f"合并书签已保存到: {json_file}")
     
-    print(f"合并书签已保存到: {json_file}")
-    return json_file
+    # 目录中只保留最新的文件，历史版本保存在快照存储中
+    snapshot_store.record('step3_merged', bookmarks)
+    return snapshot_file
 
 # 打印合并后的书签统计信息
 def print_merged_stats(bookmarks):
-    chrome_count = 0
-    safari_count = 0
-    chrome_folders = 0
-    safari_folders = 0
+    # 来源 -> [书签数, 文件夹数]，Chrome和Safari总是列出，其他来源（如Firefox）有书签时列出
+    counts = {'Chrome': [0, 0], 'Safari': [0, 0]}
+    shared_count = 0
     
     def count_bookmarks(items):
-        nonlocal chrome_count, safari_count, chrome_folders, safari_folders
+        nonlocal shared_count
         
         for item in items:
+            source_counts = counts.setdefault(item['source'], [0, 0])
             if item['type'] == 'folder':
-                if item['source'] == 'Chrome':
-                    chrome_folders += 1
-                else:
-                    safari_folders += 1
-                    
+                source_counts[1] += 1
                 if 'children' in item:
                     count_bookmarks(item['children'])
             else:  # url
-                if item['source'] == 'Chrome':
-                    chrome_count += 1
-                else:
-                    safari_count += 1
+                source_counts[0] += 1
+                if len(item.get('sources', [])) > 1:
+                    shared_count += 1
     
     count_bookmarks(bookmarks)
     
     print("\n合并书签统计:")
     print("-" * 50)
-    print(f"Chrome书签: {chrome_count} 个")
-    print(f"Chrome文件夹: {chrome_folders} 个")
-    print(f"Safari书签: {safari_count} 个")
-    print(f"Safari文件夹: {safari_folders} 个")
-    print(f"总计: {chrome_count + safari_count} 个书签, {chrome_folders + safari_folders} 个文件夹")
+    for source, (url_count, folder_count) in counts.items():
+        print(f"{source}书签: {url_count} 个")
+        print(f"{source}文件夹: {folder_count} 个")
+    print(f"多个来源共有的书签: {shared_count} 个")
+    print(f"总计: {sum(c[0] for c in counts.values())} 个书签, {sum(c[1] for c in counts.values())} 个文件夹")
     print("-" * 50)
 
 # 主函数
@@ -183,8 +371,8 @@ def main():
     chrome_bookmarks_dir = os.path.join(script_dir, 'step1chromebookmarks')
     safari_bookmarks_dir = os.path.join(script_dir, 'step2safaribookmarks')
     
-    chrome_json_file = get_latest_json_file(chrome_bookmarks_dir)
-    safari_json_file = get_latest_json_file(safari_bookmarks_dir)
+    chrome_json_file = get_latest_bookmarks_file(chrome_bookmarks_dir)
+    safari_json_file = get_latest_bookmarks_file(safari_bookmarks_dir)
     
     if not chrome_json_file:
         print(f"错误: 未找到Chrome书签JSON文件")
@@ -199,13 +387,9 @@ def main():
     
     print("\n步骤5: 读取并合并书签...")
     try:
-        # 读取Chrome书签
-        with open(chrome_json_file, 'r', encoding='utf-8') as f:
-            chrome_bookmarks = json.load(f)
-        
-        # 读取Safari书签
-        with open(safari_json_file, 'r', encoding='utf-8') as f:
-            safari_bookmarks = json.load(f)
+        # 读取Chrome书签和Safari书签（二进制快照通过mmap读取）
+        chrome_bookmarks = binary_snapshot.load_bookmarks(chrome_json_file)
+        safari_bookmarks = binary_snapshot.load_bookmarks(safari_json_file)
         
         # 合并书签
         merged_bookmarks = merge_bookmarks(chrome_bookmarks, safari_bookmarks)
@@ -215,6 +399,11 @@ def main():
         
         # 保存合并后的书签
         save_merged_bookmarks(merged_bookmarks)
+
+        # 更新书签搜索索引（bookmark_index导入了本模块，因此在这里导入）
+        import bookmark_index
+        added, removed, updated = bookmark_index.update_index(merged_bookmarks)
+        print(f"书签索引已更新: 新增 {added}，删除 {removed}，修改 {updated}")
         
         print("\n书签合并完成!")
         
@@ -5,13 +5,21 @@ import sys
 import json
 import shutil
 import time
+import uuid
+import hashlib
+import tempfile
 from datetime import datetime
 
 # 导入merge_bookmarks.py和chrome_bookmarks_viewer_fixed.py中的函数
 import step3_merge_bookmarks
+import instrumentation
+import snapshot_store
+import binary_snapshot
+import chromium_browsers
+from step3_merge_bookmarks import ROOT_FOLDER_ALIASES
 from step1_chrome_bookmarks_viewer_fixed import get_bookmarks_path as get_chrome_bookmarks_path
 
-# 获取最新的合并书签文件
+# 获取最新的合并书签文件（二进制快照或JSON）
 def get_latest_merged_bookmarks_file():
     script_dir = os.path.dirname(os.path.abspath(__file__))
     merged_dir = os.path.join(script_dir, 'step3merged')
@@ -20,179 +28,257 @@ def get_latest_merged_bookmarks_file():
         print(f"错误: 合并书签目录不存在: {merged_dir}")
         return None
     
-    json_files = [f for f in os.listdir(merged_dir) if f.endswith('.json')]
-    if not json_files:
+    latest_file = step3_merge_bookmarks.get_latest_bookmarks_file(merged_dir)
+    if not latest_file:
         print(f"错误: 未找到合并书签文件")
         return None
-    
-    # 按文件修改时间排序，获取最新的
-    latest_file = max(json_files, key=lambda f: os.path.getmtime(os.path.join(merged_dir, f)))
-    return os.path.join(merged_dir, latest_file)
+    return latest_file
+
+# Chrome书签根目录：(键, 写入的名称, 固定的GUID)，GUID与Chrome内置的根节点一致
+# 写入其他Chromium系浏览器时根目录的名称由localize_chrome_format替换
+CHROME_ROOTS = [
+    ('bookmark_bar', '书签栏', '0bc5d13f-2cba-5d74-951f-3f233fe6c908'),
+    ('other', '其他书签', '82b081ec-3dd3-529c-8475-ab6c344590dd'),
+    ('synced', '移动设备书签', '4cf2e351-0e85-532b-bb37-df045d8f8d0f'),
+]
+
+# 为新节点生成GUID时使用的命名空间，相同的节点每次得到相同的GUID
+GUID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'https://github.com/qq939/bookmarks_sync')
+
+# Chrome的时间戳从1601-01-01开始，单位为微秒
+CHROME_EPOCH_OFFSET = 11644473600
+
+# 当前时间的Chrome时间戳
+def chrome_timestamp():
+    return str(int((time.time() + CHROME_EPOCH_OFFSET) * 1000000))
+
+# 计算Chrome书签文件的checksum（与Chrome的BookmarkCodec相同）：
+# 按bookmark_bar、other、synced的顺序先序遍历，依次对id、UTF-16LE编码的名称、类型以及URL做MD5
+def compute_chrome_checksum(roots):
+    digest = hashlib.md5()
+    for root_key, _, _ in CHROME_ROOTS:
+        root = roots.get(root_key)
+        if not root:
+            continue
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            digest.update(node['id'].encode('utf-8'))
+            digest.update(node['name'].encode('utf-16-le', 'surrogatepass'))
+            if node['type'] == 'url':
+                digest.update(b'url')
+                digest.update(node['url'].encode('utf-8'))
+            else:
+                digest.update(b'folder')
+                stack.extend(reversed(node.get('children', [])))
+    return digest.hexdigest()
+
+# 为节点分配id并计算checksum：根目录依次为1、2、3，节点已有的id（读取Chrome时保留下来的）原样沿用，
+# 没有id或id与先出现的节点重复的节点按先序从现有最大id加1开始分配，新增书签不会改变其他节点的id
+def assign_ids_and_checksum(chrome_format):
+    roots = chrome_format['roots']
+    used_ids = set()
+    for index, (root_key, _, _) in enumerate(CHROME_ROOTS, 1):
+        roots[root_key]['id'] = str(index)
+        used_ids.add(index)
+
+    unassigned = []
+    for root_key, _, _ in CHROME_ROOTS:
+        stack = list(reversed(roots[root_key]['children']))
+        while stack:
+            node = stack.pop()
+            node_id = node.get('id')
+            node_id = int(node_id) if isinstance(node_id, str) and node_id.isdigit() else 0
+            if node_id > 0 and node_id not in used_ids:
+                used_ids.add(node_id)
+            else:
+                unassigned.append(node)
+            if node['type'] == 'folder':
+                stack.extend(reversed(node['children']))
+
+    next_id = max(used_ids) + 1
+    for node in unassigned:
+        node['id'] = str(next_id)
+        next_id += 1
+    chrome_format['checksum'] = compute_chrome_checksum(roots)
+    return chrome_format
+
+# 把Chrome书签结构中根目录的名称改为browser使用的名称，并重新计算checksum（checksum包含根目录的名称）
+# 只复制根目录节点，子项与chrome_format共用；名称相同时直接返回chrome_format
+def localize_chrome_format(chrome_format, browser='chrome'):
+    root_names = chromium_browsers.BROWSERS[browser]['root_names']
+    roots = chrome_format['roots']
+    if all(roots[root_key]['name'] == root_names[root_key] for root_key, _, _ in CHROME_ROOTS):
+        return chrome_format
+    localized = dict(chrome_format)
+    localized['roots'] = dict(roots)
+    for root_key, _, _ in CHROME_ROOTS:
+        localized['roots'][root_key] = dict(roots[root_key], name=root_names[root_key])
+    localized['checksum'] = compute_chrome_checksum(localized['roots'])
+    return localized
+
+# 将合并后的书签转换为Chrome书签格式，browser为其他Chromium系浏览器时根目录使用该浏览器的名称
+# 已有的id、guid、date_added、date_modified原样保留；新节点的GUID由父节点GUID、名称和URL确定，
+# 时间使用本次转换的统一时间戳，id由assign_ids_and_checksum分配，都回写到merged_bookmarks中，使保存的同步基线记住这些值
+@instrumentation.timed('step4.convert_to_chrome_format')
+def convert_to_chrome_format(merged_bookmarks, browser='chrome'):
+    now = chrome_timestamp()
+    used_guids = set()
 
-# 将合并后的书签转换为Chrome书签格式
-def convert_to_chrome_format(merged_bookmarks):
     # Chrome书签的基本结构
-    chrome_format = {
-        "checksum": "",
-        "version": 1,
-        "roots": {
-            "bookmark_bar": {
-                "children": [],
-                "date_added": str(int(time.time() * 1000000)),
-                "date_modified": str(int(time.time() * 1000000)),
-                "id": "1",
-                "name": "书签栏",
-                "type": "folder"
-            },
-            "other": {
-                "children": [],
-                "date_added": str(int(time.time() * 1000000)),
-                "date_modified": str(int(time.time() * 1000000)),
-                "id": "2",
-                "name": "其他书签",
-                "type": "folder"
-            },
-            "synced": {
+    chrome_format = {"checksum": "", "roots": {}, "version": 1}
+    for root_key, root_name, root_guid in CHROME_ROOTS:
+        chrome_format["roots"][root_key] = {
+            "children": [],
+            "date_added": now,
+            "date_modified": now,
+            "guid": root_guid,
+            "id": "",
+            "name": root_name,
+            "type": "folder"
+        }
+        used_guids.add(root_guid)
+
+    # 节点的GUID：沿用已有的值，重复或缺失时按父节点GUID、类型、名称、URL生成
+    def get_guid(bookmark, parent_guid):
+        guid = bookmark.get('guid')
+        if not guid or guid in used_guids:
+            seed = f"{parent_guid}\x00{bookmark['type']}\x00{bookmark.get('name', '')}\x00{bookmark.get('url', '')}"
+            guid = str(uuid.uuid5(GUID_NAMESPACE, seed))
+            suffix = 2
+            while guid in used_guids:
+                guid = str(uuid.uuid5(GUID_NAMESPACE, f"{seed}\x00{suffix}"))
+                suffix += 1
+            bookmark['guid'] = guid
+        used_guids.add(guid)
+        return guid
+
+    # (Chrome节点, 合并结果中的书签)，分配id后把新的id回写到合并结果中
+    converted_nodes = []
+
+    # 转换单个书签或文件夹（包括其子项），追加到target_folder
+    def convert_bookmark(bookmark, target_folder, parent_guid):
+        guid = get_guid(bookmark, parent_guid)
+        date_added = bookmark.setdefault('date_added', now)
+        if bookmark['type'] == 'url':
+            node = {
+                "date_added": date_added,
+                "guid": guid,
+                "id": bookmark.get('id', ''),
+                "name": bookmark['name'],
+                "type": "url",
+                "url": bookmark['url']
+            }
+            target_folder.append(node)
+            converted_nodes.append((node, bookmark))
+        elif bookmark['type'] == 'folder':
+            folder = {
                 "children": [],
-                "date_added": str(int(time.time() * 1000000)),
-                "date_modified": str(int(time.time() * 1000000)),
-                "id": "3",
-                "name": "移动设备书签",
+                "date_added": date_added,
+                "date_modified": bookmark.setdefault('date_modified', now),
+                "guid": guid,
+                "id": bookmark.get('id', ''),
+                "name": bookmark['name'],
                 "type": "folder"
             }
-        }
-    }
-    
-    # 递归处理书签和文件夹
-    def process_bookmarks(bookmarks, parent_array):
-        for bookmark in bookmarks:
-            current_time = int(time.time() * 1000000)
-            bookmark_id = str(current_time + len(parent_array))
-            
-            if bookmark['type'] == 'url':
-                # 处理URL类型的书签
-                chrome_bookmark = {
-                    "date_added": str(current_time),
-                    "id": bookmark_id,
-                    "name": bookmark['name'],
-                    "type": "url",
-                    "url": bookmark['url']
-                }
-                parent_array.append(chrome_bookmark)
-            elif bookmark['type'] == 'folder':
-                # 处理文件夹类型的书签
-                folder = {
-                    "children": [],
-                    "date_added": str(current_time),
-                    "date_modified": str(current_time),
-                    "id": bookmark_id,
-                    "name": bookmark['name'],
-                    "type": "folder"
-                }
-                parent_array.append(folder)
-                
-                # 递归处理子书签
-                if 'children' in bookmark and bookmark['children']:
-                    process_bookmarks(bookmark['children'], folder["children"])
-    
-    # 根据原始path来源正确归属书签到对应的Chrome文件夹
-    def get_target_folder(bookmark):
-        source = bookmark.get('source', '')
+            target_folder.append(folder)
+            converted_nodes.append((folder, bookmark))
+
+            # 递归处理子书签，子书签放在当前文件夹内
+            if 'children' in bookmark and bookmark['children']:
+                distribute_bookmarks(bookmark['children'], folder, guid)
+
+    # 根据来源和原始路径确定顶级书签所属的Chrome根目录
+    def get_root_key(bookmark):
+        if bookmark.get('source', '') != 'Chrome':
+            # Safari书签和未知来源的书签放入其他书签
+            return 'other'
         original_path = bookmark.get('original_path', bookmark.get('path', ''))
-        
-        if source == 'Chrome':
-            # Chrome书签根据原始路径归属
-            if original_path == 'Bookmarks Bar':
-                return chrome_format["roots"]["bookmark_bar"]["children"]
-            elif original_path == 'Other Bookmarks':
-                return chrome_format["roots"]["other"]["children"]
-            elif original_path == 'Mobile Bookmarks':
-                return chrome_format["roots"]["synced"]["children"]
-            else:
-                # 默认放入书签栏
-                return chrome_format["roots"]["bookmark_bar"]["children"]
-        elif source == 'Safari':
-            # Safari书签根据原始路径归属
-            if original_path == '根目录':
-                # Safari的根目录书签放入其他书签
-                return chrome_format["roots"]["other"]["children"]
-            else:
-                # 其他Safari书签也放入其他书签
-                return chrome_format["roots"]["other"]["children"]
-        else:
-            # 未知来源，默认放入其他书签
-            return chrome_format["roots"]["other"]["children"]
-    
-    # 递归处理书签，根据original_path分组到正确的Chrome文件夹
-    def distribute_bookmarks(bookmarks, target_roots):
+        root_segment = original_path.split('/')[0]
+        if root_segment in chrome_format["roots"]:
+            return root_segment
+        return ROOT_FOLDER_ALIASES.get(root_segment, 'bookmark_bar')
+
+    # 递归处理书签，parent为None时表示顶级，根据original_path分组到正确的Chrome根目录
+    def distribute_bookmarks(bookmarks, parent=None, parent_guid=''):
         for bookmark in bookmarks:
-            source = bookmark.get('source', '')
-            original_path = bookmark.get('original_path', bookmark.get('path', ''))
-            
-            # 跳过顶级文件夹名称与Chrome文件夹名称相同的情况，避免嵌套
-            if bookmark['type'] == 'folder' and bookmark['name'] in ['Bookmarks Bar', 'Other Bookmarks', 'Mobile Bookmarks']:
-                # 直接处理其子书签，不创建同名文件夹
-                if 'children' in bookmark and bookmark['children']:
-                    distribute_bookmarks(bookmark['children'], target_roots)
-                continue
-            
-            # 确定目标文件夹
-            if source == 'Chrome':
-                if original_path == 'Bookmarks Bar':
-                    target_folder = target_roots['bookmark_bar']['children']
-                elif original_path == 'Other Bookmarks':
-                    target_folder = target_roots['other']['children']
-                elif original_path == 'Mobile Bookmarks':
-                    target_folder = target_roots['synced']['children']
+            # 跳过名称与Chrome根目录相同的文件夹，避免嵌套
+            root_key = ROOT_FOLDER_ALIASES.get(bookmark['name']) if bookmark['type'] == 'folder' else None
+            if root_key:
+                if parent is None:
+                    # 顶级的根目录文件夹：沿用其时间，子书签直接放入对应的Chrome根目录
+                    root = chrome_format["roots"][root_key]
+                    root["date_added"] = bookmark.get('date_added', root["date_added"])
+                    root["date_modified"] = bookmark.get('date_modified', root["date_modified"])
+                    distribute_bookmarks(bookmark.get('children') or [], root, root["guid"])
                 else:
-                    target_folder = target_roots['bookmark_bar']['children']
-            elif source == 'Safari':
-                # Safari书签放入其他书签
-                target_folder = target_roots['other']['children']
+                    distribute_bookmarks(bookmark.get('children') or [], parent, parent_guid)
+                continue
+
+            if parent is None:
+                root = chrome_format["roots"][get_root_key(bookmark)]
+                convert_bookmark(bookmark, root["children"], root["guid"])
             else:
-                target_folder = target_roots['other']['children']
-            
-            # 处理当前书签
-            current_time = int(time.time() * 1000000)
-            bookmark_id = str(current_time + len(target_folder))
-            
-            if bookmark['type'] == 'url':
-                chrome_bookmark = {
-                    "date_added": str(current_time),
-                    "id": bookmark_id,
-                    "name": bookmark['name'],
-                    "type": "url",
-                    "url": bookmark['url']
-                }
-                target_folder.append(chrome_bookmark)
-            elif bookmark['type'] == 'folder':
-                folder = {
-                    "children": [],
-                    "date_added": str(current_time),
-                    "date_modified": str(current_time),
-                    "id": bookmark_id,
-                    "name": bookmark['name'],
-                    "type": "folder"
-                }
-                target_folder.append(folder)
-                
-                # 递归处理子书签，子书签放在当前文件夹内
-                if 'children' in bookmark and bookmark['children']:
-                    # 为子书签创建临时的target_roots，指向当前文件夹
-                    child_target_roots = {
-                        'bookmark_bar': {'children': folder['children']},
-                        'other': {'children': folder['children']},
-                        'synced': {'children': folder['children']}
-                    }
-                    distribute_bookmarks(bookmark['children'], child_target_roots)
-    
+                convert_bookmark(bookmark, parent["children"], parent_guid)
+
     # 处理合并后的书签
-    distribute_bookmarks(merged_bookmarks, chrome_format["roots"])
-    
-    return chrome_format
+    distribute_bookmarks(merged_bookmarks)
+
+    assign_ids_and_checksum(chrome_format)
+    for node, bookmark in converted_nodes:
+        if bookmark.get('id') != node['id']:
+            bookmark['id'] = node['id']
+    return localize_chrome_format(chrome_format, browser)
+
+# 序列化Chrome书签结构，只执行一次，写入Chrome和step4sync目录时共用同一份字节
+# 使用紧凑格式（不缩进），Chrome读取时不受影响
+@instrumentation.timed('step4.serialize_chrome_format')
+def serialize_chrome_format(chrome_format):
+    return json.dumps(chrome_format, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+# 原子地写入文件：先写同目录下的临时文件并fsync，再重命名覆盖目标文件，最后fsync目录
+# 任何时候中断，目标文件要么是旧内容，要么是完整的新内容
+def atomic_write_bytes(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # 沿用原文件的权限
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        os.replace(tmp_path, path)
+        instrumentation.count('bytes_written', len(data))
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    # 确保重命名本身也已落盘（部分平台不支持对目录fsync）
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+# 重新读取写入的Chrome书签文件，检查其checksum与内容一致
+def verify_chrome_bookmarks_file(path, expected_checksum):
+    with open(path, 'rb') as f:
+        data = json.loads(f.read())
+    checksum = data.get('checksum')
+    return checksum == expected_checksum and compute_chrome_checksum(data.get('roots', {})) == checksum
 
-# 保存书签到step4sync目录
-def save_to_step4sync(chrome_format):
+# 保存书签到step4sync目录；data为已经序列化好的字节时直接写入，不再重复序列化
+def save_to_step4sync(chrome_format, data=None):
     script_dir = os.path.dirname(os.path.abspath(__file__))
     step4sync_dir = os.path.join(script_dir, 'step4sync')
     
@@ -214,50 +300,94 @@ def save_to_step4sync(chrome_format):
     
     # 保存为JSON格式
     try:
-        with open(json_file, 'w', encoding='utf-8') as f:
-            json.dump(chrome_format, f, ensure_ascii=False, indent=2)
+        if data is None:
+            data = serialize_chrome_format(chrome_format)
+        with open(json_file, 'wb') as f:
+            f.write(data)
         print(f"已成功将Chrome格式书签保存到: {json_file}")
+        snapshot_store.record('step4_chrome', chrome_format, 'chrome')
         return True
     except Exception as e:
         print(f"保存到step4sync目录时出错: {e}")
         return False
 
+# 备份书签文件：优先使用硬链接，新文件通过重命名写入后，旧内容留在备份中，不需要复制整个文件
+def backup_bookmarks_file(bookmarks_path, backup_path):
+    try:
+        os.link(bookmarks_path, backup_path)
+    except OSError:
+        # 文件系统不支持硬链接时退回到复制
+        shutil.copy2(bookmarks_path, backup_path)
+
+# 写入并校验成功后删除临时备份（原内容已经保存在快照存储中）
+def remove_backup(backup_path):
+    if backup_path:
+        try:
+            os.remove(backup_path)
+        except OSError:
+            pass
+
 # 保存书签到Chrome书签文件
-def save_to_chrome_bookmarks(chrome_format):
-    chrome_bookmarks_path = get_chrome_bookmarks_path()
+# chrome_bookmarks_path为空时使用默认Chrome书签路径；save_copy控制是否同时写入step4sync目录
+# browser为写入的Chromium系浏览器，决定默认路径和快照条目的名称（如edge_before_write）
+# 书签结构只序列化一次，原子地替换Chrome书签文件，并在重新读取、校验checksum之后才报告成功
+@instrumentation.timed('step4.save_to_chrome_bookmarks')
+def save_to_chrome_bookmarks(chrome_format, chrome_bookmarks_path=None, save_copy=True, browser='chrome'):
+    name = chromium_browsers.browser_name(browser)
+    if not chrome_bookmarks_path:
+        chrome_bookmarks_path = get_chrome_bookmarks_path(browser=browser)
     
     if not chrome_bookmarks_path:
-        print("错误: 无法获取Chrome书签文件路径")
+        print(f"错误: 无法获取{name}书签文件路径")
         return False
     
-    # 备份原始书签文件
-    backup_path = chrome_bookmarks_path + ".backup." + datetime.now().strftime("%Y%m%d_%H%M%S")
+    # 原始书签文件保存到快照存储中供回滚；另外用硬链接临时备份，校验失败时恢复，成功后删除
+    backup_path = None
+    if os.path.exists(chrome_bookmarks_path):
+        backup_path = chrome_bookmarks_path + ".backup." + datetime.now().strftime("%Y%m%d_%H%M%S")
+        try:
+            snapshot_store.record_file(f'{browser}_before_write', chrome_bookmarks_path, 'chrome')
+            backup_bookmarks_file(chrome_bookmarks_path, backup_path)
+        except Exception as e:
+            print(f"备份{name}书签文件时出错: {e}")
+            return False
+    
+    # 保存新的书签文件
     try:
-        shutil.copy2(chrome_bookmarks_path, backup_path)
-        print(f"已备份原始Chrome书签文件到: {backup_path}")
+        if not chrome_format.get('checksum'):
+            chrome_format['checksum'] = compute_chrome_checksum(chrome_format['roots'])
+        data = serialize_chrome_format(chrome_format)
+        atomic_write_bytes(chrome_bookmarks_path, data)
     except Exception as e:
-        print(f"备份Chrome书签文件时出错: {e}")
+        # 写入临时文件或重命名失败时，原文件保持不变
+        print(f"保存到{name}书签文件时出错: {e}")
+        remove_backup(backup_path)
         return False
     
-    # 保存新的书签文件
+    # 重新读取并校验checksum，失败时恢复备份
     try:
-        with open(chrome_bookmarks_path, 'w', encoding='utf-8') as f:
-            json.dump(chrome_format, f, ensure_ascii=False, indent=2)
-        print(f"已成功将合并书签保存到Chrome书签文件: {chrome_bookmarks_path}")
-        
-        # 同时保存到step4sync目录
-        save_to_step4sync(chrome_format)
-        
-        return True
+        verified = verify_chrome_bookmarks_file(chrome_bookmarks_path, chrome_format['checksum'])
     except Exception as e:
-        print(f"保存到Chrome书签文件时出错: {e}")
-        # 如果保存失败，恢复备份
-        try:
-            shutil.copy2(backup_path, chrome_bookmarks_path)
-            print("已恢复原始Chrome书签文件")
-        except Exception as restore_error:
-            print(f"恢复备份时出错: {restore_error}")
+        print(f"校验{name}书签文件时出错: {e}")
+        verified = False
+    if not verified:
+        print(f"错误: 写入的{name}书签文件校验失败")
+        if backup_path:
+            try:
+                os.replace(backup_path, chrome_bookmarks_path)
+                print(f"已恢复原始{name}书签文件")
+            except Exception as restore_error:
+                print(f"恢复备份时出错: {restore_error}")
         return False
+    
+    remove_backup(backup_path)
+    print(f"已成功将合并书签保存到{name}书签文件: {chrome_bookmarks_path}")
+    
+    # 同时保存到step4sync目录，直接使用已经序列化好的内容
+    if save_copy:
+        save_to_step4sync(chrome_format, data)
+    
+    return True
 
 # 主函数
 def main():
@@ -278,8 +408,7 @@ def main():
     
     print("\n步骤3: 读取合并书签文件...")
     try:
-        with open(merged_file, 'r', encoding='utf-8') as f:
-            merged_bookmarks = json.load(f)
+        merged_bookmarks = binary_snapshot.load_bookmarks(merged_file)
     except Exception as e:
         print(f"读取合并书签文件时出错: {e}")
         return
@@ -5,12 +5,20 @@ import sys
 import json
 import shutil
 import time
+import uuid
+import html
+import plistlib
 from datetime import datetime
 
 # 导入merge_bookmarks.py中的函数
 import step3_merge_bookmarks
+import instrumentation
+import snapshot_store
+import binary_snapshot
+from step2_safari_bookmarks_viewer import get_bookmarks_path as get_safari_bookmarks_path
+from step4_sync_to_chrome import CHROME_EPOCH_OFFSET, GUID_NAMESPACE, atomic_write_bytes, backup_bookmarks_file, remove_backup
 
-# 获取最新的合并书签文件
+# 获取最新的合并书签文件（二进制快照或JSON）
 def get_latest_merged_file():
     script_dir = os.path.dirname(os.path.abspath(__file__))
     step3merged_dir = os.path.join(script_dir, 'step3merged')
@@ -19,21 +27,21 @@ def get_latest_merged_file():
         print(f"错误: 目录不存在: {step3merged_dir}")
         return None
     
-    # 获取目录中的所有JSON文件
-    json_files = [f for f in os.listdir(step3merged_dir) if f.endswith('.json')]
-    
-    if not json_files:
-        print(f"错误: 在 {step3merged_dir} 中没有找到JSON文件")
+    latest_file = step3_merge_bookmarks.get_latest_bookmarks_file(step3merged_dir)
+    if not latest_file:
+        print(f"错误: 在 {step3merged_dir} 中没有找到合并书签文件")
         return None
     
-    # 按文件名排序（假设文件名包含日期时间信息）
-    json_files.sort(reverse=True)
-    latest_file = os.path.join(step3merged_dir, json_files[0])
-    
     print(f"找到最新的合并书签文件: {latest_file}")
     return latest_file
 
+# 保留书签的添加时间，用于HTML中的ADD_DATE
+def copy_add_date(item, target):
+    if item.get('date_added'):
+        target['date_added'] = item['date_added']
+
 # 将合并后的书签转换为Safari书签格式
+@instrumentation.timed('step5.convert_to_safari_format')
 def convert_to_safari_format(merged_bookmarks):
     # 创建一个简化的Safari格式书签结构
     safari_format = []
@@ -48,6 +56,7 @@ def convert_to_safari_format(merged_bookmarks):
                     "name": item.get("name", ""),
                     "children": []
                 }
+                copy_add_date(item, new_folder)
                 parent.append(new_folder)
                 
                 # 递归处理子项
@@ -55,12 +64,14 @@ def convert_to_safari_format(merged_bookmarks):
                     process_bookmarks(item["children"], new_folder["children"])
             elif item.get("type") == "url":
                 # 添加URL
-                parent.append({
+                bookmark = {
                     "type": "url",
                     "name": item.get("name", ""),
                     "url": item.get("url", ""),
                     "source": item.get("source", "")
-                })
+                }
+                copy_add_date(item, bookmark)
+                parent.append(bookmark)
     
     # 处理根书签
     process_bookmarks(merged_bookmarks, safari_format)
@@ -69,10 +80,8 @@ def convert_to_safari_format(merged_bookmarks):
 
 
 
-# 将书签转换为HTML格式
-def convert_to_html_format(bookmarks):
-    # HTML头部
-    html = """<!DOCTYPE NETSCAPE-Bookmark-file-1>
+# Netscape书签HTML文件的头部和尾部
+HTML_HEADER = """<!DOCTYPE NETSCAPE-Bookmark-file-1>
 <!-- This is an automatically generated file.
      It will be read and overwritten.
      DO NOT EDIT! -->
@@ -81,34 +90,373 @@ def convert_to_html_format(bookmarks):
 <H1>Bookmarks</H1>
 <DL><p>
 """
-    
-    # 递归处理书签
-    def process_bookmarks(items, indent="    "):
-        result = ""
+HTML_FOOTER = "</DL><p>"
+
+# 把书签的添加时间转换为HTML中使用的Unix时间戳（秒）
+# Chrome的date_added是从1601年开始的微秒数；未知时返回None
+def html_add_date(item):
+    date_added = item.get('date_added')
+    if date_added:
+        try:
+            seconds = int(date_added) // 1000000 - CHROME_EPOCH_OFFSET
+        except (TypeError, ValueError):
+            return None
+        if seconds > 0:
+            return str(seconds)
+    return None
+
+# 逐块生成Netscape书签HTML，标题和URL都经过HTML转义
+# 使用显式栈遍历，内存只与文件夹深度有关；当前时间只取一次，用于没有添加时间的书签
+def iter_html_chunks(bookmarks, now=None):
+    now = str(int(now if now is not None else time.time()))
+    escape = html.escape
+    yield HTML_HEADER
+
+    indent = "    "
+    stack = [iter(bookmarks)]
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop()
+            if stack:
+                indent = indent[:-4]
+                yield f"{indent}</DL><p>\n"
+            continue
+
+        if item.get("type") == "folder":
+            add_date = html_add_date(item)
+            add_date_attr = f' ADD_DATE="{add_date}"' if add_date else ''
+            yield f"{indent}<DT><H3{add_date_attr}>{escape(item.get('name', ''), quote=False)}</H3>\n{indent}<DL><p>\n"
+            children = item.get("children")
+            stack.append(iter(children if isinstance(children, list) else ()))
+            indent += "    "
+        elif item.get("type") == "url":
+            url = escape(item.get("url", ""))
+            source = escape(item.get("source", ""))
+            add_date = html_add_date(item) or now
+            yield f"{indent}<DT><A HREF=\"{url}\" ADD_DATE=\"{add_date}\" SOURCE=\"{source}\">{escape(item.get('name', ''), quote=False)}</A>\n"
+
+    yield HTML_FOOTER
+
+# 将书签转换为HTML格式（返回整个字符串，大文件请使用write_html_file）
+def convert_to_html_format(bookmarks):
+    return ''.join(iter_html_chunks(bookmarks))
+
+# 把书签以HTML格式直接写入文件，不在内存中拼接整个文档
+@instrumentation.timed('step5.write_html_file')
+def write_html_file(bookmarks, html_file):
+    with open(html_file, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+        f.writelines(iter_html_chunks(bookmarks))
+    instrumentation.count('bytes_written', os.path.getsize(html_file))
+
+# Safari书签文件中的特殊文件夹
+SAFARI_BAR = 'BookmarksBar'
+SAFARI_MENU = 'BookmarksMenu'
+SAFARI_READING_LIST = 'com.apple.ReadingList'
+
+# 新建Safari书签文件时的基本结构
+def new_safari_plist():
+    return {
+        'Children': [
+            new_safari_folder(SAFARI_BAR, str(uuid.uuid5(GUID_NAMESPACE, SAFARI_BAR)).upper()),
+            new_safari_folder(SAFARI_MENU, str(uuid.uuid5(GUID_NAMESPACE, SAFARI_MENU)).upper()),
+            dict(new_safari_folder(SAFARI_READING_LIST, str(uuid.uuid5(GUID_NAMESPACE, SAFARI_READING_LIST)).upper()),
+                 ShouldOmitFromUI=True),
+        ],
+        'Title': '',
+        'WebBookmarkFileVersion': 1,
+        'WebBookmarkType': 'WebBookmarkTypeList',
+        'WebBookmarkUUID': 'Root',
+    }
+
+def new_safari_folder(title, bookmark_uuid):
+    return {
+        'Children': [],
+        'Title': title,
+        'WebBookmarkType': 'WebBookmarkTypeList',
+        'WebBookmarkUUID': bookmark_uuid,
+    }
+
+def new_safari_leaf(title, url, bookmark_uuid):
+    return {
+        'URIDictionary': {'title': title},
+        'URLString': url,
+        'WebBookmarkType': 'WebBookmarkTypeLeaf',
+        'WebBookmarkUUID': bookmark_uuid,
+    }
+
+# 读取现有的Safari书签文件，不存在时返回新的基本结构
+def load_safari_plist(safari_bookmarks_path):
+    if safari_bookmarks_path and os.path.exists(safari_bookmarks_path):
+        with open(safari_bookmarks_path, 'rb') as f:
+            data = plistlib.load(f)
+        if isinstance(data.get('Children'), list):
+            return data
+    return new_safari_plist()
+
+# 把合并后的书签写入Safari书签文件的结构（直接修改并返回existing），使Safari的结构与合并结果一致：
+# Chrome书签栏中的书签和文件夹放入Safari书签栏，其余放在顶层（已经在书签菜单中的顶级项目留在书签菜单中）；
+# 已有的书签（按规范URL）和文件夹保持WebBookmarkUUID，移动到合并结果中所在的文件夹，按合并结果排序并更新标题。
+# 文件夹先在原位置按名称（忽略大小写和空白，与step3合并文件夹的规则相同）对应，
+# 找不到时对应包含其中最多书签的已有文件夹（在Chrome中改名或移动过的文件夹）；
+# 合并结果中已不存在的书签和文件夹被删除。阅读列表不参与同步，保持不变。
+# 新节点的WebBookmarkUUID由所在文件夹、名称和URL确定，同样的输入得到同样的文件
+# 返回(Safari书签结构, {'add': 新增数, 'remove': 删除数, 'rename': 改名数, 'move': 移动数, 'reorder': 重新排序的文件夹数})，
+# 全部为0时原来的结构已经与合并结果一致
+@instrumentation.timed('step5.convert_to_safari_plist')
+def convert_to_safari_plist(merged_bookmarks, existing=None):
+    data = existing if existing is not None else new_safari_plist()
+    canonicalize_url = step3_merge_bookmarks.canonicalize_url
+    normalize_folder_name = step3_merge_bookmarks.normalize_folder_name
+    counts = {'add': 0, 'remove': 0, 'rename': 0, 'move': 0, 'reorder': 0}
+
+    # 找到（或创建）顶层的特殊文件夹
+    def special_folder(title):
+        for child in data['Children']:
+            if child.get('Title') == title and child.get('WebBookmarkType') == 'WebBookmarkTypeList':
+                child.setdefault('Children', [])
+                return child
+        folder = new_safari_folder(title, str(uuid.uuid5(GUID_NAMESPACE, title)).upper())
+        data['Children'].insert(0 if title == SAFARI_BAR else len(data['Children']), folder)
+        return folder
+
+    bar = special_folder(SAFARI_BAR)
+    menu = next((child for child in data['Children'] if isinstance(child, dict) and child.get('Title') == SAFARI_MENU
+                 and isinstance(child.get('Children'), list)), None)
+
+    def is_leaf(node):
+        return isinstance(node, dict) and node.get('WebBookmarkType') == 'WebBookmarkTypeLeaf' and 'URLString' in node
+
+    # 参与同步的文件夹（顶层的书签栏、书签菜单和阅读列表除外）
+    def is_folder(node, parent):
+        return (isinstance(node, dict) and node.get('WebBookmarkType') == 'WebBookmarkTypeList'
+                and isinstance(node.get('Children'), list)
+                and not (parent is data and node.get('Title') in (SAFARI_BAR, SAFARI_MENU, SAFARI_READING_LIST)))
+
+    # 现有的书签和文件夹：书签按规范URL索引（重复的只保留第一个），同时记录每个节点原来所在的文件夹
+    used_uuids = set()
+    existing_leaves = {}
+    existing_nodes = {}
+    parents = {}
+    stack = [data] + ([menu] if menu is not None else []) + [bar]
+    while stack:
+        folder = stack.pop()
+        for child in folder['Children']:
+            if isinstance(child, dict) and child.get('WebBookmarkUUID'):
+                used_uuids.add(child['WebBookmarkUUID'])
+            if is_leaf(child):
+                existing_leaves.setdefault(canonicalize_url(child['URLString']), child)
+            elif is_folder(child, folder):
+                stack.append(child)
+            else:
+                continue
+            existing_nodes[id(child)] = child
+            parents[id(child)] = folder
+
+    # 新节点的WebBookmarkUUID
+    def new_uuid(parent_uuid, title, url=''):
+        seed = f"{parent_uuid}\x00{title}\x00{url}"
+        bookmark_uuid = str(uuid.uuid5(GUID_NAMESPACE, seed)).upper()
+        suffix = 2
+        while bookmark_uuid in used_uuids:
+            bookmark_uuid = str(uuid.uuid5(GUID_NAMESPACE, f"{seed}\x00{suffix}")).upper()
+            suffix += 1
+        used_uuids.add(bookmark_uuid)
+        return bookmark_uuid
+
+    # 合并结果对应的Safari结构：文件夹为{'name', 'children', 'folders'}，同一位置上名称相同的文件夹合为一个；
+    # 书签为{'key', 'name', 'url'}，同一URL只出现一次
+    def new_spec(name):
+        return {'name': name, 'children': [], 'folders': {}}
+
+    bar_spec, top_spec = new_spec(SAFARI_BAR), new_spec('')
+    wanted = set()
+
+    # 顶级书签所属的Safari位置：来自Chrome书签栏的放入书签栏，其余放在顶层
+    def top_level_spec(bookmark):
+        if bookmark.get('source', '') != 'Chrome':
+            return top_spec
+        original_path = bookmark.get('original_path', bookmark.get('path', ''))
+        root_segment = original_path.split('/')[0]
+        root_key = root_segment if root_segment in ('bookmark_bar', 'other', 'synced') else \
+            step3_merge_bookmarks.ROOT_FOLDER_ALIASES.get(root_segment, 'bookmark_bar')
+        return bar_spec if root_key == 'bookmark_bar' else top_spec
+
+    # 按合并结果的结构收集；spec为None时表示合并结果的顶级
+    def collect(items, spec=None):
         for item in items:
-            if item.get("type") == "folder":
-                # 处理文件夹
-                folder_name = item.get("name", "")
-                result += f"{indent}<DT><H3>{folder_name}</H3>\n{indent}<DL><p>\n"
-                if "children" in item and isinstance(item["children"], list):
-                    result += process_bookmarks(item["children"], indent + "    ")
-                result += f"{indent}</DL><p>\n"
-            elif item.get("type") == "url":
-                # 处理URL
-                url_name = item.get("name", "")
-                url = item.get("url", "")
-                source = item.get("source", "")
-                add_date = int(datetime.now().timestamp())
-                result += f"{indent}<DT><A HREF=\"{url}\" ADD_DATE=\"{add_date}\" SOURCE=\"{source}\">{url_name}</A>\n"
-        return result
-    
-    # 处理根书签
-    html += process_bookmarks(bookmarks)
-    
-    # HTML尾部
-    html += "</DL><p>"
-    
-    return html
+            if item.get('type') == 'folder':
+                root_key = step3_merge_bookmarks.ROOT_FOLDER_ALIASES.get(item.get('name', ''))
+                if root_key:
+                    # Chrome的根目录文件夹：书签栏对应Safari书签栏，其他根目录对应顶层；嵌套的根目录文件夹并入所在文件夹
+                    collect(item.get('children') or [], spec or (bar_spec if root_key == 'bookmark_bar' else top_spec))
+                    continue
+                parent = spec or top_level_spec(item)
+                name = item.get('name', '')
+                folder = parent['folders'].get(normalize_folder_name(name))
+                if folder is None:
+                    folder = parent['folders'][normalize_folder_name(name)] = new_spec(name)
+                    parent['children'].append(folder)
+                collect(item.get('children') or [], folder)
+            elif item.get('type') == 'url' and item.get('url'):
+                key = canonicalize_url(item['url'])
+                if key not in wanted:
+                    wanted.add(key)
+                    (spec or top_level_spec(item))['children'].append(
+                        {'key': key, 'name': item.get('name', ''), 'url': item['url']})
+
+    collect(merged_bookmarks)
+
+    # 已经放入新结构的已有节点
+    placed = set()
+
+    # 为合并结果中的子文件夹对应已有的Safari文件夹：先在原来的子文件夹（candidates）中按名称对应，
+    # 其余对应包含其中最多书签的已有文件夹；返回{id(文件夹): 已有的Safari文件夹}
+    def match_folders(spec, candidates):
+        by_name = {}
+        for node in candidates:
+            by_name.setdefault(normalize_folder_name(node.get('Title') or ''), node)
+        matches = {}
+        folder_specs = [child for child in spec['children'] if 'key' not in child]
+        for child in folder_specs:
+            node = by_name.get(normalize_folder_name(child['name']))
+            if node is not None and id(node) not in placed:
+                matches[id(child)] = node
+                placed.add(id(node))
+        # {(文件夹, 已有的Safari文件夹): 合并结果中这个文件夹有几个书签原来在这个Safari文件夹中}，多的先对应
+        votes = {}
+        for child in folder_specs:
+            if id(child) in matches:
+                continue
+            for grandchild in child['children']:
+                leaf = existing_leaves.get(grandchild.get('key'))
+                parent = parents[id(leaf)] if leaf is not None else None
+                if parent is not None and id(parent) in existing_nodes and id(parent) not in placed:
+                    votes[(id(child), id(parent))] = votes.get((id(child), id(parent)), 0) + 1
+        for (spec_id, node_id), _ in sorted(votes.items(), key=lambda vote: -vote[1]):
+            if spec_id not in matches and node_id not in placed:
+                matches[spec_id] = existing_nodes[node_id]
+                placed.add(node_id)
+        return matches
+
+    # 按合并结果生成一个Safari文件夹的子项（已有节点或新节点），子文件夹递归处理
+    def build(spec, folder, candidates):
+        matches = match_folders(spec, [node for node in candidates if is_folder(node, folder)])
+        children = []
+        for child in spec['children']:
+            if 'key' in child:
+                node = existing_leaves.get(child['key'])
+                if node is None:
+                    node = new_safari_leaf(child['name'], child['url'],
+                                           new_uuid(folder.get('WebBookmarkUUID', ''), child['name'], child['url']))
+                    counts['add'] += 1
+                else:
+                    uri_dictionary = node.setdefault('URIDictionary', {})
+                    if child['name'] and uri_dictionary.get('title') != child['name']:
+                        uri_dictionary['title'] = child['name']
+                        counts['rename'] += 1
+            else:
+                node = matches.get(id(child))
+                if node is None:
+                    node = new_safari_folder(child['name'], new_uuid(folder.get('WebBookmarkUUID', ''), child['name']))
+                    counts['add'] += 1
+                elif node.get('Title') != child['name']:
+                    node['Title'] = child['name']
+                    counts['rename'] += 1
+                place(node, build(child, node, node['Children']))
+            placed.add(id(node))
+            children.append(node)
+        return children
+
+    # 用新的子项替换Safari文件夹中参与同步的子项，其他子项（阅读列表等）保持原来的顺序
+    def place(folder, children):
+        old_children = folder['Children']
+        counts['move'] += sum(1 for node in children if id(node) in parents and parents[id(node)] is not folder)
+        kept = {id(node) for node in children}
+        if [id(node) for node in old_children if id(node) in kept] != \
+                [id(node) for node in children if parents.get(id(node)) is folder]:
+            counts['reorder'] += 1
+        others = [node for node in old_children if not (is_leaf(node) or is_folder(node, folder))]
+        if folder is data:
+            # 顶层的书签和文件夹放在阅读列表之前
+            index = next((i for i, node in enumerate(others)
+                          if isinstance(node, dict) and node.get('Title') == SAFARI_READING_LIST), len(others))
+            folder['Children'] = others[:index] + children + others[index:]
+        else:
+            folder['Children'] = others + children
+
+    place(bar, build(bar_spec, bar, bar['Children']))
+    top_level = build(top_spec, data, data['Children'] + (menu['Children'] if menu is not None else []))
+    if menu is not None:
+        place(menu, [node for node in top_level if parents.get(id(node)) is menu])
+    place(data, [node for node in top_level if menu is None or parents.get(id(node)) is not menu])
+
+    counts['remove'] = sum(1 for key in existing_nodes if key not in placed)
+    return data, counts
+
+# Safari书签变化的说明
+def describe_changes(counts):
+    return (f"Safari书签变化: 新增 {counts['add']}，删除 {counts['remove']}，改名 {counts['rename']}，"
+            f"移动 {counts['move']}，重新排序的文件夹 {counts['reorder']}")
+
+# 把合并后的书签直接写入Safari的Bookmarks.plist（二进制plist，先写临时文件再原子替换）
+# 写入前用硬链接备份原文件；写入后重新读取校验，失败时恢复备份
+@instrumentation.timed('step5.save_to_safari_bookmarks')
+def save_to_safari_bookmarks(merged_bookmarks, safari_bookmarks_path=None):
+    if not safari_bookmarks_path:
+        safari_bookmarks_path = get_safari_bookmarks_path()
+    if not safari_bookmarks_path:
+        print("错误: 无法获取Safari书签文件路径")
+        return False
+
+    try:
+        existing = load_safari_plist(safari_bookmarks_path)
+    except Exception as e:
+        print(f"读取Safari书签文件时出错: {e}")
+        return False
+
+    data, counts = convert_to_safari_plist(merged_bookmarks, existing)
+    print(describe_changes(counts))
+    return write_safari_plist(data, safari_bookmarks_path)
+
+# 把Safari书签结构写入Bookmarks.plist：原文件保存到快照存储中，另外用硬链接临时备份，
+# 原子替换后重新读取校验，失败时恢复备份，成功后删除临时备份
+def write_safari_plist(data, safari_bookmarks_path):
+    backup_path = None
+    if os.path.exists(safari_bookmarks_path):
+        backup_path = safari_bookmarks_path + ".backup." + datetime.now().strftime("%Y%m%d_%H%M%S")
+        try:
+            snapshot_store.record_file('safari_before_write', safari_bookmarks_path, 'safari')
+            backup_bookmarks_file(safari_bookmarks_path, backup_path)
+        except Exception as e:
+            print(f"备份Safari书签文件时出错: {e}")
+            return False
+
+    try:
+        with instrumentation.measure('step5.plistlib.dumps'):
+            content = plistlib.dumps(data, fmt=plistlib.FMT_BINARY, sort_keys=True)
+        atomic_write_bytes(safari_bookmarks_path, content)
+        # 重新读取，确认磁盘上的内容与生成的内容完全一致
+        with open(safari_bookmarks_path, 'rb') as f:
+            verified = f.read() == content
+    except Exception as e:
+        print(f"保存到Safari书签文件时出错: {e}")
+        remove_backup(backup_path)
+        return False
+
+    if not verified:
+        print("错误: 写入的Safari书签文件校验失败")
+        if backup_path:
+            try:
+                os.replace(backup_path, safari_bookmarks_path)
+                print("已恢复原始Safari书签文件")
+            except Exception as restore_error:
+                print(f"恢复备份时出错: {restore_error}")
+        return False
+
+    remove_backup(backup_path)
+    print(f"已成功将合并书签保存到Safari书签文件: {safari_bookmarks_path}")
+    return True
 
 # 保存书签到step5sync2safari目录
 def save_to_step5sync2safari(safari_format):
@@ -139,15 +487,14 @@ def save_to_step5sync2safari(safari_format):
         with open(json_file, 'w', encoding='utf-8') as f:
             json.dump(safari_format, f, ensure_ascii=False, indent=2)
         print(f"已成功将Safari格式书签保存到: {json_file}")
+        snapshot_store.record('step5_safari', safari_format)
     except Exception as e:
         print(f"保存JSON格式书签时出错: {e}")
         success = False
     
     # 转换为HTML格式并保存
     try:
-        html_content = convert_to_html_format(safari_format)
-        with open(html_file, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+        write_html_file(safari_format, html_file)
         print(f"已成功将HTML格式书签保存到: {html_file}")
     except Exception as e:
         print(f"保存HTML格式书签时出错: {e}")
@@ -208,8 +555,7 @@ def main():
     
     print("\n步骤3: 读取合并书签文件...")
     try:
-        with open(merged_file, 'r', encoding='utf-8') as f:
-            merged_bookmarks = json.load(f)
+        merged_bookmarks = binary_snapshot.load_bookmarks(merged_file)
     except Exception as e:
         print(f"读取合并书签文件时出错: {e}")
         return
@@ -244,8 +590,7 @@ if __name__ == "__main__":
     
     # 读取合并书签
     try:
-        with open(latest_file, 'r', encoding='utf-8') as f:
-            merged_bookmarks = json.load(f)
+        merged_bookmarks = binary_snapshot.load_bookmarks(latest_file)
         print(f"已读取合并书签文件: {latest_file}")
     except Exception as e:
         print(f"读取合并书签文件时出错: {e}")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import instrumentation
+
+# 步骤的运行结果状态
+STATUS_OK = 'ok'
+STATUS_UNCHANGED = 'unchanged'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'
+
+STATUS_LABELS = {
+    STATUS_OK: '完成',
+    STATUS_UNCHANGED: '未变化，跳过',
+    STATUS_FAILED: '失败',
+    STATUS_SKIPPED: '未执行（依赖失败）',
+}
+
+# 图中的一个步骤：func以各依赖步骤的结果为参数（按deps的顺序）
+# func返回None或False表示失败；skip_if以相同参数调用，返回True时不执行func，结果为None
+class Step:
+    __slots__ = ('name', 'func', 'deps', 'skip_if', 'label')
+
+    def __init__(self, name, func, deps=(), skip_if=None, label=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.skip_if = skip_if
+        self.label = label or name
+
+# 同步步骤组成的有向无环图，互不依赖的步骤在线程池中并发执行
+# 线程适合关闭浏览器（等待子进程）、读写和fsync书签文件这类等待I/O的步骤；
+# 纯Python的解析和合并受GIL限制，并发执行时不会更快，但也不会更慢
+class StepGraph:
+    def __init__(self):
+        self.steps = {}
+        # 每个步骤的(状态, 耗时秒数)，按完成顺序记录
+        self.report = {}
+
+    # 添加步骤，依赖的步骤必须已经添加（因此图中不会有环）
+    def add(self, name, func, deps=(), skip_if=None, label=None):
+        if name in self.steps:
+            raise ValueError(f"步骤重复: {name}")
+        for dep in deps:
+            if dep not in self.steps:
+                raise ValueError(f"步骤 {name} 依赖的步骤不存在: {dep}")
+        self.steps[name] = Step(name, func, deps, skip_if, label)
+
+    # 执行一个步骤，返回(状态, 结果, 耗时)
+    def _run_step(self, step, args):
+        start = time.perf_counter()
+        try:
+            with instrumentation.measure(step.name, 'steps'):
+                if step.skip_if is not None and step.skip_if(*args):
+                    return STATUS_UNCHANGED, None, time.perf_counter() - start
+                result = step.func(*args)
+        except Exception as e:
+            print(f"步骤 {step.label} 出错: {e}")
+            return STATUS_FAILED, None, time.perf_counter() - start
+        status = STATUS_FAILED if result is None or result is False else STATUS_OK
+        return status, result, time.perf_counter() - start
+
+    # 执行所有步骤，max_workers为同时执行的步骤数量（1表示按添加顺序依次执行）
+    # 返回{步骤名称: 结果}，失败、跳过和未执行的步骤结果为None
+    def run(self, max_workers=None):
+        results = {}
+        statuses = {}
+        pending = dict(self.steps)
+        running = {}
+        self.report = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(self.steps) or 1) as executor:
+            while pending or running:
+                # 提交依赖都已完成的步骤；有依赖失败时该步骤不执行
+                for name, step in list(pending.items()):
+                    dep_statuses = [statuses.get(dep) for dep in step.deps]
+                    if any(status is None for status in dep_statuses):
+                        continue
+                    del pending[name]
+                    if any(status in (STATUS_FAILED, STATUS_SKIPPED) for status in dep_statuses):
+                        statuses[name] = STATUS_SKIPPED
+                        results[name] = None
+                        self.report[name] = (STATUS_SKIPPED, 0.0)
+                        continue
+                    args = [results[dep] for dep in step.deps]
+                    running[executor.submit(self._run_step, step, args)] = name
+
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    status, result, elapsed = future.result()
+                    statuses[name] = status
+                    results[name] = result
+                    self.report[name] = (status, elapsed)
+        return results
+
+    # 是否所有步骤都成功（或因输入未变化而跳过）
+    def succeeded(self):
+        return all(status in (STATUS_OK, STATUS_UNCHANGED) for status, _ in self.report.values())
+
+    # 打印每个步骤的状态和耗时
+    def print_report(self, wall_time=None):
+        print("\n步骤耗时:")
+        print("-" * 50)
+        total = 0.0
+        for name, (status, elapsed) in self.report.items():
+            total += elapsed
+            print(f"{self.steps[name].label:<20} {elapsed:8.3f} 秒  {STATUS_LABELS[status]}")
+        print("-" * 50)
+        if wall_time is not None:
+            print(f"各步骤耗时合计: {total:.3f} 秒，实际耗时: {wall_time:.3f} 秒")
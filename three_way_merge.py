@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import pickle
+import hashlib
+
+import source_cache
+import instrumentation
+from chrome_stream_parser import CHROME_META_KEYS
+from node_model import BookmarkTree
+from step1_chrome_bookmarks_viewer_fixed import parse_bookmarks
+from step3_merge_bookmarks import canonicalize_url, folder_path, merge_bookmarks, merge_trees
+
+# 上次同步结果（基线）的保存位置
+BASE_FILE = os.path.join(source_cache.CACHE_DIR, 'base_snapshot.pickle')
+
+# 虚拟根节点的键，顶级书签和文件夹都挂在它下面
+ROOT_KEY = ''
+
+# 计算节点哈希
+def _hash_parts(parts):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+# 书签的键使用规范URL（合并结果已按规范URL去重，因此在两个浏览器之间也唯一）
+def url_key(url):
+    return 'url:' + canonicalize_url(url)
+
+# 计算书签或文件夹在父节点下的键，taken为已经使用的键，parent_of返回已使用的键的父键；
+# 无法跟踪的节点（空URL、重复书签）返回None
+# 文件夹的键是规范化的文件夹路径，书签的键是规范URL。不同Chrome根目录下规范路径相同的文件夹
+# （如书签栏/Work和其他书签/work）返回已有的键，与step3的完整合并一样视为同一个文件夹
+def _item_key(item, parent_key, taken, parent_of):
+    if item['type'] == 'url':
+        url = item.get('url', '')
+        if not url:
+            return None
+        key = url_key(url)
+        return None if key in taken else key
+
+    if item['type'] == 'folder':
+        # 与step3按路径合并文件夹时使用相同的规范路径：忽略大小写和空白，
+        # Chrome根目录文件夹的子项与顶层的Safari书签处在同一层
+        parent_path = parent_key[len('folder:'):] if parent_key != ROOT_KEY else None
+        if parent_path is not None and parent_path.startswith('root:'):
+            parent_path = ''
+        path, _ = folder_path(parent_path, item.get('name', ''))
+        key = 'folder:' + path
+        suffix = 2
+        while key in taken and parent_of(key) == parent_key:
+            # 同一文件夹下的同名文件夹按出现顺序编号
+            key = f"folder:{path}#{suffix}"
+            suffix += 1
+        return key
+
+    return None
+
+# 为书签树建立索引：键 -> 条目，每个条目带有哈希（文件夹为整棵子树的哈希）
+# 同一个书签重复出现时只保留第一次；其他根目录下规范路径相同的文件夹，子项并入第一次出现的文件夹
+@instrumentation.timed('three_way.index_tree')
+def index_tree(bookmarks):
+    entries = {ROOT_KEY: {'type': 'folder', 'name': '', 'parent': None, 'children': []}}
+
+    def parent_of(key):
+        return entries[key]['parent']
+
+    def visit(items, parent_key):
+        parent = entries[parent_key]
+        for item in items:
+            key = _item_key(item, parent_key, entries, parent_of)
+            if key is None:
+                continue
+            if key in entries:
+                visit(item.get('children', []), key)
+                continue
+            name = item.get('name', '')
+            if item['type'] == 'url':
+                url = item['url']
+                entries[key] = {
+                    'type': 'url',
+                    'name': name,
+                    'url': url,
+                    'parent': parent_key,
+                    'hash': _hash_parts(('url', name, url)),
+                }
+            else:
+                entries[key] = {'type': 'folder', 'name': name, 'parent': parent_key, 'children': []}
+                visit(item.get('children', []), key)
+            # Chrome节点的guid等元数据不参与哈希，只在新增节点时带到合并结果中
+            meta = {meta_key: item[meta_key] for meta_key in CHROME_META_KEYS if meta_key in item}
+            if meta:
+                entries[key]['meta'] = meta
+            parent['children'].append(key)
+
+    visit(bookmarks, ROOT_KEY)
+
+    # 文件夹的哈希在建立全部条目之后计算（并入的子项可能在父文件夹之后才出现）：
+    # 条目按插入顺序排列，子项总在父节点之后，逆序计算时子项的哈希已经算好
+    for entry in reversed(entries.values()):
+        if entry['type'] == 'folder':
+            parts = ['folder', entry['name']]
+            for child in entry['children']:
+                parts.append(child)
+                parts.append(entries[child]['hash'])
+            entry['hash'] = _hash_parts(parts)
+    return entries
+
+# 比较基线和当前的书签树，返回变化列表
+# 只进入哈希发生变化的文件夹，未改动的子树直接跳过，因此工作量与改动的数量成正比
+# 变化的格式：
+#   ('add', key, entry, parent_key, index)
+#   ('move', key, entry, parent_key, index)
+#   ('rename', key, name, url)
+#   ('reorder', parent_key, [child_key, ...])
+#   ('remove', key)
+def diff_trees(base, current):
+    changes = []
+    removals = []
+    stack = [ROOT_KEY]
+
+    while stack:
+        key = stack.pop()
+        cur = current[key]
+        old = base.get(key)
+        if old is not None and old['type'] == 'folder' and old.get('hash') == cur['hash']:
+            continue
+
+        old_children = old['children'] if old is not None and old['type'] == 'folder' else []
+        old_set = set(old_children)
+        cur_set = set(cur['children'])
+
+        for index, child in enumerate(cur['children']):
+            entry = current[child]
+            base_entry = base.get(child)
+            if base_entry is None:
+                changes.append(('add', child, entry, key, index))
+            else:
+                if child not in old_set:
+                    changes.append(('move', child, entry, key, index))
+                if entry['hash'] != base_entry.get('hash') and (
+                        entry['name'] != base_entry['name'] or entry.get('url') != base_entry.get('url')):
+                    changes.append(('rename', child, entry['name'], entry.get('url')))
+            if entry['type'] == 'folder' and (base_entry is None or entry['hash'] != base_entry.get('hash')):
+                stack.append(child)
+
+        # 基线中存在、当前已不存在的节点（包括被删除文件夹下的整棵子树）
+        for child in old_children:
+            if child in cur_set or child in current:
+                continue
+            removal_stack = [child]
+            while removal_stack:
+                removed_key = removal_stack.pop()
+                if removed_key in current:
+                    continue
+                removals.append(('remove', removed_key))
+                removed = base[removed_key]
+                if removed['type'] == 'folder':
+                    removal_stack.extend(removed['children'])
+
+        # 共同子项的相对顺序发生变化
+        common_old = [c for c in old_children if c in cur_set]
+        common_cur = [c for c in cur['children'] if c in old_set]
+        if common_old != common_cur:
+            changes.append(('reorder', key, list(cur['children'])))
+
+    # 删除放在最后，先让被移走的节点落到新位置
+    return changes + removals
+
+# 为合并结果建立可修改的索引：nodes(键 -> 书签字典)、parents(键 -> 父键)、child_keys(父键 -> 子键列表)
+# 子键列表与书签字典的children列表一一对应；无法跟踪的节点（空URL、重复书签）会被去掉，
+# 其他根目录下规范路径相同的文件夹（以前的基线中可能存在）并入第一次出现的文件夹
+def build_merged_state(merged_bookmarks):
+    root = {'type': 'folder', 'name': '', 'children': merged_bookmarks}
+    state = {'nodes': {ROOT_KEY: root}, 'parents': {}, 'child_keys': {ROOT_KEY: []}}
+
+    # 把items作为子项依次加入node（键为key）
+    def visit(node, key, items):
+        for child in items:
+            child_key = _item_key(child, key, state['nodes'], state['parents'].get)
+            if child_key is None:
+                continue
+            if child_key in state['nodes']:
+                visit(state['nodes'][child_key], child_key, child.get('children') or [])
+                continue
+            node['children'].append(child)
+            state['nodes'][child_key] = child
+            state['parents'][child_key] = key
+            state['child_keys'][key].append(child_key)
+            if child['type'] == 'folder':
+                state['child_keys'][child_key] = []
+                children = child.get('children') or []
+                child['children'] = []
+                visit(child, child_key, children)
+
+    items = list(merged_bookmarks)
+    merged_bookmarks.clear()
+    visit(root, ROOT_KEY, items)
+    return state
+
+# 新建合并结果中的节点，字段与step3_merge_bookmarks.merge_bookmarks的输出一致
+def _new_node(entry, source, original_path):
+    node = {
+        'type': entry['type'],
+        'name': entry['name'],
+        'path': 'Bookmarks Bar',
+        'depth': 0,
+        'source': source,
+        'original_path': original_path,
+    }
+    if entry['type'] == 'url':
+        node['url'] = entry['url']
+        node['sources'] = [source]
+    else:
+        node['children'] = []
+    node.update(entry.get('meta', {}))
+    return node
+
+# 从父节点的两个子项列表中移除键对应的节点
+def _detach(state, key):
+    parent_key = state['parents'].pop(key)
+    siblings = state['child_keys'][parent_key]
+    index = siblings.index(key)
+    del siblings[index]
+    del state['nodes'][parent_key]['children'][index]
+
+# 把节点插入到父节点的指定位置
+def _attach(state, key, node, parent_key, index):
+    siblings = state['child_keys'][parent_key]
+    index = min(index, len(siblings))
+    siblings.insert(index, key)
+    state['nodes'][parent_key]['children'].insert(index, node)
+    state['parents'][key] = parent_key
+
+# 把一侧浏览器的变化应用到合并结果上，返回各类变化的数量
+def apply_changes(state, changes, source):
+    nodes = state['nodes']
+    counts = {'add': 0, 'move': 0, 'rename': 0, 'reorder': 0, 'remove': 0}
+    removed_folders = []
+
+    for change in changes:
+        kind = change[0]
+        if kind in ('add', 'move'):
+            _, key, entry, parent_key, index = change
+            if parent_key not in nodes:
+                parent_key = ROOT_KEY
+            if key in nodes:
+                if kind == 'add' or state['parents'][key] == parent_key:
+                    # 另一侧已经有这个书签，保持去重
+                    continue
+                node = nodes[key]
+                _detach(state, key)
+            else:
+                original_path = parent_key[len('folder:'):] if parent_key else ('根目录' if source == 'Safari' else '')
+                if original_path.startswith('root:'):
+                    original_path = original_path[len('root:'):]
+                node = _new_node(entry, source, original_path)
+                nodes[key] = node
+                if node['type'] == 'folder':
+                    state['child_keys'][key] = []
+            _attach(state, key, node, parent_key, index)
+        elif kind == 'rename':
+            _, key, name, url = change
+            if key not in nodes:
+                continue
+            nodes[key]['name'] = name
+            if url:
+                nodes[key]['url'] = url
+        elif kind == 'reorder':
+            _, parent_key, ordered = change
+            if parent_key not in nodes:
+                continue
+            _reorder(state, parent_key, ordered)
+        elif kind == 'remove':
+            _, key = change
+            if key not in nodes or key == ROOT_KEY:
+                continue
+            if nodes[key]['type'] == 'folder':
+                removed_folders.append(key)
+                continue
+            _detach(state, key)
+            del nodes[key]
+        counts[kind] += 1
+
+    # 文件夹由深到浅删除；另一侧在其中新增了内容的文件夹保留下来
+    removed_folders.sort(key=lambda k: k.count('/'), reverse=True)
+    for key in removed_folders:
+        if state['child_keys'].get(key):
+            continue
+        _detach(state, key)
+        del nodes[key]
+        del state['child_keys'][key]
+        counts['remove'] += 1
+
+    return counts
+
+# 按给定顺序重排父节点下的子项：给定顺序中出现的子项按该顺序排列，占据它们原来的位置，其余子项位置不变
+def _reorder(state, parent_key, ordered):
+    siblings = state['child_keys'][parent_key]
+    present = set(siblings)
+    wanted = [key for key in ordered if key in present]
+    wanted_set = set(wanted)
+    slots = [i for i, key in enumerate(siblings) if key in wanted_set]
+    children = state['nodes'][parent_key]['children']
+    for slot, key in zip(slots, wanted):
+        siblings[slot] = key
+        children[slot] = state['nodes'][key]
+
+# 同步Chrome的其他配置文件时使用的基线文件，每个配置文件与Safari之间各有一份基线
+def profile_base_file(profile_dir):
+    name = re.sub(r'[^0-9A-Za-z_-]+', '_', profile_dir)
+    return os.path.join(os.path.dirname(BASE_FILE), f'base_snapshot_{name}.pickle')
+
+# 读取上次同步的基线，不存在或损坏时返回None（base_file默认为BASE_FILE）
+def load_base(base_file=None):
+    try:
+        with open(base_file or BASE_FILE, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.PickleError, EOFError, AttributeError, ValueError):
+        return None
+
+# 保存基线：合并结果、两侧浏览器在同步后的书签索引以及对应的文件指纹
+# 合并结果以紧凑的BookmarkTree保存，只是为了让基线文件更小；返回保存的基线（与load_base的结果格式相同）
+@instrumentation.timed('three_way.save_base')
+def save_base(merged_bookmarks, side_entries, fingerprints, base_file=None):
+    base_file = base_file or BASE_FILE
+    os.makedirs(os.path.dirname(base_file), exist_ok=True)
+    base = {
+        'merged': BookmarkTree.from_bookmarks(merged_bookmarks),
+        'sides': side_entries,
+        'fingerprints': fingerprints,
+    }
+    tmp_file = base_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(base, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, base_file)
+    print(f"已保存同步基线: {base_file}")
+    return base
+
+# 把写入Chrome的书签结构转换为下次读取Chrome时会得到的书签列表
+def chrome_format_to_bookmarks(chrome_format):
+    bookmarks = []
+    for root_name in ('bookmark_bar', 'other', 'synced'):
+        root = chrome_format['roots'].get(root_name)
+        if root:
+            bookmarks.extend(parse_bookmarks(root))
+    return bookmarks
+
+# 三方合并：以上次同步的结果为基线，只把Chrome和Safari各自相对基线的变化（新增、删除、改名、移动、排序）
+# 应用到基线上。没有基线时退回到step3的完整合并。
+# fingerprints为{'chrome': 指纹, 'safari': 指纹}，与基线中记录的相同时跳过该侧的差异计算
+# extra_sides为其他Chromium系浏览器[(侧的键, 显示名称, 书签列表)]，与Chrome一样各自与基线比较，
+# 变化按Chrome书签应用（在Safari之前），指纹同样记录在fingerprints中对应的键下；
+# 只同步其他Chromium系浏览器时chrome_bookmarks为None
+# readonly_sides为只读取、不写回的来源[(侧的键, 显示名称, 书签列表)]（如Firefox），同样各自与基线比较，
+# 变化在Safari之后应用，来源标记为显示名称；基线中记录每次读取到的索引
+# 返回(合并后的书签列表, 各侧书签索引)
+@instrumentation.timed('three_way.merge_with_base')
+def merge_with_base(base, chrome_bookmarks, safari_bookmarks, fingerprints=None, extra_sides=None,
+                    readonly_sides=None):
+    fingerprints = fingerprints or {}
+    sides = [('chrome', 'Chrome', 'Chrome', chrome_bookmarks)] if chrome_bookmarks is not None else []
+    sides += [(side, label, 'Chrome', bookmarks) for side, label, bookmarks in extra_sides or ()]
+    sides.append(('safari', 'Safari', 'Safari', safari_bookmarks))
+    sides += [(side, label, label, bookmarks) for side, label, bookmarks in readonly_sides or ()]
+    side_entries = {}
+
+    for side, _, _, bookmarks in sides:
+        if (base is not None and side in base['sides']
+                and not source_cache.fingerprint_changed(base['fingerprints'].get(side), fingerprints.get(side))):
+            # 书签文件没有变化，沿用基线中的索引
+            side_entries[side] = base['sides'][side]
+        else:
+            # 必须在merge_bookmarks修改书签字典之前建立索引
+            side_entries[side] = index_tree(bookmarks)
+
+    if base is None:
+        print("未找到同步基线，执行完整合并")
+        if extra_sides:
+            # 各Chromium系浏览器的书签先按文件夹路径合并为Chrome一侧
+            chrome_bookmarks, _, _ = merge_trees([bookmarks for _, _, source, bookmarks in sides if source == 'Chrome'])
+        extra_sources = [(label, bookmarks) for _, label, bookmarks in readonly_sides or ()]
+        return merge_bookmarks(chrome_bookmarks, safari_bookmarks, extra_sources), side_entries
+
+    # 合并和转换仍然使用字典结构的书签树，基线中紧凑保存的合并结果每次都先展开
+    merged = base['merged']
+    if isinstance(merged, BookmarkTree):
+        merged = merged.to_bookmarks()
+    state = build_merged_state(merged)
+    for side, label, source, _ in sides:
+        if side_entries[side] is base['sides'].get(side):
+            print(f"{label}书签自上次同步以来没有变化，跳过差异计算")
+            continue
+        changes = diff_trees(base['sides'].get(side) or index_tree([]), side_entries[side])
+        counts = apply_changes(state, changes, source)
+        for kind, value in counts.items():
+            instrumentation.count(f"three_way.{side}.{kind}", value)
+        print(f"{label}相对基线的变化: 新增 {counts['add']}，删除 {counts['remove']}，"
+              f"改名 {counts['rename']}，移动 {counts['move']}，重新排序 {counts['reorder']}")
+
+    # 本次没有参与同步的浏览器保留基线中的索引，之后再参与同步时只比较它自己在此期间的变化，
+    # 不会把在其他浏览器中删除的书签重新加回来
+    for side, entries in base['sides'].items():
+        side_entries.setdefault(side, entries)
+    return state['nodes'][ROOT_KEY]['children'], side_entries